@@ -0,0 +1,266 @@
+"""
+SISTEMA ARPC - BENCHMARK DE RENDIMIENTO
+Genera exportaciones SAP sintéticas y mide lectura, clasificación, tablas dinámicas y exportación
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from main import (LectorSAP, ClasificadorVectorizado, GestorDocumentos,
+                  GeneradorTablasDinamicas, ProcesadorARPC, EscritorPorBloques, MetricasProceso)
+
+# ==================== GENERADOR DE EXPORTACIONES SINTÉTICAS ====================
+class GeneradorSAPSintetico:
+    SECTORISTAS = [
+        "ANA TORRES", "LUIS QUISPE", "PEDRO GOMEZ", "MARIA FLORES", "JORGE RAMOS",
+        "ROSA HUAMAN", "CARLOS VEGA", "LUCIA MENDOZA", "DIEGO CASTRO", "SOFIA ROJAS",
+        "MIGUEL CHAVEZ", "PAOLA DIAZ", "RAUL SANCHEZ", "ELENA RIOS", "VICTOR PAREDES"
+    ]
+    CODIGOS_CD = ['DR', 'DL', 'DZ', 'AB', 'DA']
+    PROBABILIDAD_CD = [0.68, 0.20, 0.05, 0.04, 0.03]
+    PROPORCION_TOTALES = 0.03  # filas de totales SAP (sin CD ni sectorista)
+
+    def __init__(self, mes_reporte: datetime, semilla: int = 2025):
+        self.mes_reporte = mes_reporte
+        self.semilla = semilla
+
+    def generar(self, filas: int) -> pd.DataFrame:
+        rng = np.random.default_rng(self.semilla)
+
+        cd = rng.choice(self.CODIGOS_CD, size=filas, p=self.PROBABILIDAD_CD).astype(object)
+        # Mora: mayoría por vencer o poco vencida, cola larga hasta dos años
+        mora = np.where(rng.random(filas) < 0.35,
+                        rng.integers(-60, 1, filas),
+                        rng.gamma(1.2, 60, filas).astype(np.int64) + 1)
+        sectorista = rng.choice(self.SECTORISTAS, size=filas).astype(object)
+        monto = np.round(rng.lognormal(7.5, 1.4, filas), 2)
+
+        vencimiento = np.datetime64(self.mes_reporte.date()) - mora.astype('timedelta64[D]')
+        base_plazo = vencimiento - rng.integers(0, 40, filas).astype('timedelta64[D]')
+        es_dl = cd == 'DL'
+        ref_letra = np.where(es_dl & (rng.random(filas) < 0.9),
+                             np.char.add("L", rng.integers(100000, 999999, filas).astype(str)),
+                             None).astype(object)
+
+        df = pd.DataFrame({
+            'Cuenta': rng.integers(1000000, 1999999, filas),
+            'Nº documento': rng.integers(1500000000, 1599999999, filas),
+            'CD': cd,
+            'Mora': mora,
+            'Sectorista': sectorista,
+            'Imp. ML2 Pend.': monto,
+            'Moneda': rng.choice(['PEN', 'USD'], size=filas, p=[0.7, 0.3]),
+            'Vencimiento neto': pd.to_datetime(vencimiento).strftime("%d/%m/%Y"),
+            'Base p.plazo pago': pd.to_datetime(base_plazo).strftime("%d/%m/%Y"),
+            'Ref. Letra': ref_letra,
+            'Clv.ref.(cabecera) 2': np.char.add("R", rng.integers(10000, 99999, filas).astype(str)),
+            'Texto': "FACTURA SERVICIO",
+        })
+
+        # Filas de totales SAP: sin CD, sin sectorista y con el subtotal en el monto
+        totales = rng.random(filas) < self.PROPORCION_TOTALES
+        df.loc[totales, ['CD', 'Sectorista', 'Ref. Letra', 'Vencimiento neto',
+                         'Base p.plazo pago', 'Mora']] = None
+        df.loc[totales, 'Imp. ML2 Pend.'] = np.round(monto[totales] * 25, 2)
+        return df
+
+    def escribir(self, filas: int, ruta: str) -> str:
+        df = self.generar(filas)
+        extension = os.path.splitext(ruta)[1].lower()
+        if extension == '.csv':
+            df.to_csv(ruta, index=False)
+        elif extension == '.parquet':
+            df.to_parquet(ruta, index=False)
+        else:
+            if filas > EscritorPorBloques.MAX_FILAS_HOJA:
+                raise ValueError("Excel admite como máximo 1,048,575 filas: use .csv o .parquet")
+            df.to_excel(ruta, index=False, engine=EscritorPorBloques.motor_excel())
+        return ruta
+
+# ==================== BENCHMARK ====================
+class BenchmarkARPC:
+    ETAPAS = ['lectura', 'clasificacion', 'tablas', 'exportacion']
+
+    def __init__(self, mes_reporte: datetime, formato: str = 'xlsx', directorio: Optional[str] = None):
+        self.mes_reporte = mes_reporte
+        self.formato = formato
+        self.directorio = directorio or tempfile.mkdtemp(prefix="arpc_bench_")
+        os.makedirs(self.directorio, exist_ok=True)
+        self.generador = GeneradorSAPSintetico(mes_reporte)
+
+    @staticmethod
+    def medir_arranque(repeticiones: int = 3) -> Dict:
+        # `import main` en un proceso nuevo: el menú y la CLI no deben cargar pandas al iniciar
+        codigo = ("import sys, time; t = time.perf_counter(); import main; "
+                  "print(time.perf_counter() - t, 'pandas' in sys.modules)")
+        tiempos, pandas_cargado = [], False
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+            tiempos.append(float(salida[0]))
+            pandas_cargado = pandas_cargado or salida[1] == "True"
+        return {'segundos': round(min(tiempos), 4), 'pandas_cargado': pandas_cargado}
+    
+    @staticmethod
+    def _medir(metricas: MetricasProceso, nombre: str, filas: int, funcion):
+        with metricas.etapa(nombre, filas):
+            return funcion()
+
+    def ejecutar_tamaño(self, filas: int) -> Dict:
+        formato = self.formato
+        if formato == 'xlsx' and filas > EscritorPorBloques.MAX_FILAS_HOJA:
+            formato = 'csv'
+        ruta = os.path.join(self.directorio, f"sap_sintetico_{filas}.{formato}")
+        if not os.path.exists(ruta):
+            self.generador.escribir(filas, ruta)
+
+        metricas = MetricasProceso()
+        df = self._medir(metricas, 'lectura', filas, lambda: LectorSAP().leer(ruta))
+
+        gestor = GestorDocumentos()
+
+        def clasificar():
+            mascara = df['CD'].isin(['DR', 'DL']).to_numpy()
+            df_filtrado = df[mascara]
+            clasificacion = ClasificadorVectorizado(self.mes_reporte).clasificar(df_filtrado)
+            gestor.agregar_clasificados(df, np.flatnonzero(mascara), clasificacion, self.mes_reporte)
+        self._medir(metricas, 'clasificacion', filas, clasificar)
+
+        generador = GeneradorTablasDinamicas(gestor)
+        self._medir(metricas, 'tablas', filas, generador.generar_tablas)
+
+        procesador = ProcesadorARPC(usar_cache=False)
+        procesador.gestor, procesador.generador_tablas = gestor, generador
+        procesador.mes_reporte, procesador.total_registros = self.mes_reporte, len(df)
+        procesador.total_columnas = len(df.columns)
+        salida = os.path.join(self.directorio, f"reporte_{filas}.xlsx")
+        with open(os.devnull, 'w') as nulo:
+            stdout, sys.stdout = sys.stdout, nulo
+            try:
+                self._medir(metricas, 'exportacion', filas, lambda: procesador.exportar_a(salida))
+            finally:
+                sys.stdout = stdout
+
+        etapas = metricas.a_diccionario()['etapas']
+        return {
+            'filas': filas,
+            'formato_entrada': formato,
+            'documentos': len(gestor),
+            'segundos_total': round(sum(e['segundos'] for e in etapas.values()), 4),
+            'rss_pico_mb': max(e['rss_pico_mb'] for e in etapas.values()),
+            'etapas': etapas
+        }
+
+    def ejecutar(self, tamaños: List[int]) -> Dict:
+        arranque = self.medir_arranque()
+        print(f"   ⏱️  Arranque: {arranque['segundos']:.3f} s"
+              + (" (pandas importado al iniciar)" if arranque['pandas_cargado'] else ""))
+        resultados = []
+        for filas in tamaños:
+            print(f"   ⏱️  {filas:,} filas...")
+            resultado = self.ejecutar_tamaño(filas)
+            print(f"      total {resultado['segundos_total']:.2f} s | pico {resultado['rss_pico_mb']:.0f} MB | "
+                  + " | ".join(f"{n} {e['segundos']:.2f} s" for n, e in resultado['etapas'].items()))
+            resultados.append(resultado)
+        return {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'entorno': {
+                'python': platform.python_version(), 'pandas': pd.__version__,
+                'numpy': np.__version__, 'plataforma': platform.platform(),
+                'motor_lectura': LectorSAP.motor_excel(), 'motor_escritura': EscritorPorBloques.motor_excel()
+            },
+            'mes_reporte': self.mes_reporte.strftime("%Y-%m"),
+            'arranque': arranque,
+            'resultados': resultados
+        }
+
+# ==================== COMPARACIÓN ENTRE EJECUCIONES ====================
+def comparar(actual: Dict, anterior: Dict, tolerancia: float = 0.10, minimo: float = 0.05) -> List[str]:
+    # Devuelve las regresiones entre dos ejecuciones: etapas más lentas que la tolerancia
+    # relativa y por más de `minimo` segundos (evita ruido en etapas muy cortas)
+    regresiones = []
+    arranque, arranque_previo = actual.get('arranque'), anterior.get('arranque')
+    if arranque and arranque['pandas_cargado']:
+        regresiones.append("arranque: pandas se importa al cargar main")
+    if arranque and arranque_previo and arranque_previo['segundos']:
+        cambio = arranque['segundos'] / arranque_previo['segundos'] - 1
+        print(f"\n   Arranque: {arranque_previo['segundos']:.3f}s → {arranque['segundos']:.3f}s ({cambio:+.1%})")
+        if cambio > tolerancia and arranque['segundos'] - arranque_previo['segundos'] > minimo:
+            regresiones.append(f"arranque: {cambio:+.1%}")
+    previos = {r['filas']: r for r in anterior.get('resultados', [])}
+    print(f"\n   {'FILAS':>10} {'ETAPA':<14} {'ANTES':>9} {'AHORA':>9} {'CAMBIO':>8}")
+    for resultado in actual['resultados']:
+        previo = previos.get(resultado['filas'])
+        if previo is None:
+            continue
+        for etapa, medida in resultado['etapas'].items():
+            antes = previo['etapas'].get(etapa, {}).get('segundos')
+            if not antes:
+                continue
+            cambio = medida['segundos'] / antes - 1
+            regresion = cambio > tolerancia and medida['segundos'] - antes > minimo
+            marca = "  ⚠️" if regresion else ""
+            print(f"   {resultado['filas']:>10,} {etapa:<14} {antes:>8.3f}s {medida['segundos']:>8.3f}s "
+                  f"{cambio:>+7.1%}{marca}")
+            if regresion:
+                regresiones.append(f"{resultado['filas']} filas / {etapa}: {cambio:+.1%}")
+    return regresiones
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del sistema ARPC")
+    parser.add_argument("--tamanos", default="10000,100000",
+                        help="Filas separadas por coma (10000 a 5000000)")
+    parser.add_argument("--formato", choices=['xlsx', 'csv', 'parquet'], default='xlsx',
+                        help="Formato del archivo sintético de entrada")
+    parser.add_argument("--mes", default=None, help="Mes del reporte AAAA-MM")
+    parser.add_argument("--directorio", default=None, help="Directorio de trabajo (archivos sintéticos)")
+    parser.add_argument("--salida", default="benchmark_arpc.json", help="Resultados JSON")
+    parser.add_argument("--comparar", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.10,
+                        help="Regresión permitida por etapa (0.10 = 10%%)")
+    parser.add_argument("--minimo", type=float, default=0.05,
+                        help="Diferencia mínima en segundos para considerar una regresión")
+    parser.add_argument("--generar", default=None,
+                        help="Solo generar un archivo sintético en esta ruta (usa el primer tamaño)")
+    args = parser.parse_args(argv)
+
+    tamaños = [int(t) for t in args.tamanos.split(",") if t.strip()]
+    hoy = datetime.now()
+    mes_reporte = datetime.strptime(args.mes, "%Y-%m") if args.mes else datetime(hoy.year, hoy.month, 1)
+
+    if args.generar:
+        GeneradorSAPSintetico(mes_reporte).escribir(tamaños[0], args.generar)
+        print(f"   ✅ {tamaños[0]:,} filas sintéticas en {args.generar}")
+        return 0
+
+    print("\n" + "="*60)
+    print("   BENCHMARK SISTEMA ARPC")
+    print("="*60)
+    resultados = BenchmarkARPC(mes_reporte, args.formato, args.directorio).ejecutar(tamaños)
+    with open(args.salida, 'w', encoding='utf-8') as archivo:
+        json.dump(resultados, archivo, ensure_ascii=False, indent=2)
+    print(f"\n   ✅ Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, json.load(archivo), args.tolerancia, args.minimo)
+        if regresiones:
+            print(f"\n   ❌ {len(regresiones)} regresiones sobre la tolerancia de {args.tolerancia:.0%}")
+            return 1
+        print("\n   ✅ Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,15 +3,50 @@ SISTEMA ARPC - AUTOMATIZACIÓN DEL REPORTE DE PROYECCIONES DE COBRANZAS
 UNIVERSIDAD PERUANA DE CIENCIAS APLICADAS - FUNDAMENTOS DE PROGRAMACIÓN 2
 """
 
+from __future__ import annotations
+
 import os
-import pandas as pd
-import tkinter as tk
-from tkinter import filedialog
-from datetime import datetime
+import io
+import contextlib
+import glob
+import argparse
+import json
+import hashlib
+import calendar
+import time
+import threading
+import signal
+import tempfile
+import uuid
+import cProfile
+import sqlite3
+import importlib
+import importlib.util
+from datetime import datetime, timedelta
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Dict, Optional, Tuple, Iterator
 import sys
 
+# ==================== IMPORTACIONES DIFERIDAS ====================
+# numpy, pandas y asyncio se importan en su primer uso: el menú y la ayuda de la CLI
+# aparecen sin cargarlos (openpyxl, xlsxwriter y tkinter se importan en la etapa que los usa)
+class _ModuloDiferido:
+    def __init__(self, nombre: str, alias: str):
+        self._nombre = nombre
+        self._alias = alias
+    
+    def __getattr__(self, atributo: str):
+        modulo = importlib.import_module(self._nombre)
+        globals()[self._alias] = modulo  # los accesos siguientes van directo al módulo
+        return getattr(modulo, atributo)
+
+np = _ModuloDiferido("numpy", "np")
+pd = _ModuloDiferido("pandas", "pd")
+asyncio = _ModuloDiferido("asyncio", "asyncio")
+
 # ==================== EXCEPCIONES PERSONALIZADAS ====================
 class ErrorProcesamiento(Exception):
     pass
@@ -19,6 +54,12 @@ class ErrorProcesamiento(Exception):
 class ErrorArchivoSAP(ErrorProcesamiento):
     pass
 
+class ErrorReglas(ErrorProcesamiento):
+    pass
+
+class ErrorTiposCambio(ErrorProcesamiento):
+    pass
+
 # ==================== INTERFACES ====================
 class IProcesable(ABC):
     @abstractmethod
@@ -30,6 +71,420 @@ class IExportable(ABC):
     def a_diccionario(self) -> Dict:
         pass
 
+# ==================== CONVERSIÓN DE VALORES ====================
+def _convertir_valor(valor, tipo=str, default=None):
+    # tipo=None conserva el valor leído (p. ej. fechas ya tipadas por LectorSAP)
+    try:
+        if pd.isna(valor):
+            return default
+        if valor == "":
+            return default
+        return valor if tipo is None else tipo(valor)
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+# ==================== CALENDARIO DEL MES DE REPORTE ====================
+# Límites reales de las semanas del mes de reporte, calculados una vez por ejecución como
+# puntos de corte (primer día de cada semana a partir de la segunda); los días se ubican
+# en su semana con searchsorted
+class CalendarioMes:
+    ETIQUETAS = tuple(f"SEMANA_{i}" for i in range(1, 7))
+    DIAS_SEMANA = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+    
+    def __init__(self, mes_reporte: datetime, inicio_semana: Optional[int] = None):
+        # inicio_semana: 0 = lunes ... 6 = domingo; None = cinco bloques fijos de 7 días desde
+        # el día 1 (1-7, 8-14, 15-21, 22-28, 29+) en todos los meses, también en febrero
+        self.mes_reporte = datetime(mes_reporte.year, mes_reporte.month, 1)
+        self.inicio_semana = inicio_semana
+        self.dias = calendar.monthrange(mes_reporte.year, mes_reporte.month)[1]
+        self.primer_dia = self.mes_reporte.weekday()
+        if inicio_semana is None:
+            cortes = [8, 15, 22, 29]
+        else:
+            cortes = [dia for dia in range(2, self.dias + 1)
+                      if (self.primer_dia + dia - 1) % 7 == inicio_semana]
+        self.cortes = np.array(cortes, dtype=np.int64)
+        self.semanas = len(self.cortes) + 1
+        self.etiquetas = np.array(self.ETIQUETAS[:self.semanas], dtype=object)
+    
+    def semana(self, dias, siguiente: bool = False):
+        # Días posteriores al fin de mes (fechas de otros meses) quedan en la última semana
+        indice = np.searchsorted(self.cortes, dias, side='right') + (1 if siguiente else 0)
+        return self.etiquetas[np.minimum(indice, self.semanas - 1)]
+    
+    def rangos(self) -> List[Tuple[int, int]]:
+        inicios = [1] + [int(c) for c in self.cortes]
+        fines = [int(c) - 1 for c in self.cortes] + [self.dias]
+        return list(zip(inicios, fines))
+    
+    def firma(self) -> str:
+        return f"{self.mes_reporte:%Y%m}_{'-'.join(str(c) for c in self.cortes)}"
+    
+    def descripcion(self) -> str:
+        mes_nombre = self.mes_reporte.strftime("%B %Y").upper()
+        return f"{mes_nombre} ({self.dias} días, inicia {self.DIAS_SEMANA[self.primer_dia].capitalize()})"
+
+# ==================== RESOLUCIÓN DE FECHAS ====================
+# Las exportaciones tienen pocos cientos de fechas distintas: cada una se interpreta una sola
+# vez y su semana (según el calendario del mes) se obtiene para todas a la vez y se aplica a
+# columnas completas. Las fechas que no se pueden interpretar se cuentan por columna
+class ResolutorFechas:
+    FORMATO_FECHA = "%d/%m/%Y"
+    COLUMNA_VENCIMIENTO = 'Vencimiento neto'
+    COLUMNA_BASE = 'Base p.plazo pago'
+    DIAS_BASE_DL = 8  # Lógica DL: base de plazo + 8 días
+    MAX_EJEMPLOS = 3
+    
+    def __init__(self, calendario: Optional[CalendarioMes] = None):
+        # calendario solo es necesario para resolver semanas (no para parsear)
+        self.calendario = calendario
+        self._textos: Dict[str, Optional[datetime]] = {}
+        self._semanas_vencimiento: Dict = {}
+        self._semanas_base: Dict = {}
+        self.reiniciar_conteo()
+    
+    def reiniciar_conteo(self):
+        self.fallidas: Dict[str, int] = {}
+        self.ejemplos: Dict[str, List[str]] = {}
+    
+    def _registrar_fallida(self, columna: str, valor, filas: int = 1):
+        self.fallidas[columna] = self.fallidas.get(columna, 0) + filas
+        ejemplos = self.ejemplos.setdefault(columna, [])
+        if len(ejemplos) < self.MAX_EJEMPLOS and str(valor) not in ejemplos:
+            ejemplos.append(str(valor))
+    
+    def fecha(self, valor) -> Tuple[Optional[datetime], bool]:
+        # (fecha, fallida): vacío → (None, False); texto o tipo no interpretable → (None, True)
+        valor = _convertir_valor(valor, None, None)
+        if valor is None:
+            return None, False
+        if isinstance(valor, datetime):
+            return valor, False
+        if not isinstance(valor, str):
+            return None, True
+        if valor not in self._textos:
+            try:
+                self._textos[valor] = datetime.strptime(valor, self.FORMATO_FECHA)
+            except ValueError:
+                self._textos[valor] = None
+        fecha = self._textos[valor]
+        return fecha, fecha is None
+    
+    # ---------- Documento a documento (DocumentoSAP) ----------
+    def semana_vencimiento(self, valor) -> str:
+        # DR por vencer: semana siguiente a la del día de vencimiento
+        fecha, fallida = self.fecha(valor)
+        if fallida:
+            self._registrar_fallida(self.COLUMNA_VENCIMIENTO, valor)
+        if fecha is None:
+            return "POR VENCER"
+        if fecha not in self._semanas_vencimiento:
+            self._semanas_vencimiento[fecha] = self.calendario.semana(fecha.day, siguiente=True)
+        return self._semanas_vencimiento[fecha]
+    
+    def semana_base(self, valor, desplazamiento: int = DIAS_BASE_DL) -> str:
+        fecha, fallida = self.fecha(valor)
+        if fallida:
+            self._registrar_fallida(self.COLUMNA_BASE, valor)
+        if fecha is None:
+            return "SEMANA_1"
+        if (fecha, desplazamiento) not in self._semanas_base:
+            dia = (fecha + timedelta(days=desplazamiento)).day
+            self._semanas_base[(fecha, desplazamiento)] = self.calendario.semana(dia)
+        return self._semanas_base[(fecha, desplazamiento)]
+    
+    # ---------- Columnas completas ----------
+    def _resolver_columna(self, serie: pd.Series, columna: str) -> Tuple[np.ndarray, list]:
+        # Interpreta cada valor distinto una vez. Devuelve el código de cada fila y la fecha
+        # de cada valor distinto (None si está vacío o no se pudo interpretar)
+        codigos, unicos = pd.factorize(serie)
+        fechas = []
+        fallidas = np.zeros(len(unicos), dtype=bool)
+        for i, valor in enumerate(unicos):
+            fecha, fallidas[i] = self.fecha(valor)
+            fechas.append(fecha)
+        if fallidas.any():
+            filas = np.bincount(codigos[codigos >= 0], minlength=len(unicos))
+            for i in np.flatnonzero(fallidas):
+                self._registrar_fallida(columna, unicos[i], int(filas[i]))
+        return codigos, fechas
+    
+    def parsear(self, serie: pd.Series, columna: str) -> pd.Series:
+        # Lo que no se pueda interpretar como fecha queda NaT (y se cuenta)
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return serie
+        codigos, fechas = self._resolver_columna(serie, columna)
+        tabla = pd.DatetimeIndex([pd.NaT if f is None else f for f in fechas] + [pd.NaT])
+        return pd.Series(tabla.take(codigos), index=serie.index, name=serie.name)
+    
+    def _semanas(self, df: pd.DataFrame, columna: str, desplazamiento: int,
+                 siguiente: bool, vacio: str) -> np.ndarray:
+        if columna not in df.columns:
+            return np.full(len(df), vacio, dtype=object)
+        codigos, fechas = self._resolver_columna(df[columna], columna)
+        # Tabla de búsqueda: día de cada fecha distinta → semana, en una sola búsqueda
+        dias = np.array([0 if f is None else (f + timedelta(days=desplazamiento)).day for f in fechas] + [0])
+        tabla = np.where(dias > 0, self.calendario.semana(dias, siguiente), vacio)
+        return tabla[codigos]
+    
+    def semanas_vencimiento(self, df: pd.DataFrame) -> np.ndarray:
+        return self._semanas(df, self.COLUMNA_VENCIMIENTO, 0, True, "POR VENCER")
+    
+    def semanas_base(self, df: pd.DataFrame, desplazamiento: int = DIAS_BASE_DL) -> np.ndarray:
+        return self._semanas(df, self.COLUMNA_BASE, desplazamiento, False, "SEMANA_1")
+    
+    def describir_fallidas(self) -> List[str]:
+        return [f"{filas:,} fechas no interpretables en '{columna}' (p. ej. {', '.join(self.ejemplos[columna])})"
+                for columna, filas in self.fallidas.items()]
+
+# ==================== REGLAS DE CLASIFICACIÓN ====================
+# Tramos, estatus y semanas por días de mora declarados como tablas de rangos (JSON/YAML),
+# validadas al cargarse y compiladas a puntos de corte: clasificar es un solo searchsorted
+class TablaRangos:
+    # Rangos enteros [desde, hasta] contiguos; desde/hasta nulos = sin límite
+    def __init__(self, nombre: str, rangos: List[Dict]):
+        self.nombre = nombre
+        self.rangos = sorted(rangos, key=lambda r: -np.inf if r.get('desde') is None else r['desde'])
+        self._validar()
+        self.limites = np.array([r['hasta'] for r in self.rangos[:-1]], dtype=np.int64)
+        self.etiquetas = np.array([r['etiqueta'] for r in self.rangos], dtype=object)
+    
+    def _validar(self):
+        if not self.rangos:
+            raise ErrorReglas(f"'{self.nombre}': la tabla no tiene rangos")
+        for rango in self.rangos:
+            if not rango.get('etiqueta'):
+                raise ErrorReglas(f"'{self.nombre}': rango sin etiqueta {rango}")
+            desde, hasta = rango.get('desde'), rango.get('hasta')
+            if desde is not None and hasta is not None and desde > hasta:
+                raise ErrorReglas(f"'{self.nombre}': rango invertido {desde} a {hasta}")
+        if self.rangos[0].get('desde') is not None:
+            raise ErrorReglas(f"'{self.nombre}': hueco antes de {self.rangos[0]['desde']} "
+                              f"(el primer rango debe empezar sin límite)")
+        if self.rangos[-1].get('hasta') is not None:
+            raise ErrorReglas(f"'{self.nombre}': hueco después de {self.rangos[-1]['hasta']} "
+                              f"(el último rango debe terminar sin límite)")
+        for anterior, siguiente in zip(self.rangos, self.rangos[1:]):
+            hasta, desde = anterior.get('hasta'), siguiente.get('desde')
+            if hasta is None or desde is None or desde <= hasta:
+                raise ErrorReglas(f"'{self.nombre}': '{anterior['etiqueta']}' y '{siguiente['etiqueta']}' "
+                                  f"se superponen")
+            if desde > hasta + 1:
+                raise ErrorReglas(f"'{self.nombre}': hueco entre {hasta} y {desde} "
+                                  f"('{anterior['etiqueta']}' / '{siguiente['etiqueta']}')")
+    
+    def clasificar(self, valores):
+        # Funciona con un entero (DocumentoSAP) o con un arreglo (ClasificadorVectorizado)
+        return self.etiquetas[np.searchsorted(self.limites, valores, side='left')]
+
+
+class ConjuntoReglas:
+    def __init__(self, nombre: str, config: Dict):
+        self.nombre = nombre
+        self.tramos = TablaRangos(f"{nombre}.tramos", config['tramos'])
+        self.estatus = TablaRangos(f"{nombre}.estatus", config['estatus'])
+        self.semanas_mora = TablaRangos(f"{nombre}.semanas_mora", config['semanas_mora'])
+        self.dias_base_dl = int(config['dias_base_dl'])
+        if "PROYECTADO" not in set(self.estatus.etiquetas):
+            raise ErrorReglas(f"'{nombre}.estatus': falta el estatus PROYECTADO (base de las tablas dinámicas)")
+        invalidas = set(self.semanas_mora.etiquetas) - set(CalendarioMes.ETIQUETAS)
+        if invalidas:
+            raise ErrorReglas(f"'{nombre}.semanas_mora': etiquetas no válidas {sorted(invalidas)}")
+
+
+class ReglasClasificacion:
+    # Reglas vigentes; cada unidad de negocio hereda de "por_defecto" las tablas que no declara
+    POR_DEFECTO = {
+        'tramos': [
+            {'hasta': 0, 'etiqueta': "Por Vencer"},
+            {'desde': 1, 'hasta': 30, 'etiqueta': "1 a 30"},
+            {'desde': 31, 'hasta': 60, 'etiqueta': "31 a 60"},
+            {'desde': 61, 'hasta': 90, 'etiqueta': "61 a 90"},
+            {'desde': 91, 'hasta': 120, 'etiqueta': "91 a 120"},
+            {'desde': 121, 'hasta': 180, 'etiqueta': "121 a 180"},
+            {'desde': 181, 'hasta': 360, 'etiqueta': "181 a 360"},
+            {'desde': 361, 'etiqueta': "360+"}
+        ],
+        'estatus': [
+            {'hasta': 0, 'etiqueta': "POR VENCER"},
+            {'desde': 1, 'hasta': 60, 'etiqueta': "PROYECTADO"},
+            {'desde': 61, 'etiqueta': "EN GESTIÓN"}
+        ],
+        # Solo para documentos vencidos (mora > 0); los por vencer usan la fecha de vencimiento
+        'semanas_mora': [
+            {'hasta': 7, 'etiqueta': "SEMANA_1"},
+            {'desde': 8, 'hasta': 14, 'etiqueta': "SEMANA_2"},
+            {'desde': 15, 'hasta': 21, 'etiqueta': "SEMANA_3"},
+            {'desde': 22, 'hasta': 28, 'etiqueta': "SEMANA_4"},
+            {'desde': 29, 'etiqueta': "SEMANA_5"}
+        ],
+        'dias_base_dl': 8
+    }
+    UNIDAD_DEFECTO = 'por_defecto'
+    
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.config = config
+        self.columna_unidad = config.get('columna_unidad')
+        base = dict(self.POR_DEFECTO, **config.get(self.UNIDAD_DEFECTO, {}))
+        self.conjuntos: Dict[str, ConjuntoReglas] = {self.UNIDAD_DEFECTO: ConjuntoReglas(self.UNIDAD_DEFECTO, base)}
+        for unidad, reglas in config.get('unidades', {}).items():
+            self.conjuntos[str(unidad)] = ConjuntoReglas(str(unidad), dict(base, **reglas))
+        if len(self.conjuntos) > 1 and not self.columna_unidad:
+            raise ErrorReglas("Hay reglas por unidad de negocio pero falta 'columna_unidad'")
+    
+    @classmethod
+    def cargar(cls, ruta: str) -> 'ReglasClasificacion':
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                if os.path.splitext(ruta)[1].lower() in ('.yaml', '.yml'):
+                    if importlib.util.find_spec("yaml") is None:
+                        raise ErrorReglas("Para reglas en YAML instale PyYAML (pip install pyyaml)")
+                    import yaml
+                    config = yaml.safe_load(archivo)
+                else:
+                    config = json.load(archivo)
+        except (OSError, ValueError) as e:
+            raise ErrorReglas(f"No se pudieron leer las reglas {ruta}: {e}")
+        if not isinstance(config, dict):
+            raise ErrorReglas(f"Reglas inválidas en {ruta}: se esperaba un objeto")
+        return cls(config)
+    
+    def firma(self) -> str:
+        return hashlib.md5(json.dumps(self.config, sort_keys=True, default=str).encode()).hexdigest()[:8]
+    
+    def conjunto(self, unidad=None) -> ConjuntoReglas:
+        return self.conjuntos.get(str(unidad), self.conjuntos[self.UNIDAD_DEFECTO])
+    
+    def particionar(self, df: pd.DataFrame) -> Iterator[Tuple[ConjuntoReglas, Optional[np.ndarray]]]:
+        # (reglas, máscara de filas); máscara None = todas las filas con las reglas por defecto
+        if len(self.conjuntos) == 1 or self.columna_unidad not in df.columns:
+            yield self.conjuntos[self.UNIDAD_DEFECTO], None
+            return
+        codigos, unicos = pd.factorize(df[self.columna_unidad])
+        nombres = np.array([self.conjunto(u).nombre for u in unicos] + [self.UNIDAD_DEFECTO], dtype=object)
+        unidades = nombres[codigos]
+        for nombre in pd.unique(unidades):
+            yield self.conjuntos[nombre], unidades == nombre
+
+# ==================== TIPOS DE CAMBIO ====================
+# Tabla de tasas por moneda y fecha de vigencia (unidades de la moneda de reporte por unidad
+# de la moneda del documento), cargada una vez por ejecución. La conversión es una unión
+# "as of" por moneda sobre columnas completas (la última tasa con FECHA <= la fecha pedida),
+# sin búsquedas por fila. Sin tabla los montos se suman sin convertir, como antes
+class TiposCambio:
+    COLUMNA_MONEDA = 'Moneda'
+    MONEDA_REPORTE = 'USD'
+    EXTENSIONES_EXCEL = ('.xlsx', '.xlsm', '.xls')
+    
+    def __init__(self, tasas: Optional[pd.DataFrame] = None, moneda_reporte: Optional[str] = None):
+        # tasas: MONEDA, FECHA, TASA; moneda_reporte=None sin tabla: montos sin convertir ("$")
+        if tasas is None:
+            tasas = pd.DataFrame({'MONEDA': [], 'FECHA': pd.to_datetime([]), 'TASA': []})
+        self.tasas = tasas.sort_values(['MONEDA', 'FECHA'], ignore_index=True)
+        self.moneda_reporte = moneda_reporte.strip().upper() if moneda_reporte else None
+        self._por_moneda = {
+            moneda: (grupo['FECHA'].to_numpy(dtype='datetime64[ns]'), grupo['TASA'].to_numpy(dtype=np.float64))
+            for moneda, grupo in self.tasas.groupby('MONEDA', sort=False)
+        }
+    
+    @property
+    def activa(self) -> bool:
+        return len(self.tasas) > 0
+    
+    @classmethod
+    def cargar(cls, ruta: str, moneda_reporte: Optional[str] = None) -> 'TiposCambio':
+        # CSV (, ; tabulador o |) o Excel con columnas moneda, fecha (DD/MM/AAAA o AAAA-MM-DD) y tasa
+        try:
+            if ruta.lower().endswith(cls.EXTENSIONES_EXCEL):
+                df = pd.read_excel(ruta)
+            else:
+                with open(ruta, encoding='utf-8', errors='ignore') as archivo:
+                    separador = LectorSAP._detectar_separador(archivo.readline())
+                df = pd.read_csv(ruta, sep=separador, dtype=str)
+        except (OSError, ValueError) as e:
+            raise ErrorTiposCambio(f"No se pudo leer la tabla de tipos de cambio {ruta}: {e}")
+        columnas = {str(c).strip().lower(): c for c in df.columns}
+        faltantes = [c for c in ('moneda', 'fecha', 'tasa') if c not in columnas]
+        if faltantes:
+            raise ErrorTiposCambio(f"Faltan columnas en {ruta}: {', '.join(faltantes)}")
+        
+        resolutor = ResolutorFechas()
+        
+        def fecha(valor) -> Optional[datetime]:
+            resultado, _ = resolutor.fecha(valor)
+            if resultado is None and isinstance(valor, str):
+                try:
+                    resultado = datetime.fromisoformat(valor.strip())
+                except ValueError:
+                    pass
+            return resultado
+        
+        tasas = pd.DataFrame({
+            'MONEDA': cls._normalizar(df[columnas['moneda']], None),
+            'FECHA': pd.to_datetime(pd.Series(df[columnas['fecha']].map(fecha), dtype=object)),
+            'TASA': pd.to_numeric(df[columnas['tasa']], errors='coerce')
+        })
+        invalidas = tasas['MONEDA'].isna() | tasas['FECHA'].isna() | ~(tasas['TASA'] > 0)
+        if invalidas.any():
+            filas = ", ".join(str(f + 2) for f in np.flatnonzero(invalidas)[:5])
+            raise ErrorTiposCambio(f"{ruta}: moneda, fecha o tasa inválida en las filas {filas}")
+        if tasas.duplicated(['MONEDA', 'FECHA']).any():
+            raise ErrorTiposCambio(f"{ruta}: hay más de una tasa para la misma moneda y fecha")
+        return cls(tasas, moneda_reporte or cls.MONEDA_REPORTE)
+    
+    def firma(self) -> str:
+        # Identifica la tabla y la moneda de reporte (para la caché)
+        contenido = pd.util.hash_pandas_object(self.tasas, index=False).to_numpy().tobytes()
+        return hashlib.md5(contenido + str(self.moneda_reporte).encode()).hexdigest()[:8]
+    
+    @staticmethod
+    def _normalizar(serie: pd.Series, default: Optional[str]) -> np.ndarray:
+        # Código de moneda en mayúsculas, un valor distinto a la vez (vacío: default)
+        codigos, unicos = pd.factorize(serie)
+        normalizados = [_convertir_valor(v, str, None) for v in unicos]
+        normalizados = np.array([v.strip().upper() if v and v.strip() else default for v in normalizados]
+                                + [default], dtype=object)
+        return normalizados[codigos]
+    
+    def monedas(self, df: pd.DataFrame) -> np.ndarray:
+        # Moneda de cada documento; sin columna Moneda, todos en la moneda de reporte
+        if self.COLUMNA_MONEDA not in df.columns:
+            return np.full(len(df), self.moneda_reporte, dtype=object)
+        return self._normalizar(df[self.COLUMNA_MONEDA], self.moneda_reporte)
+    
+    @staticmethod
+    def fin_de_mes(fecha: datetime) -> datetime:
+        return datetime(fecha.year, fecha.month, calendar.monthrange(fecha.year, fecha.month)[1])
+    
+    def tasas_vigentes(self, monedas: np.ndarray, fechas, hasta: Optional[datetime] = None) -> np.ndarray:
+        # Tasa por fila (NaN: moneda sin tasa a esa fecha); fechas: una fecha o una por fila.
+        # hasta: sin tasa anterior a la fecha se toma la primera con FECHA <= hasta (fin de mes)
+        tasa = np.ones(len(monedas), dtype=np.float64)
+        if not self.activa:
+            return tasa
+        fechas = np.broadcast_to(np.asarray(fechas, dtype='datetime64[ns]'), (len(monedas),))
+        codigos, unicos = pd.factorize(pd.Series(monedas, dtype=object))
+        for codigo, moneda in enumerate(unicos):
+            if moneda == self.moneda_reporte:
+                continue
+            filas = codigos == codigo
+            if moneda not in self._por_moneda:
+                tasa[filas] = np.nan
+                continue
+            fechas_tabla, valores = self._por_moneda[moneda]
+            indices = np.searchsorted(fechas_tabla, fechas[filas], side='right') - 1
+            primera = valores[0] if hasta is not None and fechas_tabla[0] <= np.datetime64(hasta, 'ns') else np.nan
+            tasa[filas] = np.where(indices >= 0, valores[np.maximum(indices, 0)], primera)
+        return tasa
+    
+    def convertir(self, monedas: np.ndarray, montos: np.ndarray, fechas,
+                  hasta: Optional[datetime] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # (montos en la moneda de reporte, filas sin tasa); sin tasa el monto convertido es 0
+        tasa = self.tasas_vigentes(monedas, fechas, hasta)
+        sin_tasa = np.isnan(tasa)
+        return np.where(sin_tasa, 0.0, montos * tasa), sin_tasa
+
 # ==================== CLASE BASE ====================
 class DocumentoBase:
     def __init__(self, datos: pd.Series):
@@ -41,35 +496,85 @@ class DocumentoBase:
 # ==================== CLASE DOCUMENTO SAP ====================
 # DESARROLLADOR: Josemir Poma - Implementación de algoritmos de cálculo
 class DocumentoSAP(DocumentoBase, IProcesable, IExportable):
+    _resolutores: Dict[Tuple, ResolutorFechas] = {}
+    _reglas_defecto: Optional[ReglasClasificacion] = None
+    _tipos_cambio_defecto: Optional[TiposCambio] = None
     
-    def __init__(self, datos_fila: pd.Series, mes_reporte: datetime):
+    def __init__(self, datos_fila: pd.Series, mes_reporte: datetime, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, tipos_cambio: Optional[TiposCambio] = None):
         super().__init__(datos_fila)
         self.mes_reporte = mes_reporte
+        self.inicio_semana = inicio_semana
+        self.reglas = reglas or self.reglas_por_defecto()
+        self.tipos_cambio = tipos_cambio or self.tipos_cambio_por_defecto()
         self._inicializar_atributos()
     
-    def _inicializar_atributos(self):
+    @classmethod
+    def reglas_por_defecto(cls) -> ReglasClasificacion:
+        if cls._reglas_defecto is None:
+            cls._reglas_defecto = ReglasClasificacion()
+        return cls._reglas_defecto
+    
+    @classmethod
+    def tipos_cambio_por_defecto(cls) -> TiposCambio:
+        if cls._tipos_cambio_defecto is None:
+            cls._tipos_cambio_defecto = TiposCambio()
+        return cls._tipos_cambio_defecto
+    
+    @property
+    def fechas(self) -> ResolutorFechas:
+        # Un calendario y sus tablas de búsqueda por mes de reporte, compartidos entre documentos
+        clave = (self.mes_reporte.year, self.mes_reporte.month, self.inicio_semana)
+        if clave not in self._resolutores:
+            self._resolutores[clave] = ResolutorFechas(CalendarioMes(self.mes_reporte, self.inicio_semana))
+        return self._resolutores[clave]
+    
+    @classmethod
+    def desde_clasificacion(cls, datos_fila: pd.Series, mes_reporte: datetime,
+                            tramo: str, estatus: str, proyeccion: str,
+                            monto: float, moneda: Optional[str], inicio_semana: Optional[int] = None,
+                            reglas: Optional[ReglasClasificacion] = None) -> 'DocumentoSAP':
+        # Vista de un documento ya clasificado por el motor vectorizado (monto ya convertido,
+        # con el calendario y las reglas con que se clasificó)
+        documento = cls.__new__(cls)
+        DocumentoBase.__init__(documento, datos_fila)
+        documento.mes_reporte = mes_reporte
+        documento.inicio_semana = inicio_semana
+        documento.reglas = reglas or cls.reglas_por_defecto()
+        documento.tipos_cambio = cls.tipos_cambio_por_defecto()
+        documento._inicializar_atributos(calcular=False)
+        documento.monto = monto
+        documento.moneda = moneda
+        documento.tramo = tramo
+        documento.estatus = estatus
+        documento.proyeccion = proyeccion
+        return documento
+    
+    def _inicializar_atributos(self, calcular: bool = True):
         self.cd = self._obtener_valor('CD')
         self.dias_mora = self._obtener_valor('Mora', int, 0)
         self.sectorista = self._obtener_valor('Sectorista', default='SIN GESTOR')
-        self.monto = self._obtener_valor('Imp. ML2 Pend.', float, 0.0)
-        self.vencimiento = self._obtener_valor('Vencimiento neto')
-        self.base_plazo = self._obtener_valor('Base p.plazo pago')
+        # monto: moneda de reporte (misma conversión que ClasificadorVectorizado); monto_origen: moneda del documento
+        self.monto_origen = self._obtener_valor('Imp. ML2 Pend.', float, 0.0)
+        self.moneda = TiposCambio._normalizar(
+            pd.Series([self._datos.get(TiposCambio.COLUMNA_MONEDA)], dtype=object), self.tipos_cambio.moneda_reporte
+        )[0]
+        monto, _ = self.tipos_cambio.convertir(np.array([self.moneda], dtype=object), np.array([self.monto_origen]),
+                                               self.mes_reporte, TiposCambio.fin_de_mes(self.mes_reporte))
+        self.monto = float(monto[0])
+        self.vencimiento = self._obtener_valor('Vencimiento neto', None)
+        self.base_plazo = self._obtener_valor('Base p.plazo pago', None)
         self.ref_letra = self._obtener_valor('Ref. Letra')
         self.clv_ref = self._obtener_valor('Clv.ref.(cabecera) 2')
         
         self.tramo = ""
         self.estatus = ""
         self.proyeccion = ""
-        self._calcular_atributos()
+        if calcular:
+            self._calcular_atributos()
     
     def _obtener_valor(self, columna: str, tipo=str, default=None):
-        try:
-            valor = self._datos.get(columna, default)
-            if pd.isna(valor):
-                return default
-            return tipo(valor) if valor != "" else default
-        except:
-            return default
+        return _convertir_valor(self._datos.get(columna, default), tipo, default)
     
     def procesar(self) -> Dict:
         return {
@@ -85,31 +590,17 @@ class DocumentoSAP(DocumentoBase, IProcesable, IExportable):
         self.estatus = resultados['estatus']
         self.proyeccion = resultados['proyeccion']
     
+    @property
+    def _conjunto_reglas(self) -> ConjuntoReglas:
+        # Reglas de la unidad de negocio del documento (o las reglas por defecto)
+        columna = self.reglas.columna_unidad
+        return self.reglas.conjunto(self._datos.get(columna) if columna else None)
+    
     def _calcular_tramo(self) -> str:
-        if self.dias_mora <= 0:
-            return "Por Vencer"
-        elif self.dias_mora < 31:
-            return "1 a 30"
-        elif self.dias_mora < 61:
-            return "31 a 60"
-        elif self.dias_mora < 91:
-            return "61 a 90"
-        elif self.dias_mora < 121:
-            return "91 a 120"
-        elif self.dias_mora < 181:
-            return "121 a 180"
-        elif self.dias_mora < 361:
-            return "181 a 360"
-        else:
-            return "360+"
+        return self._conjunto_reglas.tramos.clasificar(self.dias_mora)
     
     def _calcular_estatus(self) -> str:
-        if self.dias_mora > 60:
-            return "EN GESTIÓN"
-        elif self.dias_mora <= 0:
-            return "POR VENCER"
-        else:
-            return "PROYECTADO"
+        return self._conjunto_reglas.estatus.clasificar(self.dias_mora)
     
     def _calcular_proyeccion(self) -> str:
         if self.cd == 'DL':
@@ -120,69 +611,17 @@ class DocumentoSAP(DocumentoBase, IProcesable, IExportable):
     def _calcular_proyeccion_dr(self) -> str:
         if self.dias_mora <= 0:
             return self._determinar_semana_por_fecha(self.vencimiento)
-        elif self.dias_mora <= 7:
-            return "SEMANA_1"
-        elif self.dias_mora <= 14:
-            return "SEMANA_2"
-        elif self.dias_mora <= 21:
-            return "SEMANA_3"
-        elif self.dias_mora <= 28:
-            return "SEMANA_4"
-        else:
-            return "SEMANA_5"
+        return self._conjunto_reglas.semanas_mora.clasificar(self.dias_mora)
     
     def _calcular_proyeccion_dl(self) -> str:
         # Solo DL válidas (con referencias)
         if pd.isna(self.ref_letra) or self.ref_letra == "":
             return "NO_PROCESAR"
         
-        try:
-            fecha_base = self.base_plazo
-            if isinstance(fecha_base, str):
-                fecha_base = datetime.strptime(fecha_base, "%d/%m/%Y")
-            
-            # Lógica DL: mes anterior + 8 días
-            from datetime import timedelta
-            fecha_ajustada = fecha_base + timedelta(days=8)
-            dia = fecha_ajustada.day
-            
-            if dia <= 7:
-                return "SEMANA_1"
-            elif dia <= 14:
-                return "SEMANA_2"
-            elif dia <= 21:
-                return "SEMANA_3"
-            elif dia <= 28:
-                return "SEMANA_4"
-            else:
-                return "SEMANA_5"
-        except:
-            return "SEMANA_1"
+        return self.fechas.semana_base(self.base_plazo, self._conjunto_reglas.dias_base_dl)
     
     def _determinar_semana_por_fecha(self, fecha) -> str:
-        try:
-            if pd.isna(fecha):
-                return "POR VENCER"
-            
-            if isinstance(fecha, str):
-                fecha_obj = datetime.strptime(fecha, "%d/%m/%Y")
-            else:
-                fecha_obj = fecha
-            
-            dia = fecha_obj.day
-            
-            if dia <= 7:
-                return "SEMANA_2"
-            elif dia <= 14:
-                return "SEMANA_3"
-            elif dia <= 21:
-                return "SEMANA_4"
-            elif dia <= 28:
-                return "SEMANA_5"
-            else:
-                return "SEMANA_5"
-        except:
-            return "POR VENCER"
+        return self.fechas.semana_vencimiento(fecha)
     
     def _es_valido_para_procesar(self) -> bool:
         if pd.isna(self.sectorista):
@@ -204,30 +643,517 @@ class DocumentoSAP(DocumentoBase, IProcesable, IExportable):
     def __str__(self) -> str:
         return f"{self.cd} | {self.sectorista} | ${self.monto:,.2f}"
 
+# ==================== MOTOR DE CLASIFICACIÓN VECTORIZADO ====================
+# Aplica las reglas de DocumentoSAP sobre columnas completas (mismo resultado)
+class ClasificadorVectorizado:
+    def __init__(self, mes_reporte: datetime, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, tipos_cambio: Optional[TiposCambio] = None):
+        self.mes_reporte = mes_reporte
+        self.calendario = CalendarioMes(mes_reporte, inicio_semana)
+        self.fechas = ResolutorFechas(self.calendario)
+        self.reglas = reglas or DocumentoSAP.reglas_por_defecto()
+        self.tipos_cambio = tipos_cambio or TiposCambio()
+    
+    def firma(self) -> str:
+        # Identifica las reglas vigentes, el calendario del mes y los tipos de cambio (para la caché)
+        return hashlib.md5(f"{self.reglas.firma()}_{self.calendario.firma()}_{self.tipos_cambio.firma()}"
+                           .encode()).hexdigest()[:8]
+    
+    def clasificar(self, df: pd.DataFrame) -> pd.DataFrame:
+        cd = self._columna_texto(df, 'CD')
+        dias_mora = self._columna_entera(df, 'Mora')
+        sectorista = self._columna_texto(df, 'Sectorista', 'SIN GESTOR')
+        monto_origen = self._columna_decimal(df, 'Imp. ML2 Pend.')
+        # Montos en la moneda de reporte con la tasa vigente al mes de reporte (o la primera
+        # del mes); SIN_TASA: sin ninguna, el monto convertido es 0
+        moneda = self.tipos_cambio.monedas(df)
+        monto, sin_tasa = self.tipos_cambio.convertir(moneda, monto_origen, self.mes_reporte,
+                                                      TiposCambio.fin_de_mes(self.mes_reporte))
+        ref_valida = self._columna_texto(df, 'Ref. Letra').notna().to_numpy()
+        es_dl = (cd == 'DL').to_numpy()
+        
+        tramo = np.empty(len(df), dtype=object)
+        estatus = np.empty(len(df), dtype=object)
+        proyeccion = np.empty(len(df), dtype=object)
+        for reglas, mascara in self.reglas.particionar(df):
+            # Cada unidad de negocio con sus propias tablas (mascara None: todas las filas)
+            filas = slice(None) if mascara is None else mascara
+            parte = df if mascara is None else df[mascara]
+            tramo[filas] = reglas.tramos.clasificar(dias_mora[filas])
+            estatus[filas] = reglas.estatus.clasificar(dias_mora[filas])
+            proyeccion[filas] = self._calcular_proyeccion(
+                parte, reglas, es_dl[filas], dias_mora[filas], ref_valida[filas]
+            )
+        
+        return pd.DataFrame({
+            'CD': cd,
+            'SECTORISTA': sectorista,
+            'MONTO': monto,
+            'MONEDA': moneda,
+            'MONTO_ORIGEN': monto_origen,
+            'SIN_TASA': sin_tasa,
+            'DIAS_MORA': dias_mora,
+            'TRAMO': tramo,
+            'ESTATUS 1': estatus,
+            'PROYECCIÓN': proyeccion,
+            'ES_VALIDO': cd.isin(['DR', 'DL']).to_numpy() & ~(es_dl & ~ref_valida)
+        }, index=df.index)
+    
+    @staticmethod
+    def resumen_sin_tasa(clasificacion: pd.DataFrame) -> pd.DataFrame:
+        # Documentos válidos sin tipo de cambio por moneda: DOCUMENTOS y MONTO_ORIGEN (convertidos a 0)
+        filas = clasificacion['SIN_TASA'] & clasificacion['ES_VALIDO']
+        return (clasificacion.loc[filas].groupby('MONEDA')['MONTO_ORIGEN']
+                .agg(DOCUMENTOS='size', MONTO_ORIGEN='sum'))
+    
+    def _calcular_proyeccion(self, df: pd.DataFrame, reglas: ConjuntoReglas, es_dl: np.ndarray,
+                             dias_mora: np.ndarray, ref_valida: np.ndarray) -> np.ndarray:
+        # DR: por vencer según fecha de vencimiento, vencidos según días de mora
+        # (las fechas solo se resuelven para las filas que las usan)
+        por_vencer = ~es_dl & (dias_mora <= 0)
+        proyeccion = reglas.semanas_mora.clasificar(dias_mora)
+        proyeccion[por_vencer] = self.fechas.semanas_vencimiento(df[por_vencer])
+        
+        # DL: base de plazo + N días, solo con referencia de letra
+        con_referencia = es_dl & ref_valida
+        proyeccion[con_referencia] = self.fechas.semanas_base(df[con_referencia], reglas.dias_base_dl)
+        proyeccion[es_dl & ~ref_valida] = "NO_PROCESAR"
+        return proyeccion
+    
+    # ---------- Conversión de columnas (misma semántica que _obtener_valor) ----------
+    @staticmethod
+    def _mapear_unicos(serie: pd.Series, funcion) -> np.ndarray:
+        # Columnas de texto o categóricas: se convierte cada valor distinto una sola vez
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos, unicos = serie.cat.codes.to_numpy(), serie.cat.categories
+        elif pd.api.types.infer_dtype(serie, skipna=True) in ('string', 'empty'):
+            codigos, unicos = pd.factorize(serie)
+        else:
+            return np.array([funcion(v) for v in serie.astype(object)], dtype=object)
+        convertidos = np.array([funcion(v) for v in unicos] + [funcion(np.nan)], dtype=object)
+        return convertidos[codigos]
+    
+    def _columna_texto(self, df: pd.DataFrame, columna: str, default=None) -> pd.Series:
+        if columna not in df.columns:
+            return pd.Series([default] * len(df), index=df.index, dtype=object)
+        valores = self._mapear_unicos(df[columna], lambda v: _convertir_valor(v, str, default))
+        return pd.Series(valores, index=df.index, dtype=object)
+    
+    def _columna_entera(self, df: pd.DataFrame, columna: str, default: int = 0) -> np.ndarray:
+        if columna not in df.columns:
+            return np.full(len(df), default, dtype=np.int64)
+        serie = df[columna]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            valores = serie.to_numpy(dtype=float, na_value=np.nan)
+            finitos = np.isfinite(valores)
+            return np.where(finitos, np.trunc(np.where(finitos, valores, 0)), default).astype(np.int64)
+        return self._mapear_unicos(serie, lambda v: _convertir_valor(v, int, default)).astype(np.int64)
+    
+    def _columna_decimal(self, df: pd.DataFrame, columna: str, default: float = 0.0) -> np.ndarray:
+        if columna not in df.columns:
+            return np.full(len(df), default, dtype=np.float64)
+        serie = df[columna]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            valores = serie.to_numpy(dtype=float, na_value=np.nan)
+            return np.where(np.isnan(valores), default, valores)
+        return self._mapear_unicos(serie, lambda v: _convertir_valor(v, float, default)).astype(np.float64)
+
 # ==================== GESTOR DE DOCUMENTOS ====================
 # DESARROLLADORA: Elisa Cunya - Gestión y estadísticas de documentos
 class GestorDocumentos:
+    # Almacén columnar: códigos categóricos + montos float64 + posición de la fila
+    # en el DataFrame original (no se copia ninguna fila del archivo SAP)
+    # (monto: moneda de reporte; monto_origen: moneda del documento, en MONEDA)
+    COLUMNAS_CATEGORICAS = ['CD', 'SECTORISTA', 'TRAMO', 'ESTATUS 1', 'PROYECCIÓN', 'MONEDA']
+    CLAVES_CUBO = ['SECTORISTA', 'CD', 'ESTATUS 1', 'PROYECCIÓN']
+    
     def __init__(self):
-        self.documentos: List[DocumentoSAP] = []
+        self.mes_reporte = datetime.now()
+        self._bloques: List[pd.DataFrame] = []
+        self.bloque = np.empty(0, dtype=np.int32)
+        self.filas = np.empty(0, dtype=np.int64)
+        self.monto = np.empty(0, dtype=np.float64)
+        self.monto_origen = np.empty(0, dtype=np.float64)
+        self.moneda_reporte: Optional[str] = None  # None: montos sin convertir
+        self.inicio_semana: Optional[int] = None  # calendario y reglas con que se clasificó
+        self.reglas: Optional[ReglasClasificacion] = None
+        self.categoricas: Dict[str, pd.Categorical] = {
+            columna: pd.Categorical([]) for columna in self.COLUMNAS_CATEGORICAS
+        }
+        self._pendientes: List[DocumentoSAP] = []
+        self._cubo = None
+        self._cubo_sociedades = None
+        self._cubo_monedas = None
     
     def agregar_documento(self, documento: DocumentoSAP):
         if documento._es_valido_para_procesar():
-            self.documentos.append(documento)
+            self._pendientes.append(documento)
+    
+    def agregar_clasificados(self, origen: pd.DataFrame, filas: np.ndarray,
+                             clasificacion: pd.DataFrame, mes_reporte: datetime):
+        # clasificacion (de ClasificadorVectorizado) corresponde a origen.iloc[filas]
+        validos = clasificacion['ES_VALIDO'].to_numpy(dtype=bool)
+        self.mes_reporte = mes_reporte
+        self._agregar_bloque(origen, np.asarray(filas)[validos], clasificacion[validos])
+    
+    def _agregar_bloque(self, origen: pd.DataFrame, filas: np.ndarray, clasificacion: pd.DataFrame):
+        id_bloque = len(self._bloques)
+        self._bloques.append(origen)
+        self.bloque = np.concatenate([self.bloque, np.full(len(filas), id_bloque, dtype=np.int32)])
+        self.filas = np.concatenate([self.filas, filas.astype(np.int64)])
+        self.monto = np.concatenate([self.monto, clasificacion['MONTO'].to_numpy(dtype=np.float64)])
+        self.monto_origen = np.concatenate([self.monto_origen, clasificacion['MONTO_ORIGEN'].to_numpy(dtype=np.float64)])
+        for columna in self.COLUMNAS_CATEGORICAS:
+            nuevos = pd.Categorical(clasificacion[columna].to_numpy(dtype=object))
+            actuales = self.categoricas[columna]
+            self.categoricas[columna] = (
+                pd.api.types.union_categoricals([actuales, nuevos]) if len(actuales) else nuevos
+            )
+        # Libros multisociedad: la hoja de origen de cada documento (sin valor en bloques sin ella)
+        sociedad = LectorSAP.COLUMNA_SOCIEDAD
+        if sociedad in origen.columns or sociedad in self.categoricas:
+            nuevos = pd.Categorical(origen[sociedad].iloc[filas].to_numpy(dtype=object)
+                                    if sociedad in origen.columns else [None] * len(filas))
+            actuales = self.categoricas.get(sociedad, pd.Categorical([None] * (len(self.filas) - len(filas))))
+            self.categoricas[sociedad] = (
+                pd.api.types.union_categoricals([actuales, nuevos]) if len(actuales) else nuevos
+            )
+        self._cubo = None
+        self._cubo_sociedades = None
+        self._cubo_monedas = None
+    
+    def restaurar(self, origen: pd.DataFrame, categoricas: Dict[str, pd.Categorical], monto: np.ndarray,
+                  monto_origen: np.ndarray, mes_reporte: datetime, moneda_reporte: Optional[str],
+                  cubos: Dict[str, Optional[pd.DataFrame]]):
+        # Estado guardado por InstantaneaARPC: un solo bloque con las filas de los documentos en orden;
+        # cubos: 'cubo', 'cubo_sociedades' y 'cubo_monedas' (None: se recalcula al pedirlo)
+        self.mes_reporte = mes_reporte
+        self.moneda_reporte = moneda_reporte
+        self._bloques = [origen]
+        self.bloque = np.zeros(len(origen), dtype=np.int32)
+        self.filas = np.arange(len(origen), dtype=np.int64)
+        self.monto = monto
+        self.monto_origen = monto_origen
+        self.categoricas = categoricas
+        self._pendientes = []
+        self._cubo = cubos.get('cubo')
+        self._cubo_sociedades = cubos.get('cubo_sociedades')
+        self._cubo_monedas = cubos.get('cubo_monedas')
+    
+    def _consolidar_pendientes(self):
+        if not self._pendientes:
+            return
+        pendientes, self._pendientes = self._pendientes, []
+        origen = pd.DataFrame([doc._datos for doc in pendientes]).reset_index(drop=True)
+        clasificacion = pd.DataFrame({
+            'CD': [doc.cd for doc in pendientes],
+            'SECTORISTA': [doc.sectorista for doc in pendientes],
+            'MONTO': [doc.monto for doc in pendientes],
+            'MONEDA': [doc.moneda for doc in pendientes],
+            'MONTO_ORIGEN': [doc.monto_origen for doc in pendientes],
+            'TRAMO': [doc.tramo for doc in pendientes],
+            'ESTATUS 1': [doc.estatus for doc in pendientes],
+            'PROYECCIÓN': [doc.proyeccion for doc in pendientes]
+        })
+        self._agregar_bloque(origen, np.arange(len(origen)), clasificacion)
+    
+    def columna(self, nombre: str) -> pd.Categorical:
+        self._consolidar_pendientes()
+        return self.categoricas[nombre]
+    
+    def montos(self) -> np.ndarray:
+        self._consolidar_pendientes()
+        return self.monto
+    
+    def obtener_cubo(self) -> pd.DataFrame:
+        # Una sola agregación (cantidad y monto) por sectorista, cd, estatus y proyección;
+        # estadísticas, tablas dinámicas y reporte se derivan de este cubo
+        self._consolidar_pendientes()
+        if self._cubo is None:
+            self._cubo = self._agregar_cubo(self.CLAVES_CUBO)
+        return self._cubo
+    
+    def obtener_cubo_sociedades(self) -> Optional[pd.DataFrame]:
+        # El mismo cubo con la sociedad como clave adicional (None si el archivo tenía una sola hoja)
+        self._consolidar_pendientes()
+        if LectorSAP.COLUMNA_SOCIEDAD not in self.categoricas:
+            return None
+        if self._cubo_sociedades is None:
+            self._cubo_sociedades = self._agregar_cubo([LectorSAP.COLUMNA_SOCIEDAD] + self.CLAVES_CUBO)
+        return self._cubo_sociedades
+    
+    def obtener_cubo_monedas(self) -> pd.DataFrame:
+        # El cubo por moneda del documento, con el monto también en la moneda original (MONTO_ORIGEN)
+        self._consolidar_pendientes()
+        if self._cubo_monedas is None:
+            self._cubo_monedas = self._agregar_cubo(['MONEDA'] + self.CLAVES_CUBO, con_origen=True)
+        return self._cubo_monedas
+    
+    def _agregar_cubo(self, claves: List[str], con_origen: bool = False) -> pd.DataFrame:
+        codigos = pd.DataFrame({columna: self.categoricas[columna].codes for columna in claves})
+        codigos['MONTO'] = self.monto
+        cubo = (codigos.groupby(claves, sort=False)['MONTO']
+                .agg(['size', 'sum'])
+                .reset_index()
+                .rename(columns={'size': 'DOCUMENTOS', 'sum': 'MONTO'}))
+        if con_origen:
+            # Mismo orden de grupos (sort=False) que el cubo
+            codigos['MONTO_ORIGEN'] = self.monto_origen
+            cubo['MONTO_ORIGEN'] = codigos.groupby(claves, sort=False)['MONTO_ORIGEN'].sum().to_numpy()
+        for columna in claves:
+            etiquetas = np.append(np.asarray(self.categoricas[columna].categories, dtype=object), None)
+            cubo[columna] = etiquetas[cubo[columna].to_numpy()]
+        return cubo
+    
+    def documento(self, posicion: int) -> DocumentoSAP:
+        # Vista por documento: se construye solo cuando se solicita
+        self._consolidar_pendientes()
+        origen = self._bloques[self.bloque[posicion]]
+        return DocumentoSAP.desde_clasificacion(
+            origen.iloc[self.filas[posicion]], self.mes_reporte,
+            self.categoricas['TRAMO'][posicion],
+            self.categoricas['ESTATUS 1'][posicion],
+            self.categoricas['PROYECCIÓN'][posicion],
+            float(self.monto[posicion]), self.categoricas['MONEDA'][posicion],
+            self.inicio_semana, self.reglas
+        )
+    
+    @property
+    def documentos(self) -> 'VistaDocumentos':
+        return VistaDocumentos(self)
+    
+    def columnas_origen(self, columnas: Optional[List[str]] = None) -> pd.DataFrame:
+        # Filas originales de los documentos, en su orden (columnas=None: todas)
+        self._consolidar_pendientes()
+        if len(self.filas) == 0:
+            return pd.DataFrame(columns=columnas or [])
+        partes = [
+            (origen if columnas is None else origen[[c for c in columnas if c in origen.columns]])
+            .iloc[self.filas[self.bloque == id_bloque]]
+            for id_bloque, origen in enumerate(self._bloques)
+        ]
+        return pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0].reset_index(drop=True)
+    
+    def a_dataframe(self) -> pd.DataFrame:
+        # Filas originales + TRAMO / ESTATUS 1 / PROYECCIÓN, sin diccionarios por fila
+        if len(self) == 0:
+            return pd.DataFrame()
+        df = self.columnas_origen()
+        for columna in ['TRAMO', 'ESTATUS 1', 'PROYECCIÓN']:
+            df[columna] = np.asarray(self.categoricas[columna], dtype=object)
+        if self.moneda_reporte:
+            df[f'MONTO {self.moneda_reporte}'] = self.monto
+        return df
     
     def obtener_estadisticas(self) -> Dict:
-        total = len(self.documentos)
-        dr = len([d for d in self.documentos if d.cd == 'DR'])
-        dl = len([d for d in self.documentos if d.cd == 'DL'])
+        return self.estadisticas_de_cubo(self.obtener_cubo())
+    
+    @staticmethod
+    def estadisticas_de_cubo(cubo: pd.DataFrame) -> Dict:
+        por_cd = cubo.groupby('CD')[['DOCUMENTOS', 'MONTO']].sum()
         
-        monto_total = sum(d.monto for d in self.documentos)
-        monto_dr = sum(d.monto for d in self.documentos if d.cd == 'DR')
-        monto_dl = sum(d.monto for d in self.documentos if d.cd == 'DL')
+        def valor(cd: str, columna: str):
+            return por_cd.at[cd, columna] if cd in por_cd.index else 0
         
         return {
-            'total': total, 'dr': dr, 'dl': dl,
-            'monto_total': monto_total, 'monto_dr': monto_dr, 'monto_dl': monto_dl
+            'total': int(cubo['DOCUMENTOS'].sum()),
+            'dr': int(valor('DR', 'DOCUMENTOS')), 'dl': int(valor('DL', 'DOCUMENTOS')),
+            'monto_total': float(cubo['MONTO'].sum()),
+            'monto_dr': float(valor('DR', 'MONTO')),
+            'monto_dl': float(valor('DL', 'MONTO'))
         }
     
+    def __len__(self):
+        return len(self.filas) + len(self._pendientes)
+
+
+class GestorConsolidado:
+    # Suma cubos parciales (p. ej. de varios archivos) y ofrece la misma lectura que
+    # GestorDocumentos para estadísticas y tablas dinámicas
+    def __init__(self, cubos: List[pd.DataFrame], cubos_sociedades: Optional[List[pd.DataFrame]] = None,
+                 cubos_monedas: Optional[List[pd.DataFrame]] = None, moneda_reporte: Optional[str] = None):
+        self.moneda_reporte = moneda_reporte
+        self._cubo = self._sumar(cubos, GestorDocumentos.CLAVES_CUBO)
+        self._cubo_sociedades = None
+        if cubos_sociedades and any(cubo is not None for cubo in cubos_sociedades):
+            self._cubo_sociedades = self._sumar(
+                cubos_sociedades, [LectorSAP.COLUMNA_SOCIEDAD] + GestorDocumentos.CLAVES_CUBO
+            )
+        self._cubo_monedas = None
+        if cubos_monedas and any(cubo is not None for cubo in cubos_monedas):
+            self._cubo_monedas = self._sumar(cubos_monedas, ['MONEDA'] + GestorDocumentos.CLAVES_CUBO,
+                                             ('DOCUMENTOS', 'MONTO', 'MONTO_ORIGEN'))
+    
+    @staticmethod
+    def _sumar(cubos: List[pd.DataFrame], claves: List[str],
+               valores: Tuple[str, ...] = ('DOCUMENTOS', 'MONTO')) -> pd.DataFrame:
+        columnas = claves + list(valores)
+        cubos = [cubo[columnas] for cubo in cubos if cubo is not None and len(cubo) > 0]
+        if not cubos:
+            return pd.DataFrame(columns=columnas)
+        return (pd.concat(cubos, ignore_index=True)
+                .groupby(claves, sort=False, dropna=False)
+                [list(valores)].sum()
+                .reset_index())
+    
+    def obtener_cubo(self) -> pd.DataFrame:
+        return self._cubo
+    
+    def obtener_cubo_sociedades(self) -> Optional[pd.DataFrame]:
+        return self._cubo_sociedades
+    
+    def obtener_cubo_monedas(self) -> Optional[pd.DataFrame]:
+        return self._cubo_monedas
+    
+    def obtener_estadisticas(self) -> Dict:
+        return GestorDocumentos.estadisticas_de_cubo(self._cubo)
+    
+    def __len__(self):
+        return int(self._cubo['DOCUMENTOS'].sum())
+
+
+class VistaDocumentos:
+    # Secuencia de solo lectura de DocumentoSAP creados bajo demanda
+    def __init__(self, gestor: GestorDocumentos):
+        self._gestor = gestor
+    
+    def __len__(self):
+        return len(self._gestor)
+    
+    def __getitem__(self, posicion: int) -> DocumentoSAP:
+        if posicion < 0:
+            posicion += len(self)
+        if not 0 <= posicion < len(self):
+            raise IndexError(posicion)
+        return self._gestor.documento(posicion)
+    
+    def __iter__(self):
+        for posicion in range(len(self)):
+            yield self._gestor.documento(posicion)
+
+# ==================== ÍNDICE DE DOCUMENTOS (DETALLE) ====================
+# Se construye una vez tras la clasificación: posiciones agrupadas por clave y ordenadas
+# por monto (mayor primero), de modo que cada grupo es un tramo contiguo del arreglo y
+# cualquier consulta cuesta O(resultado), sin recorrer todos los documentos
+class GruposOrdenados:
+    def __init__(self, columnas: List, por_monto: np.ndarray):
+        # por_monto: posiciones ordenadas por monto descendente (compartido por todos los grupos)
+        self.valores: List[pd.Index] = []
+        codigo = np.zeros(len(por_monto), dtype=np.int64)
+        validos = np.ones(len(por_monto), dtype=bool)
+        for columna in columnas:
+            codigos, unicos = pd.factorize(columna)
+            self.valores.append(pd.Index(unicos))
+            codigo = codigo * max(len(unicos), 1) + codigos
+            validos &= codigos >= 0
+        grupos = int(np.prod([max(len(v), 1) for v in self.valores]))
+        # Orden estable por grupo sobre el orden por monto: dentro de cada grupo, mayor monto primero
+        orden = por_monto[np.argsort(codigo[por_monto], kind='stable')]
+        self.orden = orden[validos[orden]]
+        self.inicios = np.concatenate([[0], np.cumsum(np.bincount(codigo[validos], minlength=grupos))])
+    
+    def posiciones(self, *valores) -> np.ndarray:
+        codigo = 0
+        for indice, valor in zip(self.valores, valores):
+            if valor not in indice:
+                return self.orden[:0]
+            codigo = codigo * len(indice) + indice.get_loc(valor)
+        return self.orden[self.inicios[codigo]:self.inicios[codigo + 1]]
+
+
+class IndiceDocumentos:
+    # Columnas del archivo SAP que acompañan a cada documento en el detalle
+    COLUMNAS_DETALLE = ['Cuenta', 'Nº documento', 'Clv.ref.(cabecera) 2', 'Ref. Letra',
+                        'Vencimiento neto', 'Mora']
+    
+    def __init__(self, documentos: pd.DataFrame):
+        # documentos: CD, SECTORISTA, MONTO, TRAMO, ESTATUS 1, PROYECCIÓN (+ columnas de detalle)
+        self.documentos = documentos.reset_index(drop=True)
+        monto = self.documentos['MONTO'].to_numpy(dtype=np.float64)
+        por_monto = np.argsort(-monto, kind='stable')
+        sectorista = self.documentos['SECTORISTA']
+        self._celdas = GruposOrdenados([sectorista, self.documentos['PROYECCIÓN']], por_monto)
+        self._sectoristas = GruposOrdenados([sectorista], por_monto)
+        self._tramos = GruposOrdenados([self.documentos['TRAMO']], por_monto)
+        self._cds = GruposOrdenados([self.documentos['CD']], por_monto)
+        # Ref. Letra normalizada (sin espacios, mayúsculas) con operaciones de columna
+        referencias = pd.Series(pd.NA, index=self.documentos.index, dtype='string')
+        if 'Ref. Letra' in self.documentos.columns:
+            referencias = self.documentos['Ref. Letra'].astype('string').str.strip().str.upper()
+        self._referencias = GruposOrdenados([referencias.replace("", pd.NA)], por_monto)
+    
+    @classmethod
+    def desde_gestor(cls, gestor: GestorDocumentos) -> 'IndiceDocumentos':
+        return cls(cls.documentos_gestor(gestor))
+    
+    @classmethod
+    def documentos_gestor(cls, gestor: GestorDocumentos) -> pd.DataFrame:
+        # Solo las columnas del detalle (la tabla que se indexa)
+        documentos = gestor.columnas_origen(cls.COLUMNAS_DETALLE)
+        for columna in ['CD', 'SECTORISTA', 'TRAMO', 'ESTATUS 1', 'PROYECCIÓN']:
+            documentos[columna] = gestor.columna(columna)
+        documentos['MONTO'] = gestor.montos()
+        return documentos
+    
+    @classmethod
+    def guardar(cls, gestor: GestorDocumentos, ruta: str) -> str:
+        # Tabla del detalle en disco (Arrow IPC con pyarrow, si no pickle); devuelve la ruta escrita
+        documentos = cls.documentos_gestor(gestor)
+        if InstantaneaARPC.disponible():
+            ruta += '.arrow'
+            InstantaneaARPC._escribir(ruta, documentos)
+        else:
+            ruta += '.pkl'
+            documentos.to_pickle(ruta)
+        return ruta
+    
+    @classmethod
+    def abrir(cls, ruta: str) -> 'IndiceDocumentos':
+        if ruta.endswith('.arrow'):
+            return cls(InstantaneaARPC._leer(ruta))
+        return cls(pd.read_pickle(ruta))
+    
+    @staticmethod
+    def _normalizar_ref(valor) -> Optional[str]:
+        valor = _convertir_valor(valor, str, None)
+        return valor.strip().upper() if valor and valor.strip() else None
+    
+    @property
+    def sectoristas(self) -> List[str]:
+        return [str(s) for s in self._sectoristas.valores[0]]
+    
+    def _pagina(self, posiciones: np.ndarray, pagina: int, por_pagina: int) -> pd.DataFrame:
+        inicio = max(pagina, 0) * por_pagina
+        return self.documentos.iloc[posiciones[inicio:inicio + por_pagina]]
+    
+    def posiciones(self, sectorista: Optional[str] = None, proyeccion: Optional[str] = None) -> np.ndarray:
+        if proyeccion is None:
+            return self._sectoristas.posiciones(sectorista)
+        return self._celdas.posiciones(sectorista, proyeccion)
+    
+    def celda(self, sectorista: str, proyeccion: Optional[str] = None,
+              pagina: int = 0, por_pagina: int = 20) -> pd.DataFrame:
+        # Documentos de una celda de la tabla dinámica (o de todo el sectorista), mayor monto primero
+        return self._pagina(self.posiciones(sectorista, proyeccion), pagina, por_pagina)
+    
+    def top(self, sectorista: str, proyeccion: Optional[str] = None, n: int = 10) -> pd.DataFrame:
+        return self.celda(sectorista, proyeccion, 0, n)
+    
+    def posiciones_tramo(self, tramo: str) -> np.ndarray:
+        return self._tramos.posiciones(tramo)
+    
+    def posiciones_cd(self, cd: str) -> np.ndarray:
+        return self._cds.posiciones(cd)
+    
+    def por_tramo(self, tramo: str, pagina: int = 0, por_pagina: int = 20) -> pd.DataFrame:
+        return self._pagina(self.posiciones_tramo(tramo), pagina, por_pagina)
+    
+    def por_cd(self, cd: str, pagina: int = 0, por_pagina: int = 20) -> pd.DataFrame:
+        return self._pagina(self.posiciones_cd(cd), pagina, por_pagina)
+    
+    def buscar_ref_letra(self, referencia: str) -> pd.DataFrame:
+        return self.documentos.iloc[self._referencias.posiciones(self._normalizar_ref(referencia))]
+    
     def __len__(self):
         return len(self.documentos)
 
@@ -238,52 +1164,1624 @@ class GeneradorTablasDinamicas:
         self.gestor = gestor_documentos
         self.tabla_proyecciones = None
         self.tabla_cd = None
+        # Libros multisociedad: {sociedad: (tabla de proyecciones, tabla por CD)}
+        self.tablas_sociedad: Dict[str, Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]] = {}
+        # Documentos en otras monedas: las mismas tablas en la moneda original de cada una y
+        # DOCUMENTOS / MONTO_ORIGEN / MONTO (moneda de reporte) por moneda
+        self.tablas_moneda: Dict[str, Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]] = {}
+        self.monedas: Optional[pd.DataFrame] = None
+    
+    @property
+    def moneda_reporte(self) -> Optional[str]:
+        return self.gestor.moneda_reporte
     
     def generar_tablas(self):
         self._generar_tabla_proyecciones()
         self._generar_tabla_cd()
+        self._generar_tablas_sociedad()
+        self._generar_tablas_moneda()
+    
+    def _generar_tabla_proyecciones(self):
+        self.tabla_proyecciones = self._tabla_proyecciones(self.gestor.obtener_cubo())
+    
+    def _generar_tabla_cd(self):
+        self.tabla_cd = self._tabla_cd(self.gestor.obtener_cubo())
+    
+    def _generar_tablas_sociedad(self):
+        cubo = self.gestor.obtener_cubo_sociedades()
+        self.tablas_sociedad = {}
+        if cubo is None:
+            return
+        for sociedad in pd.unique(cubo[LectorSAP.COLUMNA_SOCIEDAD].dropna()):
+            parte = cubo[cubo[LectorSAP.COLUMNA_SOCIEDAD] == sociedad]
+            self.tablas_sociedad[str(sociedad)] = (self._tabla_proyecciones(parte), self._tabla_cd(parte))
+    
+    def _generar_tablas_moneda(self):
+        cubo = self.gestor.obtener_cubo_monedas()
+        self.tablas_moneda, self.monedas = {}, None
+        if cubo is None:
+            return
+        monedas = [str(moneda) for moneda in pd.unique(cubo['MONEDA'].dropna())]
+        # Todo en la moneda de reporte (o una sola moneda sin tabla de tipos de cambio): sin desglose
+        if not monedas or (len(monedas) == 1 and self.moneda_reporte in (None, monedas[0])):
+            return
+        self.monedas = cubo.groupby('MONEDA', sort=False)[['DOCUMENTOS', 'MONTO_ORIGEN', 'MONTO']].sum()
+        for moneda in monedas:
+            parte = cubo[cubo['MONEDA'] == moneda].assign(MONTO=lambda c: c['MONTO_ORIGEN'])
+            self.tablas_moneda[moneda] = (self._tabla_proyecciones(parte), self._tabla_cd(parte))
+    
+    @staticmethod
+    def _tabla_proyecciones(cubo: pd.DataFrame) -> Optional[pd.DataFrame]:
+        df = cubo[(cubo['ESTATUS 1'] == "PROYECTADO") & cubo['PROYECCIÓN'].isin(CalendarioMes.ETIQUETAS)]
+        
+        if len(df) > 0:
+            return pd.pivot_table(
+                df, values='MONTO', index='SECTORISTA',
+                columns='PROYECCIÓN', aggfunc='sum', fill_value=0,
+                margins=True, margins_name='Total general'
+            )
+        return None
+    
+    @staticmethod
+    def _tabla_cd(cubo: pd.DataFrame) -> Optional[pd.DataFrame]:
+        df = cubo[cubo['ESTATUS 1'] == "PROYECTADO"]
+        
+        if len(df) > 0:
+            return pd.pivot_table(
+                df, values='MONTO', index='SECTORISTA',
+                columns='CD', aggfunc='sum', fill_value=0,
+                margins=True, margins_name='Total general'
+            )
+        return None
+    
+    @staticmethod
+    def nombre_hoja(sociedad: str) -> str:
+        # Nombre de hoja válido en Excel (máx. 31 caracteres, sin []:*?/\)
+        return ("TD_" + sociedad.translate(str.maketrans('[]:*?/\\', '_______')))[:31]
+    
+    def hojas(self) -> List[Tuple[str, Optional[pd.DataFrame], Optional[pd.DataFrame]]]:
+        # (hoja, tabla de proyecciones con solo columnas de semanas, tabla por CD): el consolidado
+        # en TABLA_DINAMICA, una hoja por sociedad y una por moneda original (TD_MONEDA_<moneda>)
+        semanas = list(CalendarioMes.ETIQUETAS) + ["Total general"]
+        
+        def filtrar(tabla: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+            return None if tabla is None else tabla[[col for col in tabla.columns if col in semanas]]
+        
+        hojas = [('TABLA_DINAMICA', filtrar(self.tabla_proyecciones), self.tabla_cd)]
+        for sociedad, (proyecciones, cd) in self.tablas_sociedad.items():
+            hojas.append((self.nombre_hoja(sociedad), filtrar(proyecciones), cd))
+        for moneda, (proyecciones, cd) in self.tablas_moneda.items():
+            hojas.append((self.nombre_hoja(f"MONEDA_{moneda}"), filtrar(proyecciones), cd))
+        return hojas
+# ==================== LECTURA DE ARCHIVOS SAP ====================
+def _leer_hoja_excel(ruta: str, hoja: str, motor: Optional[str], columnas: Optional[List[str]]) -> pd.DataFrame:
+    # Se ejecuta en un proceso de trabajo (una hoja por proceso en libros multisociedad)
+    return pd.read_excel(ruta, sheet_name=hoja, engine=motor,
+                         usecols=None if columnas is None else (lambda c: c in columnas))
+
+
+# Lee solo las columnas necesarias, con tipos explícitos, desde xlsx/xls, CSV o Parquet.
+# Los libros con una hoja por sociedad se leen completos (hojas en paralelo) y cada fila
+# queda marcada con su hoja en la columna SOCIEDAD
+class LectorSAP:
+    COLUMNAS_REGLAS = ['CD', 'Mora', 'Sectorista', 'Imp. ML2 Pend.', 'Moneda', 'Vencimiento neto',
+                       'Base p.plazo pago', 'Ref. Letra', 'Clv.ref.(cabecera) 2']
+    COLUMNAS_CATEGORICAS = ['CD', 'Sectorista']
+    COLUMNAS_FECHA = ['Vencimiento neto', 'Base p.plazo pago']
+    COLUMNA_SOCIEDAD = 'SOCIEDAD'
+    EXTENSIONES = ['.xlsx', '.xlsm', '.xls', '.csv', '.parquet']
+    
+    def __init__(self, columnas_paso: Optional[List[str]] = None, procesos: Optional[int] = None):
+        # columnas_paso=None conserva todas las columnas para DATOS_COMPLETOS;
+        # procesos: hojas leídas a la vez en libros multisociedad (None: una por núcleo)
+        self.columnas_paso = columnas_paso
+        self.procesos = procesos
+        self.fechas = ResolutorFechas()
+        self.fechas_invalidas = self.sin_fechas_invalidas()
+        self.inicios_bloque = np.zeros(1, dtype=np.int64)
+        self._columnas_bloque: Optional[List[str]] = None
+    
+    @staticmethod
+    def sin_fechas_invalidas() -> pd.DataFrame:
+        # Posición, columna y texto original de cada fecha no interpretable del último DataFrame leído
+        return pd.DataFrame({'POSICION': np.empty(0, dtype=np.int64),
+                             'COLUMNA': np.empty(0, dtype=object), 'VALOR': np.empty(0, dtype=object)})
+    
+    @property
+    def columnas(self) -> Optional[List[str]]:
+        if self.columnas_paso is None:
+            return None
+        return self.COLUMNAS_REGLAS + [c for c in self.columnas_paso if c not in self.COLUMNAS_REGLAS]
+    
+    def firma(self) -> str:
+        # Identifica la configuración de lectura (para la caché)
+        return hashlib.md5(repr(self.columnas).encode()).hexdigest()[:8]
+    
+    @staticmethod
+    def motor_excel() -> str:
+        # calamine (python-calamine) es mucho más rápido que openpyxl si está instalado
+        return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+    
+    @staticmethod
+    def _extension(ruta: str) -> str:
+        return os.path.splitext(ruta)[1].lower()
+    
+    def leer_metadatos(self, ruta: str) -> Tuple[Optional[int], Optional[int]]:
+        # (registros, columnas) sin leer las filas del archivo
+        extension = self._extension(ruta)
+        try:
+            if extension in ('.xlsx', '.xlsm'):
+                from openpyxl import load_workbook
+                libro = load_workbook(ruta, read_only=True)
+                try:
+                    hojas = self._hojas_xlsx(libro) or libro.worksheets[:1]
+                    filas = sum((hoja.max_row or 1) - 1 for hoja in hojas)
+                    columnas = max(hoja.max_column or 0 for hoja in hojas)
+                finally:
+                    libro.close()
+                if columnas:
+                    return filas, columnas
+            elif extension == '.parquet':
+                import pyarrow.parquet as pq
+                metadatos = pq.ParquetFile(ruta).metadata
+                return metadatos.num_rows, metadatos.num_columns
+            elif extension == '.csv':
+                with open(ruta, 'rb') as archivo:
+                    encabezado = archivo.readline()
+                    filas = sum(bloque.count(b'\n') for bloque in iter(lambda: archivo.read(1 << 20), b''))
+                separador = self._detectar_separador(encabezado.decode('utf-8', errors='ignore'))
+                return filas, len(encabezado.split(separador.encode()))
+        except Exception:
+            pass
+        return None, None
+    
+    @staticmethod
+    def _es_hoja_datos(encabezado) -> bool:
+        return 'CD' in list(encabezado)
+    
+    @classmethod
+    def _hojas_xlsx(cls, libro) -> list:
+        return [hoja for hoja in libro.worksheets
+                if cls._es_hoja_datos(next(hoja.iter_rows(max_row=1, values_only=True), ()))]
+    
+    def hojas_datos(self, ruta: str) -> List[str]:
+        # Hojas con encabezado SAP (columna CD), en el orden del libro
+        extension = self._extension(ruta)
+        if extension in ('.xlsx', '.xlsm'):
+            from openpyxl import load_workbook
+            libro = load_workbook(ruta, read_only=True)
+            try:
+                return [hoja.title for hoja in self._hojas_xlsx(libro)]
+            finally:
+                libro.close()
+        if extension == '.xls':
+            with pd.ExcelFile(ruta) as libro:
+                return [nombre for nombre in libro.sheet_names
+                        if self._es_hoja_datos(libro.parse(nombre, nrows=0).columns)]
+        return []
+    
+    @classmethod
+    def inicios_hoja(cls, df: pd.DataFrame) -> np.ndarray:
+        # Posición de la primera fila de cada hoja (las hojas quedan contiguas en el DataFrame)
+        if cls.COLUMNA_SOCIEDAD not in df.columns:
+            return np.zeros(1, dtype=np.int64)
+        codigos = df[cls.COLUMNA_SOCIEDAD].cat.codes.to_numpy()
+        return np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1]])
+    
+    def leer(self, ruta: str) -> pd.DataFrame:
+        extension = self._extension(ruta)
+        if extension not in self.EXTENSIONES:
+            raise ErrorArchivoSAP(f"Formato no soportado: {extension}")
+        
+        self.fechas.reiniciar_conteo()
+        if extension == '.parquet':
+            df = self._leer_parquet(ruta)
+        elif extension == '.csv':
+            df = self._leer_csv(ruta)
+        else:
+            df = self._leer_excel(ruta)
+        return self._tipar(df)
+    
+    def leer_por_bloques(self, ruta: str, filas: int = 100_000) -> Iterator[pd.DataFrame]:
+        # Igual que leer(), pero entrega el archivo en bloques de filas (memoria acotada)
+        extension = self._extension(ruta)
+        if extension not in self.EXTENSIONES:
+            raise ErrorArchivoSAP(f"Formato no soportado: {extension}")
+        self.fechas.reiniciar_conteo()
+        
+        # inicios_bloque: inicio de cada hoja respecto al bloque entregado (negativo si la
+        # hoja empezó en un bloque anterior), para numerar las filas del archivo
+        emitidas = 0
+        if extension == '.csv':
+            with open(ruta, encoding='utf-8', errors='ignore') as archivo:
+                separador = self._detectar_separador(archivo.readline())
+            for bloque in pd.read_csv(ruta, sep=separador, usecols=self._filtro_columnas(),
+                                      chunksize=filas):
+                self.inicios_bloque = np.array([-emitidas], dtype=np.int64)
+                emitidas += len(bloque)
+                yield self._tipar(bloque)
+        elif extension == '.parquet':
+            import pyarrow.parquet as pq
+            archivo = pq.ParquetFile(ruta)
+            columnas = self.columnas
+            if columnas is not None:
+                columnas = [c for c in columnas if c in archivo.schema_arrow.names]
+            for lote in archivo.iter_batches(batch_size=filas, columns=columnas):
+                self.inicios_bloque = np.array([-emitidas], dtype=np.int64)
+                emitidas += lote.num_rows
+                yield self._tipar(lote.to_pandas())
+        elif extension in ('.xlsx', '.xlsm'):
+            yield from self._leer_excel_por_bloques(ruta, filas)
+        else:
+            # .xls no admite lectura en streaming: se lee completo y se divide
+            df = self.leer(ruta)
+            invalidas = self.fechas_invalidas
+            inicios = self.inicios_hoja(df)
+            for inicio in range(0, len(df), filas):
+                en_bloque = (invalidas['POSICION'] >= inicio) & (invalidas['POSICION'] < inicio + filas)
+                self.fechas_invalidas = invalidas[en_bloque].assign(POSICION=lambda t: t['POSICION'] - inicio)
+                self.inicios_bloque = inicios - inicio
+                yield df.iloc[inicio:inicio + filas]
+    
+    def _leer_excel_por_bloques(self, ruta: str, filas: int) -> Iterator[pd.DataFrame]:
+        # Hoja por hoja (un bloque nunca mezcla dos hojas); todos los bloques con las
+        # columnas de la primera hoja, para que la salida por bloques sea uniforme
+        from openpyxl import load_workbook
+        libro = load_workbook(ruta, read_only=True, data_only=True)
+        try:
+            hojas = self._hojas_xlsx(libro)
+            nombres_hojas = [hoja.title for hoja in hojas] if len(hojas) > 1 else None
+            self._columnas_bloque = None
+            for hoja in hojas or libro.worksheets[:1]:
+                iterador = hoja.iter_rows(values_only=True)
+                encabezado = next(iterador, None)
+                if encabezado is None:
+                    continue
+                nombres = [str(n) if n is not None else f"Unnamed: {i}" for i, n in enumerate(encabezado)]
+                columnas = self.columnas
+                indices = [i for i, n in enumerate(nombres) if columnas is None or n in columnas]
+                seleccion = [nombres[i] for i in indices]
+                
+                buffer = []
+                emitidas = 0
+                for fila in iterador:
+                    buffer.append([fila[i] if i < len(fila) else None for i in indices])
+                    if len(buffer) >= filas:
+                        yield self._bloque_hoja(buffer, seleccion, hoja.title, nombres_hojas, emitidas)
+                        emitidas += len(buffer)
+                        buffer = []
+                if buffer:
+                    yield self._bloque_hoja(buffer, seleccion, hoja.title, nombres_hojas, emitidas)
+        finally:
+            libro.close()
+    
+    def _bloque_hoja(self, buffer: list, columnas: List[str], hoja: str,
+                     hojas: Optional[List[str]], emitidas: int) -> pd.DataFrame:
+        df = pd.DataFrame(buffer, columns=columnas)
+        if self._columnas_bloque is None:
+            self._columnas_bloque = columnas
+        elif columnas != self._columnas_bloque:
+            df = df.reindex(columns=self._columnas_bloque)
+        if hojas is not None:
+            df[self.COLUMNA_SOCIEDAD] = pd.Categorical([hoja] * len(df), categories=hojas)
+        self.inicios_bloque = np.array([-emitidas], dtype=np.int64)
+        return self._tipar(df)
+    
+    def _filtro_columnas(self):
+        columnas = self.columnas
+        return None if columnas is None else (lambda c: c in columnas)
+    
+    def _leer_excel(self, ruta: str) -> pd.DataFrame:
+        motor = self.motor_excel() if self._extension(ruta) != '.xls' else None
+        hojas = self.hojas_datos(ruta)
+        if len(hojas) <= 1:
+            # Una sola hoja de datos (o ninguna reconocible: la primera, como siempre)
+            return _leer_hoja_excel(ruta, hojas[0] if hojas else 0, motor, self.columnas)
+        
+        procesos = min(self.procesos or os.cpu_count() or 1, len(hojas))
+        argumentos = ([ruta] * len(hojas), hojas, [motor] * len(hojas), [self.columnas] * len(hojas))
+        if procesos > 1:
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                partes = list(pool.map(_leer_hoja_excel, *argumentos))
+        else:
+            partes = list(map(_leer_hoja_excel, *argumentos))
+        df = pd.concat(partes, ignore_index=True)
+        df[self.COLUMNA_SOCIEDAD] = pd.Categorical.from_codes(
+            np.repeat(np.arange(len(hojas)), [len(parte) for parte in partes]), categories=hojas
+        )
+        return df
+    
+    def _leer_csv(self, ruta: str) -> pd.DataFrame:
+        with open(ruta, encoding='utf-8', errors='ignore') as archivo:
+            separador = self._detectar_separador(archivo.readline())
+        return pd.read_csv(
+            ruta, sep=separador, usecols=self._filtro_columnas(),
+            dtype={columna: 'category' for columna in self.COLUMNAS_CATEGORICAS}
+        )
+    
+    def _leer_parquet(self, ruta: str) -> pd.DataFrame:
+        columnas = self.columnas
+        if columnas is not None:
+            import pyarrow.parquet as pq
+            disponibles = pq.ParquetFile(ruta).schema_arrow.names
+            columnas = [c for c in columnas if c in disponibles]
+        return pd.read_parquet(ruta, columns=columnas)
+    
+    @staticmethod
+    def _detectar_separador(encabezado: str) -> str:
+        return max([',', ';', '\t', '|'], key=encabezado.count)
+    
+    def _tipar(self, df: pd.DataFrame) -> pd.DataFrame:
+        for columna in self.COLUMNAS_CATEGORICAS:
+            if columna in df.columns and not isinstance(df[columna].dtype, pd.CategoricalDtype):
+                df[columna] = df[columna].astype('category')
+        invalidas = [self.sin_fechas_invalidas()]
+        for columna in self.COLUMNAS_FECHA:
+            if columna in df.columns and not pd.api.types.is_datetime64_any_dtype(df[columna]):
+                # Lo que no se pueda interpretar queda NaT y se cuenta en self.fechas.fallidas;
+                # el texto original se conserva aparte para la validación (hoja RECHAZOS)
+                previas = self.fechas.fallidas.get(columna, 0)
+                original = df[columna]
+                df[columna] = self.fechas.parsear(original, columna)
+                if self.fechas.fallidas.get(columna, 0) > previas:
+                    posiciones = np.flatnonzero(df[columna].isna().to_numpy() & original.notna().to_numpy()
+                                                & (original.astype(object) != "").to_numpy())
+                    invalidas.append(pd.DataFrame({
+                        'POSICION': posiciones, 'COLUMNA': columna,
+                        'VALOR': original.iloc[posiciones].astype(str).to_numpy(dtype=object)
+                    }))
+        self.fechas_invalidas = pd.concat(invalidas, ignore_index=True) if len(invalidas) > 1 else invalidas[0]
+        return df
+
+# ==================== VALIDACIÓN DE CALIDAD DE DATOS ====================
+# Revisa columnas completas de los documentos DR/DL (tipos, vacíos, montos negativos, fechas no
+# interpretables y letras sin Ref. Letra) antes de clasificar. La clasificación no cambia (los
+# valores inválidos siguen tomando su valor por defecto): cada fila afectada queda registrada
+# con su código de motivo para la hoja RECHAZOS y los conteos del RESUMEN
+class ValidadorDatos:
+    MOTIVOS = {
+        'SIN_SECTORISTA': "Sectorista vacío (se asigna SIN GESTOR)",
+        'MORA_VACIA': "Mora vacía (se toma 0)",
+        'MORA_NO_NUMERICA': "Mora no numérica (se toma 0)",
+        'MONTO_VACIO': "Imp. ML2 Pend. vacío (se toma 0)",
+        'MONTO_NO_NUMERICO': "Imp. ML2 Pend. no numérico (se toma 0)",
+        'MONTO_NEGATIVO': "Imp. ML2 Pend. negativo",
+        'VENCIMIENTO_INVALIDO': "Vencimiento neto no interpretable (sin fecha)",
+        'BASE_INVALIDA': "Base p.plazo pago no interpretable (sin fecha)",
+        'DL_SIN_REF_LETRA': "Letra (DL) sin Ref. Letra (no entra al reporte)",
+        'SIN_TIPO_CAMBIO': "Moneda sin tipo de cambio al mes de reporte (monto 0 en la moneda de reporte)",
+    }
+    EXCLUIDOS = {'DL_SIN_REF_LETRA'}
+    COLUMNAS_REQUERIDAS = ['Sectorista', 'Mora', 'Imp. ML2 Pend.', 'Vencimiento neto',
+                           'Base p.plazo pago', 'Ref. Letra']
+    COLUMNAS_CONTEXTO = ['SOCIEDAD', 'CD', 'Sectorista', 'Cuenta', 'Nº documento', 'Clv.ref.(cabecera) 2',
+                         'Ref. Letra', 'Imp. ML2 Pend.', 'Moneda', 'Mora']
+    
+    def __init__(self, limite_filas: Optional[int] = None, tipos_cambio: Optional[TiposCambio] = None,
+                 fecha_cambio: Optional[datetime] = None):
+        # limite_filas: filas que se conservan para la hoja RECHAZOS (los conteos son completos);
+        # tipos_cambio / fecha_cambio: la tabla y la fecha con que se convierten los montos
+        self.limite_filas = limite_filas or EscritorPorBloques.MAX_FILAS_HOJA
+        self.tipos_cambio = tipos_cambio
+        self.fecha_cambio = fecha_cambio
+        self.conteos: Dict[str, int] = {motivo: 0 for motivo in self.MOTIVOS}
+        self.filas_revisadas = 0
+        self.filas_observadas = 0
+        self.columnas_faltantes: List[str] = []
+        self._partes: List[pd.DataFrame] = []
+        self._guardadas = 0
+    
+    @property
+    def observaciones(self) -> int:
+        return sum(self.conteos.values())
+    
+    # ---------- Revisión de columnas ----------
+    @staticmethod
+    def _convertir(serie: pd.Series, tipo) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (vacío, no convertible, valor) con la semántica de _convertir_valor; las columnas de
+        # texto o categóricas se convierten un valor distinto a la vez
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            valores = serie.to_numpy(dtype=float, na_value=np.nan)
+            vacios = np.isnan(valores)
+            invalidos = ~vacios & ~np.isfinite(valores) if tipo is int else np.zeros(len(serie), dtype=bool)
+            return vacios, invalidos, valores
+        codigos, unicos = pd.factorize(serie)
+        vacios = np.array([_convertir_valor(v, None) is None for v in unicos] + [True])
+        convertidos = [_convertir_valor(v, tipo) for v in unicos]
+        invalidos = np.array([c is None and not vacio for c, vacio in zip(convertidos, vacios)] + [False])
+        valores = np.array([np.nan if c is None or tipo is str else float(c) for c in convertidos] + [np.nan])
+        return vacios[codigos], invalidos[codigos], valores[codigos]
+    
+    @staticmethod
+    def _fechas_no_interpretables(serie: pd.Series, columna: str, posiciones: np.ndarray,
+                                  fechas_invalidas: Optional[pd.DataFrame]) -> Tuple[np.ndarray, np.ndarray]:
+        # (filas, texto original): de la lectura si la columna ya viene tipada (LectorSAP),
+        # si no se interpreta cada valor distinto una vez
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            if fechas_invalidas is None or len(fechas_invalidas) == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+            tabla = fechas_invalidas[fechas_invalidas['COLUMNA'] == columna]
+            origen = tabla['POSICION'].to_numpy(dtype=np.int64)
+            locales = np.searchsorted(posiciones, origen)
+            presentes = locales < len(posiciones)
+            presentes[presentes] = posiciones[locales[presentes]] == origen[presentes]
+            return locales[presentes], tabla['VALOR'].to_numpy(dtype=object)[presentes]
+        resolutor = ResolutorFechas()
+        codigos, unicos = pd.factorize(serie)
+        fallidas = np.array([resolutor.fecha(v)[1] for v in unicos] + [False])
+        filas = np.flatnonzero(fallidas[codigos])
+        return filas, serie.iloc[filas].astype(str).to_numpy(dtype=object)
+    
+    def validar(self, df: pd.DataFrame, posiciones: Optional[np.ndarray] = None,
+                fechas_invalidas: Optional[pd.DataFrame] = None,
+                inicios_hoja: Optional[np.ndarray] = None) -> pd.DataFrame:
+        # df: documentos DR/DL; posiciones: su posición en el DataFrame leído (fechas_invalidas
+        # se refiere a esas posiciones); inicios_hoja: posición de la primera fila de cada hoja
+        # (LectorSAP.inicios_hoja / inicios_bloque) para numerar las filas del archivo
+        posiciones = np.arange(len(df)) if posiciones is None else np.asarray(posiciones, dtype=np.int64)
+        self.columnas_faltantes = sorted(set(self.columnas_faltantes) |
+                                         {c for c in self.COLUMNAS_REQUERIDAS if c not in df.columns})
+        marcas: List[Tuple[str, str, np.ndarray, Optional[np.ndarray]]] = []
+        
+        if 'Sectorista' in df.columns:
+            vacios, _, _ = self._convertir(df['Sectorista'], str)
+            marcas.append(('SIN_SECTORISTA', 'Sectorista', np.flatnonzero(vacios), None))
+        if 'Mora' in df.columns:
+            vacios, invalidos, _ = self._convertir(df['Mora'], int)
+            marcas.append(('MORA_VACIA', 'Mora', np.flatnonzero(vacios), None))
+            marcas.append(('MORA_NO_NUMERICA', 'Mora', np.flatnonzero(invalidos), None))
+        if 'Imp. ML2 Pend.' in df.columns:
+            vacios, invalidos, montos = self._convertir(df['Imp. ML2 Pend.'], float)
+            marcas.append(('MONTO_VACIO', 'Imp. ML2 Pend.', np.flatnonzero(vacios), None))
+            marcas.append(('MONTO_NO_NUMERICO', 'Imp. ML2 Pend.', np.flatnonzero(invalidos), None))
+            marcas.append(('MONTO_NEGATIVO', 'Imp. ML2 Pend.', np.flatnonzero(montos < 0), None))
+        for motivo, columna in (('VENCIMIENTO_INVALIDO', 'Vencimiento neto'), ('BASE_INVALIDA', 'Base p.plazo pago')):
+            if columna in df.columns:
+                filas, valores = self._fechas_no_interpretables(df[columna], columna, posiciones, fechas_invalidas)
+                marcas.append((motivo, columna, filas, valores))
+        
+        # Misma condición que ClasificadorVectorizado (ES_VALIDO) para las letras
+        es_dl = (df['CD'].astype(object) == 'DL').to_numpy() if 'CD' in df.columns else np.zeros(len(df), dtype=bool)
+        if 'Ref. Letra' in df.columns:
+            sin_referencia, _, _ = self._convertir(df['Ref. Letra'], str)
+        else:
+            sin_referencia = np.ones(len(df), dtype=bool)
+        marcas.append(('DL_SIN_REF_LETRA', 'Ref. Letra', np.flatnonzero(es_dl & sin_referencia), None))
+        if self.tipos_cambio is not None and self.tipos_cambio.activa and TiposCambio.COLUMNA_MONEDA in df.columns:
+            tasas = self.tipos_cambio.tasas_vigentes(self.tipos_cambio.monedas(df), self.fecha_cambio,
+                                                     TiposCambio.fin_de_mes(self.fecha_cambio))
+            marcas.append(('SIN_TIPO_CAMBIO', TiposCambio.COLUMNA_MONEDA, np.flatnonzero(np.isnan(tasas)), None))
+        
+        partes = []
+        for motivo, columna, filas, valores in marcas:
+            self.conteos[motivo] += len(filas)
+            if len(filas) == 0:
+                continue
+            if valores is None:
+                valores = (df[columna].iloc[filas].astype(object).where(lambda v: v.notna(), "")
+                           .astype(str).to_numpy(dtype=object))
+            partes.append(pd.DataFrame({'LOCAL': filas, 'MOTIVO': motivo, 'COLUMNA': columna, 'VALOR': valores}))
+        self.filas_revisadas += len(df)
+        if not partes:
+            return self._tabla_vacia()
+        
+        marcadas = pd.concat(partes, ignore_index=True).sort_values('LOCAL', kind='stable', ignore_index=True)
+        locales = marcadas['LOCAL'].to_numpy()
+        origen = posiciones[locales]
+        inicios = np.zeros(1, dtype=np.int64) if inicios_hoja is None else np.asarray(inicios_hoja)
+        inicio = inicios[np.maximum(np.searchsorted(inicios, origen, side='right') - 1, 0)]
+        self.filas_observadas += len(np.unique(locales))
+        contexto = df[[c for c in self.COLUMNAS_CONTEXTO if c in df.columns]].iloc[locales].reset_index(drop=True)
+        rechazos = pd.concat([
+            pd.DataFrame({
+                'FILA': origen - inicio + 2,  # fila en su hoja del archivo (1 = encabezado)
+                'MOTIVO': marcadas['MOTIVO'],
+                'DESCRIPCION': marcadas['MOTIVO'].map(self.MOTIVOS),
+                'EN_REPORTE': np.where(marcadas['MOTIVO'].isin(self.EXCLUIDOS), "NO", "SI"),
+                'COLUMNA': marcadas['COLUMNA'],
+                'VALOR': marcadas['VALOR']
+            }),
+            contexto
+        ], axis=1)
+        
+        disponibles = self.limite_filas - self._guardadas
+        if disponibles > 0:
+            self._partes.append(rechazos.iloc[:disponibles])
+            self._guardadas += min(disponibles, len(rechazos))
+        return rechazos
+    
+    @staticmethod
+    def _tabla_vacia() -> pd.DataFrame:
+        return pd.DataFrame(columns=['FILA', 'MOTIVO', 'DESCRIPCION', 'EN_REPORTE', 'COLUMNA', 'VALOR'])
+    
+    # ---------- Resultados ----------
+    def rechazos(self) -> pd.DataFrame:
+        # Filas de la hoja RECHAZOS (hasta limite_filas), una por fila y motivo
+        if not self._partes:
+            return self._tabla_vacia()
+        return pd.concat(self._partes, ignore_index=True) if len(self._partes) > 1 else self._partes[0]
+    
+    def estado(self) -> Dict:
+        # Conteos para guardar junto a la hoja RECHAZOS (InstantaneaARPC)
+        return {'conteos': self.conteos, 'filas_revisadas': self.filas_revisadas,
+                'filas_observadas': self.filas_observadas, 'columnas_faltantes': self.columnas_faltantes,
+                'limite_filas': self.limite_filas}
+    
+    @classmethod
+    def restaurar(cls, estado: Dict, rechazos: Optional[pd.DataFrame] = None) -> 'ValidadorDatos':
+        validador = cls(estado.get('limite_filas'))
+        validador.conteos.update(estado['conteos'])
+        validador.filas_revisadas = estado['filas_revisadas']
+        validador.filas_observadas = estado['filas_observadas']
+        validador.columnas_faltantes = list(estado['columnas_faltantes'])
+        if rechazos is not None and len(rechazos) > 0:
+            validador._partes = [rechazos]
+            validador._guardadas = len(rechazos)
+        return validador
+    
+    def filas_resumen(self) -> List[List]:
+        filas = [["Filas con observaciones de calidad", f"{self.filas_observadas:,} de {self.filas_revisadas:,}"]]
+        filas += [[f"Rechazos {motivo}", f"{cantidad:,}"] for motivo, cantidad in self.conteos.items() if cantidad]
+        if self.columnas_faltantes:
+            filas.append(["Columnas faltantes", ", ".join(self.columnas_faltantes)])
+        if self.observaciones > self._guardadas:
+            filas.append(["Hoja RECHAZOS", f"primeras {self._guardadas:,} de {self.observaciones:,} observaciones"])
+        return filas
+    
+    def imprimir(self):
+        if self.columnas_faltantes:
+            print(f"   ⚠️  Columnas faltantes: {', '.join(self.columnas_faltantes)}")
+        if self.observaciones == 0:
+            print("   ✅ Validación de calidad de datos - Sin observaciones")
+            return
+        print(f"   ⚠️  Validación de calidad de datos: {self.filas_observadas:,} filas con observaciones "
+              f"(hoja RECHAZOS)")
+        for motivo, cantidad in self.conteos.items():
+            if cantidad:
+                print(f"      • {motivo}: {cantidad:,}")
+
+# ==================== CACHÉ DE ARCHIVOS SAP ====================
+# Guarda en disco los DataFrames ya leídos y clasificados, por contenido del archivo
+class CacheSAP:
+    DIRECTORIO_DEFECTO = os.path.join(os.path.expanduser("~"), ".arpc_cache")
+    
+    def __init__(self, directorio: Optional[str] = None, limite_mb: float = 2048, activo: bool = True):
+        self.directorio = directorio or os.environ.get("ARPC_CACHE_DIR", self.DIRECTORIO_DEFECTO)
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self.activo = activo and os.environ.get("ARPC_SIN_CACHE", "") != "1"
+        self.formato = 'feather' if importlib.util.find_spec('pyarrow') else 'pickle'
+    
+    @property
+    def _ruta_indice(self) -> str:
+        return os.path.join(self.directorio, "indice.json")
+    
+    def clave_archivo(self, ruta: str) -> Optional[str]:
+        # Hash del contenido + tamaño; si ruta, tamaño y mtime no cambiaron se reutiliza el hash.
+        # None si el archivo no se puede leer (el lector informa el error, no la caché)
+        try:
+            estado = os.stat(ruta)
+            ruta_abs = os.path.abspath(ruta)
+            indice = self._leer_indice()
+            registro = indice.get(ruta_abs)
+            if registro and registro['tamaño'] == estado.st_size and registro['mtime'] == estado.st_mtime_ns:
+                return registro['clave']
+            
+            digest = hashlib.sha256()
+            with open(ruta, 'rb') as archivo:
+                for bloque in iter(lambda: archivo.read(1 << 20), b''):
+                    digest.update(bloque)
+        except (OSError, KeyError, TypeError):
+            return None
+        clave = f"{digest.hexdigest()[:32]}_{estado.st_size}"
+        
+        indice[ruta_abs] = {'tamaño': estado.st_size, 'mtime': estado.st_mtime_ns, 'clave': clave}
+        self._guardar_indice(indice)
+        return clave
+    
+    def cargar(self, clave: str) -> Optional[pd.DataFrame]:
+        if not self.activo:
+            return None
+        for extension in ('.feather', '.pkl'):
+            ruta = os.path.join(self.directorio, clave + extension)
+            if not os.path.exists(ruta):
+                continue
+            try:
+                if extension == '.feather':
+                    import pyarrow.feather as feather
+                    df = feather.read_table(ruta, memory_map=True).to_pandas()
+                else:
+                    df = pd.read_pickle(ruta)
+            except Exception:
+                # Dañado o eliminado mientras se leía (otro proceso): se trata como ausente
+                self._eliminar(ruta)
+                return None
+            try:
+                os.utime(ruta)  # marca de uso para el desalojo LRU
+            except OSError:
+                pass
+            return df
+        return None
+    
+    def guardar(self, clave: str, df: pd.DataFrame, conservar: Tuple[str, ...] = ()) -> bool:
+        # False si no se pudo guardar (disco lleno, permisos...): la próxima lectura es un fallo de caché.
+        # conservar: claves que el desalojo no debe eliminar (p. ej. la guardada justo antes)
+        if not self.activo:
+            return False
+        ruta = os.path.join(self.directorio, clave)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            df = df.reset_index(drop=True)
+            try:
+                if self.formato != 'feather':
+                    raise ValueError("pyarrow no instalado")
+                df.to_feather(temporal)
+                os.replace(temporal, ruta + '.feather')
+            except Exception:
+                # Columnas con tipos mixtos que Arrow no representa: se guarda con pickle
+                df.to_pickle(temporal)
+                os.replace(temporal, ruta + '.pkl')
+        except Exception:
+            self._eliminar(temporal)
+            return False
+        self._desalojar((clave,) + tuple(conservar))
+        return True
+    
+    @staticmethod
+    def _eliminar(ruta: str):
+        # Otro proceso puede haberlo eliminado o tenerlo abierto: se ignora
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+    
+    def _desalojar(self, conservar: Tuple[str, ...] = ()):
+        # Elimina los archivos usados hace más tiempo hasta respetar el límite de tamaño
+        # (nunca los de `conservar`, recién guardados)
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError:
+            return
+        archivos = []
+        for nombre in nombres:
+            clave, extension = os.path.splitext(nombre)
+            if extension in ('.feather', '.pkl'):
+                try:
+                    estado = os.stat(os.path.join(self.directorio, nombre))
+                except OSError:
+                    continue
+                archivos.append((estado.st_mtime, estado.st_size, nombre, clave in conservar))
+        total = sum(tamaño for _, tamaño, _, _ in archivos)
+        for _, tamaño, nombre, conservado in sorted(archivos):
+            if total <= self.limite_bytes:
+                break
+            if not conservado:
+                self._eliminar(os.path.join(self.directorio, nombre))
+                total -= tamaño
+    
+    def _leer_indice(self) -> Dict:
+        try:
+            with open(self._ruta_indice, encoding='utf-8') as archivo:
+                indice = json.load(archivo)
+        except (OSError, ValueError):
+            return {}
+        return indice if isinstance(indice, dict) else {}
+    
+    def _guardar_indice(self, indice: Dict):
+        # Archivo temporal + os.replace: otro proceso nunca lee un índice a medio escribir
+        if not self.activo:
+            return
+        temporal = f"{self._ruta_indice}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(temporal, 'w', encoding='utf-8') as archivo:
+                json.dump(indice, archivo)
+            os.replace(temporal, self._ruta_indice)
+        except OSError:
+            self._eliminar(temporal)
+
+# ==================== INSTANTÁNEA DE LA ÚLTIMA EJECUCIÓN ====================
+# Estado procesado en Arrow IPC sin comprimir, que se abre con memory_map sin volver a leer
+# ni clasificar el archivo SAP: filas de los documentos con la clasificación como columnas
+# de diccionario (códigos categóricos), cubos agregados y rechazos; estadísticas y metadatos
+# de la ejecución en ejecucion.json
+class InstantaneaARPC:
+    DIRECTORIO_DEFECTO = os.path.join(os.path.expanduser("~"), ".arpc_ultima_ejecucion")
+    VERSION = 2
+    PREFIJO = "ARPC:"  # columnas de clasificación (sin choques con las columnas del archivo)
+    
+    def __init__(self, directorio: Optional[str] = None):
+        self.directorio = directorio or os.environ.get("ARPC_INSTANTANEA", self.DIRECTORIO_DEFECTO)
+    
+    @staticmethod
+    def disponible() -> bool:
+        return importlib.util.find_spec('pyarrow') is not None
+    
+    @property
+    def _ruta_metadatos(self) -> str:
+        return os.path.join(self.directorio, "ejecucion.json")
+    
+    def existe(self) -> bool:
+        return os.path.exists(self._ruta_metadatos)
+    
+    @staticmethod
+    def _escribir(ruta: str, df: pd.DataFrame):
+        import pyarrow as pa
+        tabla = pa.Table.from_pandas(ProcesadorARPC._para_parquet(df.reset_index(drop=True)),
+                                     preserve_index=False)
+        with pa.OSFile(ruta + '.tmp', 'wb') as destino:
+            with pa.ipc.new_file(destino, tabla.schema) as escritor:
+                escritor.write_table(tabla)
+        os.replace(ruta + '.tmp', ruta)
+    
+    @staticmethod
+    def _leer(ruta: str) -> pd.DataFrame:
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.memory_map(ruta)).read_all().to_pandas()
+    
+    def guardar(self, procesador: 'ProcesadorARPC'):
+        gestor = procesador.gestor
+        documentos = gestor.columnas_origen()
+        for columna, valores in gestor.categoricas.items():
+            documentos[self.PREFIJO + columna] = valores
+        documentos[self.PREFIJO + 'MONTO'] = gestor.monto
+        documentos[self.PREFIJO + 'MONTO_ORIGEN'] = gestor.monto_origen
+        validacion = procesador.validacion
+        tablas = {
+            'documentos': documentos,
+            'cubo': gestor.obtener_cubo(),
+            'cubo_sociedades': gestor.obtener_cubo_sociedades(),
+            'cubo_monedas': gestor.obtener_cubo_monedas(),
+            'rechazos': validacion.rechazos() if validacion is not None else None
+        }
+        
+        # Archivos nuevos con otro prefijo y ejecucion.json al final: una instantánea a medio
+        # escribir nunca reemplaza a la anterior
+        os.makedirs(self.directorio, exist_ok=True)
+        identificador = uuid.uuid4().hex[:12]
+        archivos = {}
+        for nombre, tabla in tablas.items():
+            if tabla is None or len(tabla) == 0:
+                continue
+            archivos[nombre] = f"{identificador}_{nombre}.arrow"
+            self._escribir(os.path.join(self.directorio, archivos[nombre]), tabla)
+        metadatos = {
+            'version': self.VERSION,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'archivo': os.path.abspath(procesador.archivo_actual) if procesador.archivo_actual else None,
+            'mes_reporte': procesador.mes_reporte.isoformat(),
+            'moneda_reporte': gestor.moneda_reporte,
+            'inicio_semana': procesador.inicio_semana,
+            'reglas': gestor.reglas.config if gestor.reglas is not None else None,
+            'total_registros': procesador.total_registros,
+            'total_columnas': procesador.total_columnas,
+            'tiempo_proceso': procesador.tiempo_proceso,
+            'estadisticas': gestor.obtener_estadisticas(),
+            'validacion': validacion.estado() if validacion is not None else None,
+            'archivos': archivos
+        }
+        with open(self._ruta_metadatos + '.tmp', 'w', encoding='utf-8') as archivo:
+            json.dump(metadatos, archivo, ensure_ascii=False, indent=2)
+        os.replace(self._ruta_metadatos + '.tmp', self._ruta_metadatos)
+        
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.arrow') and not nombre.startswith(identificador):
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError:
+                    pass  # abierto (memory_map) por otra sesión: se elimina en el próximo guardado
+    
+    def cargar(self) -> Dict:
+        # {'metadatos', 'gestor', 'validacion'}: el gestor queda listo para tablas, exportación y detalle
+        if not self.existe():
+            raise ErrorProcesamiento("No hay una ejecución guardada para reabrir")
+        with open(self._ruta_metadatos, encoding='utf-8') as archivo:
+            metadatos = json.load(archivo)
+        if metadatos.get('version') != self.VERSION:
+            raise ErrorProcesamiento("La ejecución guardada es de otra versión del sistema; vuelva a procesar el archivo")
+        tablas = {nombre: self._leer(os.path.join(self.directorio, archivo))
+                  for nombre, archivo in metadatos['archivos'].items()}
+        
+        documentos = tablas['documentos']
+        clasificacion = [c for c in documentos.columns if c.startswith(self.PREFIJO)]
+        montos = {self.PREFIJO + 'MONTO', self.PREFIJO + 'MONTO_ORIGEN'}
+        categoricas = {
+            columna[len(self.PREFIJO):]: documentos[columna].array
+            for columna in clasificacion if columna not in montos
+        }
+        gestor = GestorDocumentos()
+        gestor.inicio_semana = metadatos['inicio_semana']
+        gestor.reglas = ReglasClasificacion(metadatos['reglas']) if metadatos.get('reglas') else None
+        gestor.restaurar(
+            documentos.drop(columns=clasificacion), categoricas,
+            documentos[self.PREFIJO + 'MONTO'].to_numpy(dtype=np.float64),
+            documentos[self.PREFIJO + 'MONTO_ORIGEN'].to_numpy(dtype=np.float64),
+            datetime.fromisoformat(metadatos['mes_reporte']), metadatos['moneda_reporte'],
+            {
+                'cubo': self._cubo(tablas.get('cubo'), GestorDocumentos.CLAVES_CUBO),
+                'cubo_sociedades': self._cubo(tablas.get('cubo_sociedades'),
+                                              [LectorSAP.COLUMNA_SOCIEDAD] + GestorDocumentos.CLAVES_CUBO),
+                'cubo_monedas': self._cubo(tablas.get('cubo_monedas'), ['MONEDA'] + GestorDocumentos.CLAVES_CUBO)
+            }
+        )
+        validacion = None
+        if metadatos['validacion'] is not None:
+            validacion = ValidadorDatos.restaurar(metadatos['validacion'], tablas.get('rechazos'))
+        return {'metadatos': metadatos, 'gestor': gestor, 'validacion': validacion}
+    
+    @staticmethod
+    def _cubo(cubo: Optional[pd.DataFrame], claves: List[str]) -> Optional[pd.DataFrame]:
+        # Claves como objetos con None (igual que GestorDocumentos._agregar_cubo)
+        if cubo is None:
+            return None
+        for columna in claves:
+            cubo[columna] = cubo[columna].astype(object).where(cubo[columna].notna(), None)
+        return cubo
+
+# ==================== ESCRITURA DE REPORTES ====================
+# Escribe fila a fila (memoria constante): xlsxwriter en modo constant_memory si está
+# instalado, si no openpyxl write-only; o CSV por anexado
+class EscritorPorBloques:
+    MAX_FILAS_HOJA = 1_048_575  # límite de filas de Excel (sin el encabezado)
+    
+    def __init__(self, ruta: str, motor: Optional[str] = None):
+        self.ruta = ruta
+        self.es_csv = ruta.lower().endswith('.csv')
+        self.motor = 'csv' if self.es_csv else (motor or self.motor_excel())
+        self.filas_escritas = 0
+        self._encabezado = None
+        self._hoja = None
+        self._filas_hoja = 0
+        self._hojas_datos = 0
+        if self.es_csv:
+            self._archivo = open(ruta, 'w', newline='', encoding='utf-8')
+        elif self.motor == 'xlsxwriter':
+            import xlsxwriter
+            self._libro = xlsxwriter.Workbook(ruta, {
+                'constant_memory': True, 'default_date_format': 'dd/mm/yyyy',
+                'nan_inf_to_errors': True
+            })
+        else:
+            from openpyxl import Workbook
+            self._libro = Workbook(write_only=True)
+    
+    @staticmethod
+    def motor_excel() -> str:
+        return 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+    
+    def _crear_hoja(self, nombre: str) -> list:
+        if self.motor == 'xlsxwriter':
+            return [self._libro.add_worksheet(nombre), 0]
+        return [self._libro.create_sheet(nombre), 0]
+    
+    def _escribir_fila(self, hoja: list, fila):
+        if self.motor == 'xlsxwriter':
+            hoja[0].write_row(hoja[1], 0, fila)
+        else:
+            hoja[0].append(list(fila))
+        hoja[1] += 1
+    
+    def agregar(self, df: pd.DataFrame):
+        if self.es_csv:
+            df.to_csv(self._archivo, header=self._encabezado is None, index=False)
+        else:
+            valores = df.astype(object).where(df.notna(), None)
+            for fila in valores.itertuples(index=False, name=None):
+                if self._hoja is None or self._filas_hoja >= self.MAX_FILAS_HOJA:
+                    self._nueva_hoja_datos(list(df.columns))
+                self._escribir_fila(self._hoja, fila)
+                self._filas_hoja += 1
+        self._encabezado = list(df.columns)
+        self.filas_escritas += len(df)
+    
+    def _nueva_hoja_datos(self, columnas: List[str]):
+        self._hojas_datos += 1
+        sufijo = "" if self._hojas_datos == 1 else f"_{self._hojas_datos}"
+        self._hoja = self._crear_hoja(f"DATOS_COMPLETOS{sufijo}")
+        self._escribir_fila(self._hoja, columnas)
+        self._filas_hoja = 0
+    
+    def cerrar(self, generador: 'GeneradorTablasDinamicas', filas_resumen: List[List],
+               rechazos: Optional[pd.DataFrame] = None) -> str:
+        # Escribe las tablas dinámicas, el RESUMEN y los RECHAZOS de la validación;
+        # en modo CSV van a un .xlsx aparte
+        if self.es_csv:
+            self._archivo.close()
+            ruta_tablas = os.path.splitext(self.ruta)[0] + "_TABLAS.xlsx"
+            with pd.ExcelWriter(ruta_tablas, engine='openpyxl') as writer:
+                ProcesadorARPC._escribir_tablas_dinamicas(writer, generador)
+                pd.DataFrame(filas_resumen, columns=['INDICADOR', 'VALOR']).to_excel(
+                    writer, sheet_name='RESUMEN', index=False
+                )
+                if rechazos is not None:
+                    rechazos.to_excel(writer, sheet_name='RECHAZOS', index=False)
+            return ruta_tablas
+        
+        if self._hoja is None:
+            self._nueva_hoja_datos(self._encabezado or [])
+        # Misma selección de columnas que el reporte estándar (y una hoja por sociedad)
+        for nombre, *tablas in generador.hojas():
+            hoja = self._crear_hoja(nombre)
+            for tabla in tablas:
+                if tabla is not None:
+                    self._escribir_fila(hoja, [tabla.index.name] + [str(c) for c in tabla.columns])
+                    for indice, fila in zip(tabla.index, tabla.itertuples(index=False, name=None)):
+                        self._escribir_fila(hoja, [indice] + [float(v) for v in fila])
+                    hoja[1] += 2
+        resumen = self._crear_hoja('RESUMEN')
+        self._escribir_fila(resumen, ['INDICADOR', 'VALOR'])
+        for fila in filas_resumen:
+            self._escribir_fila(resumen, fila)
+        if rechazos is not None:
+            hoja = self._crear_hoja('RECHAZOS')
+            self._escribir_fila(hoja, [str(c) for c in rechazos.columns])
+            valores = rechazos.astype(object).where(rechazos.notna(), None)
+            for fila in valores.itertuples(index=False, name=None):
+                self._escribir_fila(hoja, fila)
+        
+        if self.motor == 'xlsxwriter':
+            self._libro.close()
+        else:
+            self._libro.save(self.ruta)
+        return self.ruta
+
+# ==================== PROCESAMIENTO INCREMENTAL ====================
+# Las exportaciones diarias son casi idénticas: se guarda la clasificación de la ejecución
+# anterior por documento y solo se reclasifican las filas nuevas o modificadas
+class EstadoIncremental:
+    COLUMNAS_CLAVE = ['Clv.ref.(cabecera) 2', 'Ref. Letra', 'CD', 'SOCIEDAD']
+    COLUMNAS_CLASIFICACION = ['CD', 'SECTORISTA', 'MONTO', 'MONEDA', 'MONTO_ORIGEN', 'SIN_TASA', 'DIAS_MORA',
+                              'TRAMO', 'ESTATUS 1', 'PROYECCIÓN', 'ES_VALIDO']
+    
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        # Mismo almacenamiento que la caché, pero sin límite de tamaño ni ARPC_SIN_CACHE
+        self.almacen = CacheSAP(directorio, limite_mb=1e9)
+        self.almacen.activo = True
+        self.resumen: Dict = {}
+        self.movimientos: Optional[pd.DataFrame] = None
+        self.cubo: Optional[pd.DataFrame] = None
+        self._filas: Optional[pd.DataFrame] = None
+        self._firma = None
+    
+    @property
+    def _ruta_estado(self) -> str:
+        return os.path.join(self.directorio, "estado.json")
+    
+    @classmethod
+    def identificar(cls, df: pd.DataFrame, columnas_extra: Tuple[str, ...] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        # Clave: identidad del documento (las repetidas se distinguen por su número de aparición).
+        # Huella: contenido de las columnas que usan las reglas; si cambia, la fila se reclasifica
+        hashes = {
+            columna: pd.util.hash_pandas_object(
+                df[columna], index=False, categorize=isinstance(df[columna].dtype, pd.CategoricalDtype)
+            ).to_numpy()
+            for columna in LectorSAP.COLUMNAS_REGLAS + list(columnas_extra) if columna in df.columns
+        }
+        identidad = cls._combinar([hashes[c] for c in cls.COLUMNAS_CLAVE if c in hashes], len(df))
+        aparicion = pd.Series(identidad).groupby(identidad, sort=False).cumcount().to_numpy()
+        claves = cls._combinar([identidad, aparicion.astype(np.uint64)], len(df))
+        return claves, cls._combinar(list(hashes.values()), len(df))
+    
+    @staticmethod
+    def _combinar(hashes: List[np.ndarray], filas: int) -> np.ndarray:
+        combinado = np.full(filas, 0x345678, dtype=np.uint64)
+        for valores in hashes:
+            combinado = (combinado ^ valores) * np.uint64(1000003)
+        return combinado
+    
+    def _leer_estado(self) -> Dict:
+        try:
+            with open(self._ruta_estado, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return {}
+    
+    def clasificar(self, clasificador: ClasificadorVectorizado, df_filtrado: pd.DataFrame) -> pd.DataFrame:
+        unidad = clasificador.reglas.columna_unidad
+        extra = tuple(c for c in (unidad, LectorSAP.COLUMNA_SOCIEDAD) if c)
+        claves, huellas = self.identificar(df_filtrado, extra)
+        self._firma = clasificador.firma()
+        previo = cubo_previo = None
+        if self._leer_estado().get('firma') == self._firma:
+            previo = self.almacen.cargar('filas')
+            cubo_previo = self.almacen.cargar('cubo')
+        
+        if previo is None or cubo_previo is None or not pd.Index(previo['CLAVE']).is_unique:
+            # Sin estado anterior (o con otras reglas): clasificación completa
+            clasificacion = clasificador.clasificar(df_filtrado)
+            self.resumen = {'nuevas': len(df_filtrado), 'modificadas': 0, 'sin_cambios': 0,
+                            'eliminadas': 0, 'estado_previo': False}
+            self.movimientos = None
+            self.cubo = None
+        else:
+            # Unión por hash de la clave contra las filas de la ejecución anterior
+            posiciones = pd.Index(previo['CLAVE']).get_indexer(claves)
+            encontradas = posiciones >= 0
+            iguales = encontradas.copy()
+            iguales[encontradas] = previo['HUELLA'].to_numpy()[posiciones[encontradas]] == huellas[encontradas]
+            
+            reutilizadas = previo[self.COLUMNAS_CLASIFICACION].iloc[posiciones[iguales]]
+            recalculadas = clasificador.clasificar(df_filtrado[~iguales])
+            if len(recalculadas) == 0:
+                clasificacion = reutilizadas
+            else:
+                orden = np.argsort(np.concatenate([np.flatnonzero(iguales), np.flatnonzero(~iguales)]), kind='stable')
+                clasificacion = pd.concat([reutilizadas.reset_index(drop=True),
+                                           recalculadas.reset_index(drop=True)], ignore_index=True).take(orden)
+            clasificacion.index = df_filtrado.index
+            
+            # Delta del cubo: se restan las filas anteriores que ya no están igual y se suman las nuevas
+            conservadas = np.zeros(len(previo), dtype=bool)
+            conservadas[posiciones[iguales]] = True
+            retiradas = previo[~conservadas]
+            self.cubo = self._aplicar_delta(cubo_previo, recalculadas, retiradas)
+            
+            modificadas = encontradas & ~iguales
+            self.resumen = {
+                'nuevas': int((~encontradas).sum()), 'modificadas': int(modificadas.sum()),
+                'sin_cambios': int(iguales.sum()), 'eliminadas': int(len(previo) - encontradas.sum()),
+                'estado_previo': True
+            }
+            self.movimientos = self._movimientos(
+                previo.iloc[posiciones[modificadas]], clasificacion[modificadas]
+            )
+        
+        self._filas = clasificacion.reset_index(drop=True)
+        self._filas.insert(0, 'HUELLA', huellas)
+        self._filas.insert(0, 'CLAVE', claves)
+        return clasificacion
+    
+    @staticmethod
+    def _agregar(clasificacion: pd.DataFrame, signo: int = 1) -> Optional[pd.DataFrame]:
+        validas = clasificacion[clasificacion['ES_VALIDO'].to_numpy(dtype=bool)]
+        if len(validas) == 0:
+            return None
+        cubo = (validas.groupby(GestorDocumentos.CLAVES_CUBO, sort=False, dropna=False)['MONTO']
+                .agg(['size', 'sum']).reset_index()
+                .rename(columns={'size': 'DOCUMENTOS', 'sum': 'MONTO'}))
+        cubo[['DOCUMENTOS', 'MONTO']] *= signo
+        return cubo
+    
+    def _aplicar_delta(self, cubo_previo: pd.DataFrame, agregadas: pd.DataFrame,
+                       retiradas: pd.DataFrame) -> pd.DataFrame:
+        delta = [self._agregar(agregadas), self._agregar(retiradas, -1)]
+        if all(parte is None for parte in delta):
+            return cubo_previo
+        cubo = GestorConsolidado([cubo_previo] + delta).obtener_cubo()
+        return cubo[cubo['DOCUMENTOS'] != 0].reset_index(drop=True)
+    
+    @staticmethod
+    def _movimientos(anteriores: pd.DataFrame, actuales: pd.DataFrame) -> pd.DataFrame:
+        # Documentos modificados que cambiaron de semana o de sectorista
+        cambios = pd.DataFrame({
+            'PROYECCIÓN ANTERIOR': anteriores['PROYECCIÓN'].to_numpy(dtype=object),
+            'PROYECCIÓN': actuales['PROYECCIÓN'].to_numpy(dtype=object),
+            'SECTORISTA ANTERIOR': anteriores['SECTORISTA'].to_numpy(dtype=object),
+            'SECTORISTA': actuales['SECTORISTA'].to_numpy(dtype=object),
+            'MONTO': actuales['MONTO'].to_numpy(dtype=np.float64)
+        })
+        movidos = cambios[(cambios['PROYECCIÓN ANTERIOR'] != cambios['PROYECCIÓN'])
+                          | (cambios['SECTORISTA ANTERIOR'] != cambios['SECTORISTA'])]
+        return (movidos.groupby(list(movidos.columns[:4]), sort=False, dropna=False)['MONTO']
+                .agg(['size', 'sum']).reset_index()
+                .rename(columns={'size': 'DOCUMENTOS', 'sum': 'MONTO'})
+                .sort_values('MONTO', ascending=False, ignore_index=True))
+    
+    def guardar(self, archivo: str, mes_reporte: datetime, cubo: pd.DataFrame):
+        # Se llama cuando la ejecución terminó bien: la próxima exportación se compara con esta.
+        # cubo: el del gestor, usado cuando no hubo estado anterior al que aplicar el delta
+        if self._filas is None:
+            return
+        if self.cubo is None:
+            self.cubo = cubo
+        if not (self.almacen.guardar('filas', self._filas) and self.almacen.guardar('cubo', self.cubo)):
+            # Sin estado completo la próxima ejecución no puede usar el anterior: clasificación completa
+            CacheSAP._eliminar(self._ruta_estado)
+            raise ErrorProcesamiento(f"No se pudo guardar el estado incremental en {self.directorio}")
+        ruta_movimientos = os.path.join(self.directorio, "movimientos.csv")
+        if self.movimientos is not None:
+            self.movimientos.to_csv(ruta_movimientos, index=False, encoding='utf-8-sig')
+        elif os.path.exists(ruta_movimientos):
+            os.remove(ruta_movimientos)
+        with open(self._ruta_estado, 'w', encoding='utf-8') as archivo_estado:
+            json.dump({'firma': self._firma, 'archivo': os.path.abspath(archivo),
+                       'mes_reporte': mes_reporte.strftime("%Y-%m"),
+                       'fecha': datetime.now().isoformat(timespec='seconds'),
+                       'filas': len(self._filas)}, archivo_estado, ensure_ascii=False, indent=2)
+        self._filas = None
+    
+    def imprimir(self):
+        r = self.resumen
+        if not r.get('estado_previo'):
+            print(f"   ✅ Incremental: sin ejecución anterior, {r['nuevas']:,} filas clasificadas")
+            return
+        print(f"   ✅ Incremental: {r['sin_cambios']:,} sin cambios, {r['nuevas']:,} nuevas, "
+              f"{r['modificadas']:,} modificadas, {r['eliminadas']:,} eliminadas")
+        if self.movimientos is None or len(self.movimientos) == 0:
+            return
+        print(f"      Movimientos entre semanas / sectoristas:")
+        for _, fila in self.movimientos.head(10).iterrows():
+            semana = (f"{fila['PROYECCIÓN ANTERIOR']} → {fila['PROYECCIÓN']}"
+                      if fila['PROYECCIÓN ANTERIOR'] != fila['PROYECCIÓN'] else fila['PROYECCIÓN'])
+            gestor = (f"{fila['SECTORISTA ANTERIOR']} → {fila['SECTORISTA']}"
+                      if fila['SECTORISTA ANTERIOR'] != fila['SECTORISTA'] else fila['SECTORISTA'])
+            print(f"      • {gestor}: {semana} ({fila['DOCUMENTOS']:,} docs, $ {fila['MONTO']:,.2f})")
+        if len(self.movimientos) > 10:
+            print(f"      ... ({len(self.movimientos) - 10} movimientos adicionales)")
+
+# ==================== HISTORIAL DE EJECUCIONES (SQLite) ====================
+# Cada ejecución queda en una base local (documentos enriquecidos y cubo agregado por mes de
+# reporte y archivo) para consultar tendencias de varios meses sin releer ningún Excel
+class HistorialARPC:
+    RUTA_DEFECTO = os.path.join(os.path.expanduser("~"), ".arpc_historial.db")
+    # Columnas del archivo SAP que se guardan con cada documento
+    COLUMNAS_ORIGEN = {'Clv.ref.(cabecera) 2': 'clave', 'Ref. Letra': 'ref_letra',
+                       'Cuenta': 'cuenta', 'Nº documento': 'documento', 'Mora': 'dias_mora'}
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS ejecuciones (
+            mes TEXT NOT NULL, archivo TEXT NOT NULL, ruta TEXT, fecha TEXT NOT NULL,
+            registros INTEGER, documentos INTEGER, monto REAL, firma TEXT,
+            PRIMARY KEY (mes, archivo)
+        );
+        CREATE TABLE IF NOT EXISTS documentos (
+            mes TEXT NOT NULL, archivo TEXT NOT NULL, clave TEXT, ref_letra TEXT, cuenta TEXT,
+            documento TEXT, cd TEXT, sectorista TEXT, monto REAL, dias_mora INTEGER,
+            tramo TEXT, estatus TEXT, proyeccion TEXT
+        );
+        CREATE TABLE IF NOT EXISTS agregados (
+            mes TEXT NOT NULL, archivo TEXT NOT NULL, sectorista TEXT, cd TEXT, estatus TEXT,
+            proyeccion TEXT, documentos INTEGER, monto REAL
+        );
+        CREATE INDEX IF NOT EXISTS ix_documentos_mes ON documentos (mes, archivo);
+        CREATE INDEX IF NOT EXISTS ix_documentos_sectorista ON documentos (sectorista, mes, proyeccion);
+        CREATE INDEX IF NOT EXISTS ix_documentos_proyeccion ON documentos (proyeccion, mes);
+        CREATE INDEX IF NOT EXISTS ix_agregados_mes ON agregados (mes, archivo);
+        CREATE INDEX IF NOT EXISTS ix_agregados_sectorista ON agregados (sectorista, proyeccion, mes);
+        CREATE INDEX IF NOT EXISTS ix_agregados_proyeccion ON agregados (proyeccion, mes);
+    """
+    
+    def __init__(self, ruta: Optional[str] = None):
+        self.ruta = ruta or os.environ.get("ARPC_HISTORIAL", self.RUTA_DEFECTO)
+        directorio = os.path.dirname(os.path.abspath(self.ruta))
+        os.makedirs(directorio, exist_ok=True)
+        with contextlib.closing(self._conectar()) as conexion:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.executescript(self.ESQUEMA)
+    
+    def _conectar(self) -> sqlite3.Connection:
+        # timeout: los procesos de trabajo del modo lote pueden escribir a la vez
+        conexion = sqlite3.connect(self.ruta, timeout=60)
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        conexion.execute("PRAGMA cache_size=-65536")  # 64 MB: índices de inserciones masivas en memoria
+        return conexion
+    
+    @staticmethod
+    def _a_lista(valores, tipo=None) -> list:
+        # Columna a lista de valores nativos con None en lugar de NaN (lo que acepta sqlite3)
+        serie = pd.Series(valores)
+        if tipo is not None:
+            serie = pd.to_numeric(serie, errors='coerce')
+            if tipo is int:
+                serie = np.trunc(serie).astype('Int64')
+        serie = serie.astype(object)
+        return serie.where(serie.notna(), None).tolist()
+    
+    def _filas_documentos(self, gestor: 'GestorDocumentos') -> Iterator[tuple]:
+        origen = gestor.columnas_origen(list(self.COLUMNAS_ORIGEN))
+        columnas = {}
+        for columna, nombre in self.COLUMNAS_ORIGEN.items():
+            if columna not in origen.columns:
+                columnas[nombre] = [None] * len(gestor)
+            else:
+                columnas[nombre] = self._a_lista(origen[columna], int if nombre == 'dias_mora' else None)
+        columnas['monto'] = self._a_lista(gestor.montos(), float)
+        for columna, nombre in [('CD', 'cd'), ('SECTORISTA', 'sectorista'), ('TRAMO', 'tramo'),
+                                ('ESTATUS 1', 'estatus'), ('PROYECCIÓN', 'proyeccion')]:
+            columnas[nombre] = self._a_lista(np.asarray(gestor.columna(columna), dtype=object))
+        orden = ['clave', 'ref_letra', 'cuenta', 'documento', 'cd', 'sectorista',
+                 'monto', 'dias_mora', 'tramo', 'estatus', 'proyeccion']
+        return zip(*(columnas[nombre] for nombre in orden))
+    
+    def registrar(self, archivo: str, mes_reporte: datetime, gestor, registros: int = 0,
+                  firma: str = "") -> int:
+        # Reemplaza la ejecución anterior del mismo mes y archivo; con GestorConsolidado
+        # (procesamiento por bloques) solo se guarda el cubo agregado
+        mes = mes_reporte.strftime("%Y-%m")
+        nombre = os.path.basename(archivo)
+        cubo = gestor.obtener_cubo()
+        stats = gestor.obtener_estadisticas()
+        with contextlib.closing(self._conectar()) as conexion, conexion:
+            for tabla in ('documentos', 'agregados', 'ejecuciones'):
+                conexion.execute(f"DELETE FROM {tabla} WHERE mes = ? AND archivo = ?", (mes, nombre))
+            documentos = 0
+            if isinstance(gestor, GestorDocumentos) and len(gestor) > 0:
+                cursor = conexion.executemany(
+                    "INSERT INTO documentos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((mes, nombre) + fila for fila in self._filas_documentos(gestor))
+                )
+                documentos = cursor.rowcount
+            conexion.executemany(
+                "INSERT INTO agregados VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([mes] * len(cubo), [nombre] * len(cubo),
+                    *(self._a_lista(cubo[c]) for c in GestorDocumentos.CLAVES_CUBO),
+                    self._a_lista(cubo['DOCUMENTOS'], int), self._a_lista(cubo['MONTO'], float))
+            )
+            conexion.execute(
+                "INSERT INTO ejecuciones VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (mes, nombre, os.path.abspath(archivo), datetime.now().isoformat(timespec='seconds'),
+                 int(registros), stats['total'], stats['monto_total'], firma)
+            )
+        return documentos
+    
+    def _consultar(self, sql: str, parametros: tuple = ()) -> pd.DataFrame:
+        with contextlib.closing(self._conectar()) as conexion:
+            return pd.read_sql_query(sql, conexion, params=parametros)
+    
+    def tendencia(self, sectorista: Optional[str] = None, proyeccion: str = "SEMANA_1",
+                  meses: int = 12, estatus: Optional[str] = "PROYECTADO") -> pd.DataFrame:
+        # Documentos y monto de una proyección por mes (los últimos `meses` meses registrados)
+        condiciones, parametros = ["proyeccion = ?"], [proyeccion]
+        if sectorista:
+            condiciones.append("sectorista = ?")
+            parametros.append(sectorista)
+        if estatus:
+            condiciones.append("estatus = ?")
+            parametros.append(estatus)
+        df = self._consultar(
+            f"SELECT mes AS MES, SUM(documentos) AS DOCUMENTOS, SUM(monto) AS MONTO FROM agregados "
+            f"WHERE {' AND '.join(condiciones)} GROUP BY mes ORDER BY mes DESC LIMIT ?",
+            tuple(parametros) + (int(meses),)
+        )
+        return df.iloc[::-1].reset_index(drop=True)
+    
+    def ejecuciones(self) -> pd.DataFrame:
+        return self._consultar("SELECT * FROM ejecuciones ORDER BY mes, archivo")
+    
+    def documentos(self, mes: str, sectorista: Optional[str] = None,
+                   proyeccion: Optional[str] = None) -> pd.DataFrame:
+        condiciones, parametros = ["mes = ?"], [mes]
+        for columna, valor in (('sectorista', sectorista), ('proyeccion', proyeccion)):
+            if valor:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+        return self._consultar(f"SELECT * FROM documentos WHERE {' AND '.join(condiciones)}", tuple(parametros))
+
+# ==================== BACKTESTING DE PROYECCIONES ====================
+# Compara las semanas proyectadas de un mes con exportaciones posteriores: un documento que ya
+# no aparece en una exportación se cobró entre el corte anterior y el día previo a esa exportación
+class BacktestProyecciones:
+    PENDIENTE = "PENDIENTE"          # sigue en la última exportación
+    SIN_SEMANA = "SIN_SEMANA"        # cobrado, pero entre cortes que abarcan más de una semana
+    POSTERIOR = "MES_SIGUIENTE"      # cobrado después del mes de reporte
+    DIMENSIONES = ['SECTORISTA', 'TRAMO', 'CD']
+    COLUMNAS_REFERENCIA = ['Clv.ref.(cabecera) 2', 'Ref. Letra']
+    
+    def __init__(self, mes_reporte: datetime, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, tipos_cambio: Optional[TiposCambio] = None):
+        # tipos_cambio: la misma tabla que en la proyección, para que los montos coincidan
+        self.clasificador = ClasificadorVectorizado(mes_reporte, inicio_semana, reglas, tipos_cambio)
+        self.calendario = self.clasificador.calendario
+        self.documentos: Optional[pd.DataFrame] = None
+        self.sin_tasa: Optional[pd.DataFrame] = None
+        self.cortes: List[datetime] = []
+    
+    @staticmethod
+    def _filtrar(df: pd.DataFrame) -> pd.DataFrame:
+        return df[df['CD'].isin(['DR', 'DL']).to_numpy()]
+    
+    def proyectar(self, df: pd.DataFrame) -> int:
+        # Documentos del mes con semana proyectada, identificados con la clave del modo incremental
+        df_filtrado = self._filtrar(df)
+        clasificacion = self.clasificador.clasificar(df_filtrado)
+        claves, _ = EstadoIncremental.identificar(df_filtrado)
+        # Todas las semanas que puede dar el clasificador: las reglas por mora pueden proyectar
+        # semanas que el calendario del mes no tiene (p. ej. SEMANA_6 con bloques de 7 días)
+        seleccion = (clasificacion['ES_VALIDO'].to_numpy(dtype=bool)
+                     & clasificacion['PROYECCIÓN'].isin(CalendarioMes.ETIQUETAS).to_numpy())
+        documentos = clasificacion.loc[seleccion, ['CD', 'SECTORISTA', 'MONTO', 'MONEDA', 'MONTO_ORIGEN',
+                                                   'TRAMO', 'ESTATUS 1', 'PROYECCIÓN']].reset_index(drop=True)
+        for columna in self.COLUMNAS_REFERENCIA:
+            if columna in df_filtrado.columns:
+                documentos[columna] = df_filtrado[columna].to_numpy()[seleccion]
+        documentos['CLAVE'] = claves[seleccion]
+        documentos['SEMANA_COBRO'] = self.PENDIENTE
+        documentos['CORTE'] = pd.NaT
+        self.documentos = documentos
+        self.sin_tasa = ClasificadorVectorizado.resumen_sin_tasa(clasificacion.loc[seleccion])
+        self.cortes = [self.calendario.mes_reporte]
+        return len(documentos)
+    
+    def seguimiento(self, df: pd.DataFrame, fecha_corte: datetime) -> int:
+        # Exportación posterior (cortes en orden cronológico); devuelve los documentos cobrados
+        if self.documentos is None:
+            raise ErrorProcesamiento("Primero cargue la exportación proyectada del mes")
+        if fecha_corte <= self.cortes[-1]:
+            raise ErrorProcesamiento(f"Corte {fecha_corte:%Y-%m-%d} fuera de orden "
+                                     f"(el anterior es {self.cortes[-1]:%Y-%m-%d})")
+        claves, _ = EstadoIncremental.identificar(self._filtrar(df))
+        pendientes = self.documentos['SEMANA_COBRO'].to_numpy() == self.PENDIENTE
+        # Unión por hash: isin construye una tabla hash con las claves de la exportación
+        cobrados = pendientes & ~self.documentos['CLAVE'].isin(claves).to_numpy()
+        self.documentos.loc[cobrados, 'SEMANA_COBRO'] = self._semana_cobro(self.cortes[-1], fecha_corte)
+        self.documentos.loc[cobrados, 'CORTE'] = fecha_corte
+        self.cortes.append(fecha_corte)
+        return int(cobrados.sum())
+    
+    def _semana_cobro(self, desde: datetime, corte: datetime) -> str:
+        inicio_mes = self.calendario.mes_reporte
+        fin_mes = inicio_mes + timedelta(days=self.calendario.dias - 1)
+        hasta = corte - timedelta(days=1)
+        if desde > fin_mes:
+            return self.POSTERIOR
+        if hasta > fin_mes:
+            return self.SIN_SEMANA
+        desde, hasta = max(desde, inicio_mes), max(hasta, inicio_mes)
+        semanas = self.calendario.semana(np.array([desde.day, hasta.day]))
+        return semanas[0] if semanas[0] == semanas[1] else self.SIN_SEMANA
+    
+    def resumen(self, dimension: Optional[str] = None) -> pd.DataFrame:
+        # Tasa de cobro: cobrados en el mes / proyectados.
+        # Tasa de acierto: cobrados en la semana proyectada / documentos con semana determinable
+        documentos = self.documentos
+        semana = documentos['SEMANA_COBRO']
+        con_semana = semana.isin(self.calendario.etiquetas)
+        cobrados = con_semana | (semana == self.SIN_SEMANA)
+        # Sin ningún corte dentro del mes (p. ej. solo la exportación del mes siguiente)
+        # la semana de cobro no se conoce y no hay tasa de acierto
+        determinables = (semana != self.SIN_SEMANA) & con_semana.any()
+        indicadores = pd.DataFrame({
+            'DOCUMENTOS': 1,
+            'COBRADOS': cobrados.astype(np.int64),
+            'ACIERTOS': (semana == documentos['PROYECCIÓN']).astype(np.int64),
+            'DETERMINABLES': determinables.astype(np.int64),
+            'MONTO': documentos['MONTO'],
+            'MONTO_COBRADO': documentos['MONTO'].where(cobrados, 0.0)
+        })
+        if dimension:
+            tabla = indicadores.groupby(documentos[dimension].to_numpy(), sort=True).sum()
+            tabla.index.name = dimension
+        else:
+            tabla = indicadores.sum().to_frame('TOTAL').T
+        tabla['TASA_COBRO'] = tabla['COBRADOS'] / tabla['DOCUMENTOS']
+        tabla['TASA_ACIERTO'] = tabla['ACIERTOS'] / tabla['DETERMINABLES'].replace(0, np.nan)
+        tabla['TASA_MONTO'] = tabla['MONTO_COBRADO'] / tabla['MONTO'].replace(0, np.nan)
+        return tabla
+    
+    def matriz(self) -> pd.DataFrame:
+        # Semana proyectada (filas) contra semana de cobro observada (columnas)
+        return pd.crosstab(self.documentos['PROYECCIÓN'], self.documentos['SEMANA_COBRO'],
+                           margins=True, margins_name='Total general')
+    
+    def imprimir(self):
+        total = self.resumen().iloc[0]
+        print(f"\n   🎯 BACKTEST {self.calendario.mes_reporte:%Y-%m} "
+              f"(exportaciones posteriores: {len(self.cortes) - 1})")
+        print(f"      • Documentos proyectados: {int(total['DOCUMENTOS']):,}")
+        print(f"      • Cobrados en el mes: {int(total['COBRADOS']):,} ({total['TASA_COBRO']:.1%}), "
+              f"monto {total['TASA_MONTO']:.1%}")
+        if total['DETERMINABLES'] > 0:
+            print(f"      • Cobrados en la semana proyectada: {int(total['ACIERTOS']):,} "
+                  f"({total['TASA_ACIERTO']:.1%} de {int(total['DETERMINABLES']):,} con semana determinable)")
+        for dimension in self.DIMENSIONES:
+            tabla = self.resumen(dimension).sort_values('DOCUMENTOS', ascending=False).head(5)
+            print(f"      Por {dimension.lower()}:")
+            for nombre, fila in tabla.iterrows():
+                acierto = "" if pd.isna(fila['TASA_ACIERTO']) else f", acierto {fila['TASA_ACIERTO']:.1%}"
+                print(f"         {str(nombre):<20} {int(fila['DOCUMENTOS']):>8,} docs  "
+                      f"cobro {fila['TASA_COBRO']:.1%}{acierto}")
+    
+    def exportar(self, ruta: str) -> List[str]:
+        # Tasas y matriz en Excel; el detalle por documento (cientos de miles de filas) en CSV
+        with pd.ExcelWriter(ruta, engine=EscritorPorBloques.motor_excel()) as writer:
+            self.resumen().to_excel(writer, sheet_name='RESUMEN', index=False)
+            for dimension in self.DIMENSIONES:
+                self.resumen(dimension).to_excel(writer, sheet_name=dimension)
+            self.matriz().to_excel(writer, sheet_name='MATRIZ')
+        ruta_documentos = os.path.splitext(ruta)[0] + "_documentos.csv"
+        self.documentos.drop(columns='CLAVE').to_csv(ruta_documentos, index=False, encoding='utf-8-sig')
+        return [ruta, ruta_documentos]
+
+# ==================== MÉTRICAS DE RENDIMIENTO ====================
+# Tiempo, filas por segundo y pico de memoria por etapa, con perfilado opcional
+class MedidorMemoria:
+    # Muestrea la memoria residente del proceso en un hilo para obtener el pico de cada etapa
+    def __init__(self, intervalo: float = 0.01):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._activo = False
+        self._hilo = None
+    
+    @staticmethod
+    def rss_actual() -> int:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+        try:
+            with open("/proc/self/statm") as archivo:
+                return int(archivo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            import resource
+            maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maximo if sys.platform == "darwin" else maximo * 1024
+    
+    def __enter__(self):
+        self.pico = self.rss_actual()
+        self._activo = True
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+    
+    def __exit__(self, *args):
+        self._activo = False
+        self._hilo.join()
+        self.pico = max(self.pico, self.rss_actual())
+    
+    def _muestrear(self):
+        while self._activo:
+            self.pico = max(self.pico, self.rss_actual())
+            time.sleep(self.intervalo)
+
+
+class MetricasProceso:
+    # Todas las etapas medidas con etapa(), en el orden del proceso
+    ETAPAS = ['lectura', 'filtrado', 'validacion', 'clasificacion', 'agregacion', 'tablas', 'incremental',
+              'historial', 'instantanea', 'indice', 'exportacion']
+    PERFILADORES = ['cprofile', 'muestreo']
+    
+    def __init__(self, perfilar: Optional[List[str]] = None, perfilador: str = 'cprofile',
+                 directorio_perfiles: Optional[str] = None, prefijo: str = "arpc"):
+        # perfilar: etapas a envolver en el perfilador ('todas' para todas)
+        self.perfilar = perfilar or []
+        self.perfilador = perfilador
+        self.directorio_perfiles = directorio_perfiles or os.getcwd()
+        self.prefijo = prefijo
+        self.reiniciar()
+    
+    def reiniciar(self):
+        self.inicio = datetime.now()
+        self.etapas: Dict[str, Dict] = {}
+        self.perfiles: Dict[str, str] = {}
+        self._perfiles_activos = {}
+    
+    @contextlib.contextmanager
+    def etapa(self, nombre: str, filas: int = 0):
+        # Uso: with metricas.etapa('lectura') as medida: ...; medida['filas'] = n
+        # Si la etapa se repite (procesamiento por bloques) se acumula
+        medida = {'filas': filas}
+        perfil = self._iniciar_perfil(nombre)
+        with MedidorMemoria() as memoria:
+            inicio = time.perf_counter()
+            try:
+                yield medida
+            finally:
+                segundos = time.perf_counter() - inicio
+                if perfil is not None:
+                    self._detener_perfil(nombre, perfil)
+        
+        acumulada = self.etapas.setdefault(
+            nombre, {'segundos': 0.0, 'filas': 0, 'llamadas': 0, 'rss_pico_mb': 0.0}
+        )
+        acumulada['segundos'] += segundos
+        acumulada['filas'] += int(medida['filas'] or 0)
+        acumulada['llamadas'] += 1
+        acumulada['rss_pico_mb'] = max(acumulada['rss_pico_mb'], memoria.pico / (1024 * 1024))
+    
+    def _iniciar_perfil(self, nombre: str):
+        if nombre not in self.perfilar and 'todas' not in self.perfilar:
+            return None
+        perfil = self._perfiles_activos.get(nombre)
+        if self.perfilador == 'muestreo':
+            if importlib.util.find_spec("pyinstrument") is None:
+                print("   ⚠️  pyinstrument no instalado, se usa cProfile")
+                self.perfilador = 'cprofile'
+            else:
+                from pyinstrument import Profiler
+                perfil = Profiler()
+                perfil.start()
+                return perfil
+        if perfil is None:
+            perfil = cProfile.Profile()
+            self._perfiles_activos[nombre] = perfil
+        perfil.enable()
+        return perfil
+    
+    def _detener_perfil(self, nombre: str, perfil):
+        os.makedirs(self.directorio_perfiles, exist_ok=True)
+        base = os.path.join(self.directorio_perfiles, f"{self.prefijo}_{nombre}")
+        if isinstance(perfil, cProfile.Profile):
+            # El mismo perfil acumula las llamadas repetidas de la etapa
+            perfil.disable()
+            ruta = f"{base}.prof"
+            perfil.dump_stats(ruta)
+        else:
+            perfil.stop()
+            ruta = f"{base}.html"
+            with open(ruta, 'w', encoding='utf-8') as archivo:
+                archivo.write(perfil.output_html())
+        self.perfiles[nombre] = ruta
+    
+    def a_diccionario(self) -> Dict:
+        etapas = {}
+        for nombre, medida in self.etapas.items():
+            segundos = medida['segundos']
+            etapas[nombre] = {
+                'segundos': round(segundos, 4),
+                'filas': medida['filas'],
+                'filas_por_segundo': round(medida['filas'] / segundos) if segundos > 0 and medida['filas'] else None,
+                'rss_pico_mb': round(medida['rss_pico_mb'], 1),
+                'llamadas': medida['llamadas']
+            }
+        return {
+            'inicio': self.inicio.isoformat(timespec='seconds'),
+            'segundos_total': round(sum(e['segundos'] for e in etapas.values()), 4),
+            'rss_pico_mb': max((e['rss_pico_mb'] for e in etapas.values()), default=0.0),
+            'etapas': etapas,
+            'perfiles': dict(self.perfiles)
+        }
+    
+    def imprimir(self):
+        for nombre, medida in self.a_diccionario()['etapas'].items():
+            velocidad = f"{medida['filas_por_segundo']:>11,} filas/s" if medida['filas_por_segundo'] else " " * 19
+            print(f"      • {nombre:<14} {medida['segundos']:>8.2f} s {velocidad}  pico {medida['rss_pico_mb']:,.0f} MB")
+    
+    def guardar(self, ruta: str, etiquetas: Optional[Dict[str, str]] = None):
+        self.escribir(ruta, [(etiquetas or {}, self.a_diccionario())])
     
-    def _generar_tabla_proyecciones(self):
-        datos = []
-        for doc in self.gestor.documentos:
-            if doc.estatus == "PROYECTADO" and doc.proyeccion in [
-                "SEMANA_1", "SEMANA_2", "SEMANA_3", "SEMANA_4", "SEMANA_5"
-            ]:
-                datos.append({
-                    'SECTORISTA': doc.sectorista,
-                    'PROYECCIÓN': doc.proyeccion,
-                    'MONTO': doc.monto
-                })
-        
-        if datos:
-            df = pd.DataFrame(datos)
-            self.tabla_proyecciones = pd.pivot_table(
-                df, values='MONTO', index='SECTORISTA',
-                columns='PROYECCIÓN', aggfunc='sum', fill_value=0,
-                margins=True, margins_name='Total general'
-            )
+    @classmethod
+    def escribir(cls, ruta: str, registros: List[Tuple[Dict[str, str], Dict]]):
+        # .prom / .txt en formato de texto Prometheus (textfile collector); cualquier otra, JSON
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        if os.path.splitext(ruta)[1].lower() in ('.prom', '.txt'):
+            contenido = cls.formato_prometheus(registros)
+        else:
+            contenido = json.dumps({'ejecuciones': [dict(metricas, etiquetas=etiquetas)
+                                                    for etiquetas, metricas in registros]},
+                                   ensure_ascii=False, indent=2)
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            archivo.write(contenido)
     
-    def _generar_tabla_cd(self):
-        datos = []
-        for doc in self.gestor.documentos:
-            if doc.estatus == "PROYECTADO":
-                datos.append({
-                    'SECTORISTA': doc.sectorista,
-                    'CD': doc.cd,
-                    'MONTO': doc.monto
-                })
+    @staticmethod
+    def formato_prometheus(registros: List[Tuple[Dict[str, str], Dict]]) -> str:
+        series = {
+            'arpc_etapa_segundos': ('gauge', 'Duración de la etapa en segundos', 'segundos'),
+            'arpc_etapa_filas': ('gauge', 'Filas procesadas en la etapa', 'filas'),
+            'arpc_etapa_filas_por_segundo': ('gauge', 'Filas por segundo de la etapa', 'filas_por_segundo'),
+            'arpc_etapa_rss_pico_bytes': ('gauge', 'Pico de memoria residente durante la etapa', 'rss_pico_mb'),
+        }
         
-        if datos:
-            df = pd.DataFrame(datos)
-            self.tabla_cd = pd.pivot_table(
-                df, values='MONTO', index='SECTORISTA',
-                columns='CD', aggfunc='sum', fill_value=0,
-                margins=True, margins_name='Total general'
-            )
+        def etiquetas_texto(etiquetas: Dict[str, str]) -> str:
+            valores = []
+            for clave, valor in etiquetas.items():
+                valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+                valores.append(f'{clave}="{valor}"')
+            return "{" + ",".join(valores) + "}" if valores else ""
+        
+        lineas = []
+        for metrica, (tipo, ayuda, campo) in series.items():
+            lineas += [f"# HELP {metrica} {ayuda}", f"# TYPE {metrica} {tipo}"]
+            for etiquetas, metricas in registros:
+                for nombre, medida in metricas['etapas'].items():
+                    valor = medida[campo]
+                    if valor is None:
+                        continue
+                    if campo == 'rss_pico_mb':
+                        valor = int(valor * 1024 * 1024)
+                    lineas.append(f"{metrica}{etiquetas_texto(dict(etiquetas, etapa=nombre))} {valor}")
+        lineas += ["# HELP arpc_proceso_segundos Duración total de las etapas medidas",
+                   "# TYPE arpc_proceso_segundos gauge"]
+        for etiquetas, metricas in registros:
+            lineas.append(f"arpc_proceso_segundos{etiquetas_texto(etiquetas)} {metricas['segundos_total']}")
+        return "\n".join(lineas) + "\n"
+
 # ==================== PROCESADOR PRINCIPAL ====================
 # DESARROLLADOR: Carlos García - Sistema principal e interfaz
 class ProcesadorARPC:
-    def __init__(self):
+    def __init__(self, usar_cache: bool = True):
         self.gestor = GestorDocumentos()
         self.generador_tablas = None
         self.dataframe_original = None
@@ -292,6 +2790,31 @@ class ProcesadorARPC:
         self.mes_reporte = datetime.now()
         self.total_registros = 0
         self.total_columnas = 0
+        self.lector = LectorSAP()
+        self.cache = CacheSAP(activo=usar_cache)
+        self.formatos_adicionales: List[str] = []
+        self.metricas = MetricasProceso()
+        self.incremental: Optional[EstadoIncremental] = None
+        self.inicio_semana: Optional[int] = None  # None: semanas de 7 días desde el día 1
+        self.reglas: Optional[ReglasClasificacion] = None  # None: reglas por defecto
+        self.tipos_cambio: Optional[TiposCambio] = None  # None: montos sin convertir
+        self.historial: Optional[HistorialARPC] = None
+        self.validacion: Optional[ValidadorDatos] = None
+        self.instantanea: Optional[InstantaneaARPC] = None
+        self._clave_cache = None
+        self._indice: Optional[IndiceDocumentos] = None
+        # Mes y día de inicio de la sesión mientras se muestra una ejecución reabierta (con los suyos)
+        self._configuracion_sesion: Optional[Tuple[datetime, Optional[int]]] = None
+        # Motivo del último procesamiento o exportación fallidos (para quien no ve la consola)
+        self.ultimo_error: Optional[str] = None
+    
+    @property
+    def indice(self) -> IndiceDocumentos:
+        # Índice de detalle: se construye en la primera consulta tras la clasificación
+        if self._indice is None:
+            with self.metricas.etapa('indice', len(self.gestor)):
+                self._indice = IndiceDocumentos.desde_gestor(self.gestor)
+        return self._indice
     
     def seleccionar_archivo(self) -> bool:
         try:
@@ -301,44 +2824,88 @@ class ProcesadorARPC:
             print("   📁 SELECCIONAR ARCHIVO SAP")
             print("-"*50)
             
-            root = tk.Tk()
-            root.withdraw()
-            
-            archivo = filedialog.askopenfilename(
+            archivo = DialogosArchivo.abrir(
                 title="Seleccionar archivo SAP exportado",
-                filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
+                filetypes=[("Excel files", "*.xlsx *.xlsm *.xls"), ("CSV files", "*.csv"),
+                           ("Parquet files", "*.parquet"), ("All files", "*.*")]
             )
             
             if not archivo:
                 print("   ❌ Operación cancelada")
                 return False
             
+            return self.cargar_archivo(archivo)
+        except ErrorArchivoSAP:
+            raise
+        except Exception as e:
+            raise ErrorArchivoSAP(f"Error: {e}")
+    
+    def cargar_archivo(self, archivo: str) -> bool:
+        try:
             self.archivo_actual = archivo
             nombre = os.path.basename(archivo)
             tamaño = os.path.getsize(archivo) / (1024*1024)
             
-            # Leer archivo para contar registros y columnas
-            df_temp = pd.read_excel(archivo)
-            self.total_registros = len(df_temp)
-            self.total_columnas = len(df_temp.columns)
+            # Registros y columnas desde los metadatos del archivo (sin leer las filas)
+            registros, columnas = self.lector.leer_metadatos(archivo)
             
             print(f"   [Examinar...] {nombre}")
             print(f"\n   📊 Archivo seleccionado:")
-            print(f"   • {self.total_registros:,} registros detectados")
-            print(f"   • {self.total_columnas} columnas identificadas")
+            if registros is not None:
+                print(f"   • {registros:,} registros detectados")
+                print(f"   • {columnas} columnas identificadas")
             print(f"   • Tamaño: {tamaño:.2f} MB")
             print(f"\n   🔍 Cargando {nombre}...")
             
-            self.dataframe_original = df_temp
+            df = None
+            self._clave_cache = None
+            self.metricas.reiniciar()
+            with self.metricas.etapa('lectura') as medida:
+                clave_archivo = self.cache.clave_archivo(archivo) if self.cache.activo else None
+                if clave_archivo:
+                    self._clave_cache = f"{clave_archivo}_{self.lector.firma()}"
+                    df = self.cache.cargar(self._clave_cache)
+                    # Las fechas no interpretables (texto original) se guardan junto al DataFrame
+                    invalidas = self.cache.cargar(f"{self._clave_cache}_fechas") if df is not None else None
+                    if invalidas is None:
+                        df = None
+                if df is None:
+                    df = self.lector.leer(archivo)
+                    if self._clave_cache:
+                        self.cache.guardar(self._clave_cache, df)
+                        self.cache.guardar(f"{self._clave_cache}_fechas", self.lector.fechas_invalidas,
+                                           conservar=(self._clave_cache,))
+                else:
+                    self.lector.fechas_invalidas = invalidas
+                    print(f"   ⚡ Recuperado de la caché local")
+                medida['filas'] = len(df)
+            self.dataframe_original = df
+            self.total_registros = len(df)
+            self.total_columnas = columnas if columnas is not None else len(df.columns)
             print(f"   ✅ Archivo SAP cargado")
+            if LectorSAP.COLUMNA_SOCIEDAD in df.columns:
+                sociedades = df[LectorSAP.COLUMNA_SOCIEDAD].cat.categories
+                print(f"   • {len(sociedades)} hojas de datos (sociedades): {', '.join(map(str, sociedades))}")
+            for aviso in self.lector.fechas.describir_fallidas():
+                print(f"   ⚠️  {aviso}")
             
             return True
+        except ErrorArchivoSAP:
+            raise
         except Exception as e:
             raise ErrorArchivoSAP(f"Error: {e}")
     
     def cargar_y_procesar(self) -> bool:
         from datetime import datetime as dt
         inicio = dt.now()
+        self._indice = None
+        self.ultimo_error = None
+        # Cada archivo empieza con un gestor vacío y la configuración de la sesión
+        # (no la de una ejecución reabierta)
+        self.gestor = GestorDocumentos()
+        if self._configuracion_sesion is not None:
+            self.mes_reporte, self.inicio_semana = self._configuracion_sesion
+            self._configuracion_sesion = None
         
         try:
             print("\n" + "="*48)
@@ -348,30 +2915,52 @@ class ProcesadorARPC:
             
             # Filtrar solo DR y DL válidos
             total_inicial = self.total_registros
-            df_filtrado = self.dataframe_original[
-                self.dataframe_original['CD'].isin(['DR', 'DL'])
-            ].copy()
+            with self.metricas.etapa('filtrado', total_inicial):
+                mascara = self.dataframe_original['CD'].isin(['DR', 'DL']).to_numpy()
+                df_filtrado = self.dataframe_original[mascara]
             
             filtrados = len(df_filtrado)
             print(f"   ✅ Filtrado DR/DL - Completado ({filtrados:,} de {total_inicial:,})")
             
-            # Procesar cada documento
-            contador = 0
-            for _, fila in df_filtrado.iterrows():
-                documento = DocumentoSAP(fila, self.mes_reporte)
-                self.gestor.agregar_documento(documento)
-                contador += 1
-                
-                if contador % 1000 == 0:
-                    print(f"   📝 {contador:,} documentos procesados...")
+            # Validación de calidad por columnas (no cambia la clasificación)
+            with self.metricas.etapa('validacion', filtrados):
+                self.validacion = ValidadorDatos(tipos_cambio=self.tipos_cambio, fecha_cambio=self.mes_reporte)
+                self.validacion.validar(df_filtrado, np.flatnonzero(mascara), self.lector.fechas_invalidas,
+                                        LectorSAP.inicios_hoja(self.dataframe_original))
+            self.validacion.imprimir()
+            
+            # Clasificar todos los documentos por columnas
+            with self.metricas.etapa('clasificacion', filtrados):
+                clasificador = ClasificadorVectorizado(self.mes_reporte, self.inicio_semana, self.reglas,
+                                                       self.tipos_cambio)
+                if self.incremental is not None:
+                    clasificacion = self.incremental.clasificar(clasificador, df_filtrado)
+                else:
+                    clasificacion = self._clasificar_con_cache(clasificador, df_filtrado)
+            # Solo hay fechas sin interpretar aquí si el DataFrame no pasó por LectorSAP
+            for aviso in clasificador.fechas.describir_fallidas():
+                print(f"   ⚠️  {aviso}")
+            self._advertir_sin_tasa(ClasificadorVectorizado.resumen_sin_tasa(clasificacion), self.mes_reporte)
+            with self.metricas.etapa('agregacion', filtrados):
+                self.gestor.moneda_reporte = clasificador.tipos_cambio.moneda_reporte
+                self.gestor.inicio_semana = clasificador.calendario.inicio_semana
+                self.gestor.reglas = clasificador.reglas
+                self.gestor.agregar_clasificados(
+                    self.dataframe_original, np.flatnonzero(mascara), clasificacion, self.mes_reporte
+                )
+                self.gestor.obtener_cubo()
             
             print("   ✅ Procesando documentos...")
+            if self.incremental is not None:
+                self.incremental.imprimir()
             print("   ✅ Cálculo automático de TRAMOS - Completado")
             
-            # Calcular semanas del mes
-            mes_nombre = self.mes_reporte.strftime("%B %Y").upper()
-            print(f"   ✅ Detección: {mes_nombre} (30 días, inicia Sábado)")
-            print(f"   ✅ Semanas calculadas: 5 semanas detectadas")
+            # Semanas del mes según el calendario del mes de reporte
+            calendario = clasificador.calendario
+            rangos = ", ".join(f"{inicio}-{fin}" if inicio <= fin else f"{inicio}+"
+                               for inicio, fin in calendario.rangos())
+            print(f"   ✅ Detección: {calendario.descripcion()}")
+            print(f"   ✅ Semanas calculadas: {calendario.semanas} semanas detectadas (días {rangos})")
             print("   ✅ Clasificación automática por semanas - Completado")
             
             # Estadísticas DR/DL
@@ -386,29 +2975,148 @@ class ProcesadorARPC:
                 print(f"   ✅ Eliminación de totales SAP ({eliminados} registros) - Completado")
             
             # Generar tablas dinámicas
-            self.generador_tablas = GeneradorTablasDinamicas(self.gestor)
-            self.generador_tablas.generar_tablas()
+            with self.metricas.etapa('tablas', filtrados):
+                self.generador_tablas = GeneradorTablasDinamicas(self.gestor)
+                self.generador_tablas.generar_tablas()
             print("   ✅ Generación de tablas dinámicas - Completado")
+            self._imprimir_monedas()
+            
+            if self.incremental is not None:
+                with self.metricas.etapa('incremental', filtrados):
+                    self.incremental.guardar(self.archivo_actual, self.mes_reporte, self.gestor.obtener_cubo())
+            
+            if self.historial is not None:
+                self._registrar_historial(clasificador.firma())
             
             # Tiempo de procesamiento
             fin = dt.now()
             self.tiempo_proceso = (fin - inicio).total_seconds()
             
+            if self.instantanea is not None and len(self.gestor) > 0:
+                self._guardar_instantanea()
+            
             print(f"\n   ⏱️  **Tiempo transcurrido: {self.tiempo_proceso:.1f} segundos**")
+            self.metricas.imprimir()
             print("\n" + "="*48)
             
             return True
             
         except Exception as e:
+            self.ultimo_error = self._describir_error(e)
             print(f"❌ Error en procesamiento: {e}")
             return False
     
+    @staticmethod
+    def _describir_error(e: Exception) -> str:
+        # Los errores del sistema ya traen un mensaje legible; el resto, con su tipo (p. ej. KeyError: 'CD')
+        if isinstance(e, ErrorProcesamiento) and str(e):
+            return str(e)
+        return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    
+    def _registrar_historial(self, firma: str):
+        # Un fallo del historial no invalida el procesamiento
+        try:
+            with self.metricas.etapa('historial', len(self.gestor)):
+                self.historial.registrar(self.archivo_actual, self.mes_reporte, self.gestor,
+                                         self.total_registros, firma)
+            print(f"   ✅ Ejecución registrada en el historial ({self.historial.ruta})")
+        except sqlite3.Error as e:
+            print(f"   ⚠️  No se pudo registrar en el historial: {e}")
+    
+    @staticmethod
+    def _advertir_sin_tasa(sin_tasa: pd.DataFrame, fecha: datetime):
+        # Documentos cuyo monto queda en 0 en las tablas por falta de tipo de cambio
+        if len(sin_tasa) == 0:
+            return
+        montos = ", ".join(f"{moneda} {fila['MONTO_ORIGEN']:,.2f}" for moneda, fila in sin_tasa.iterrows())
+        print(f"   ⚠️  {int(sin_tasa['DOCUMENTOS'].sum()):,} documentos sin tipo de cambio para "
+              f"{fecha.strftime('%m/%Y')} ({montos}): suman 0 en las tablas (ver RECHAZOS SIN_TIPO_CAMBIO)")
+    
+    def _imprimir_monedas(self):
+        monedas = self.generador_tablas.monedas
+        if monedas is None:
+            return
+        lista = ", ".join(map(str, monedas.index))
+        if self.gestor.moneda_reporte:
+            print(f"   ✅ Conversión a {self.gestor.moneda_reporte} ({lista}) con la tasa vigente al "
+                  f"{self.mes_reporte.strftime('%d/%m/%Y')} - Completado")
+        else:
+            print(f"   ⚠️  Documentos en varias monedas ({lista}) sin tabla de tipos de cambio: "
+                  f"los montos se suman sin convertir")
+    
+    def _guardar_instantanea(self):
+        # Un fallo al guardar la instantánea no invalida el procesamiento
+        try:
+            with self.metricas.etapa('instantanea', len(self.gestor)):
+                self.instantanea.guardar(self)
+            print(f"   ✅ Ejecución guardada para reabrirla ({self.instantanea.directorio})")
+        except Exception as e:
+            print(f"   ⚠️  No se pudo guardar la ejecución para reabrirla: {e}")
+    
+    def reabrir_ultima_ejecucion(self) -> bool:
+        # Restaura el estado procesado (tablas, exportación y detalle) sin leer el archivo SAP
+        if not InstantaneaARPC.disponible():
+            print("\n⚠️  Reabrir la última ejecución requiere pyarrow (pip install pyarrow)")
+            return False
+        inicio = time.perf_counter()
+        try:
+            restaurado = (self.instantanea or InstantaneaARPC()).cargar()
+        except ErrorProcesamiento as e:
+            print(f"\n⚠️  {e}")
+            return False
+        except Exception as e:
+            print(f"\n❌ No se pudo reabrir la última ejecución: {e}")
+            return False
+        
+        metadatos = restaurado['metadatos']
+        if self._configuracion_sesion is None:
+            self._configuracion_sesion = (self.mes_reporte, self.inicio_semana)
+        self.gestor = restaurado['gestor']
+        self.validacion = restaurado['validacion']
+        self.archivo_actual = metadatos['archivo']
+        self.mes_reporte = self.gestor.mes_reporte
+        self.inicio_semana = metadatos['inicio_semana']
+        self.total_registros = metadatos['total_registros']
+        self.total_columnas = metadatos['total_columnas']
+        self.tiempo_proceso = metadatos['tiempo_proceso']
+        self.dataframe_original = None
+        self._indice = None
+        self.generador_tablas = GeneradorTablasDinamicas(self.gestor)
+        self.generador_tablas.generar_tablas()
+        
+        stats = metadatos['estadisticas']
+        print("\n" + "="*50)
+        print("   ♻️  ÚLTIMA EJECUCIÓN REABIERTA")
+        print("="*50)
+        print(f"   • Archivo: {os.path.basename(self.archivo_actual or '')}")
+        print(f"   • Procesado: {datetime.fromisoformat(metadatos['fecha']).strftime('%d/%m/%Y %H:%M')} "
+              f"(mes de reporte {self.mes_reporte.strftime('%m/%Y')})")
+        print(f"   • {stats['total']:,} documentos (DR: {stats['dr']:,} - DL: {stats['dl']:,})")
+        print(f"   • Restaurada en {time.perf_counter() - inicio:.2f} segundos")
+        return True
+    
+    def _clasificar_con_cache(self, clasificador: ClasificadorVectorizado,
+                              df_filtrado: pd.DataFrame) -> pd.DataFrame:
+        clave = f"{self._clave_cache}_{clasificador.firma()}" if self._clave_cache else None
+        clasificacion = self.cache.cargar(clave) if clave else None
+        if clasificacion is not None and len(clasificacion) == len(df_filtrado):
+            clasificacion.index = df_filtrado.index
+            return clasificacion
+        
+        clasificacion = clasificador.clasificar(df_filtrado)
+        if clave:
+            self.cache.guardar(clave, clasificacion)
+        return clasificacion
+    
     def mostrar_reporte_proyecciones(self):
         if len(self.gestor) == 0:
             print("\n⚠️  No hay datos procesados")
             return
         
         mes_nombre = self.mes_reporte.strftime("%B %Y").upper()
+        # Moneda de reporte (sin tabla de tipos de cambio, "$" como siempre)
+        m = self.gestor.moneda_reporte or "$"
+        a = 11 - len(m)
         
         print("\n" + "="*65)
         print(f"   REPORTE DE PROYECCIONES - {mes_nombre}")
@@ -416,17 +3124,19 @@ class ProcesadorARPC:
         
         # Agrupar datos por gestor y semana (solo semanas válidas)
         datos_gestores = {}
-        semanas_validas = ["SEMANA_1", "SEMANA_2", "SEMANA_3", "SEMANA_4", "SEMANA_5"]
-        
-        for doc in self.gestor.documentos:
-            if doc.estatus == "PROYECTADO" and doc.proyeccion in semanas_validas:
-                gestor = doc.sectorista
-                if gestor not in datos_gestores:
-                    datos_gestores[gestor] = {sem: 0 for sem in semanas_validas}
-                    datos_gestores[gestor]['TOTAL'] = 0
-                
-                datos_gestores[gestor][doc.proyeccion] += doc.monto
-                datos_gestores[gestor]['TOTAL'] += doc.monto
+        semanas_validas = list(CalendarioMes.ETIQUETAS)
+        
+        cubo = self.gestor.obtener_cubo()
+        proyectados = cubo[
+            (cubo['ESTATUS 1'] == "PROYECTADO") & cubo['PROYECCIÓN'].isin(semanas_validas)
+        ]
+        if len(proyectados) > 0:
+            tabla = (proyectados.groupby(['SECTORISTA', 'PROYECCIÓN'], sort=False)['MONTO'].sum()
+                     .unstack(fill_value=0)
+                     .reindex(index=pd.unique(proyectados['SECTORISTA']),
+                              columns=semanas_validas, fill_value=0))
+            tabla['TOTAL'] = tabla.sum(axis=1)
+            datos_gestores = tabla.to_dict('index')
         
         # Encabezados
         print(f"{'GESTOR':<20} {'SEMANA 1':>12} {'SEMANA 2':>12} {'SEMANA 3':>12} {'TOTAL':>15}")
@@ -439,8 +3149,8 @@ class ProcesadorARPC:
                 break
             
             nombre = gestor[:18] + "..." if len(gestor) > 18 else gestor
-            print(f"{nombre:<20} $ {datos['SEMANA_1']:>10,.2f} $ {datos['SEMANA_2']:>10,.2f} "
-                  f"$ {datos['SEMANA_3']:>10,.2f} $ {datos['TOTAL']:>13,.2f}")
+            print(f"{nombre:<20} {m} {datos['SEMANA_1']:>{a},.2f} {m} {datos['SEMANA_2']:>{a},.2f} "
+                  f"{m} {datos['SEMANA_3']:>{a},.2f} {m} {datos['TOTAL']:>{a + 3},.2f}")
         
         # Totales
         total_s1 = sum(d['SEMANA_1'] for d in datos_gestores.values())
@@ -449,17 +3159,68 @@ class ProcesadorARPC:
         total_gen = sum(d['TOTAL'] for d in datos_gestores.values())
         
         print("-" * 75)
-        print(f"{'TOTAL GENERAL':<20} $ {total_s1:>10,.2f} $ {total_s2:>10,.2f} "
-              f"$ {total_s3:>10,.2f} $ {total_gen:>13,.2f}")
+        print(f"{'TOTAL GENERAL':<20} {m} {total_s1:>{a},.2f} {m} {total_s2:>{a},.2f} "
+              f"{m} {total_s3:>{a},.2f} {m} {total_gen:>{a + 3},.2f}")
         
         print("\n" + "="*65)
         print(f"\n📊 RESUMEN:")
         print(f"   • Total gestores: {len(datos_gestores)}")
-        print(f"   • Monto total proyectado: $ {total_gen:,.2f}")
+        print(f"   • Monto total proyectado: {m} {total_gen:,.2f}")
+        for sociedad, (tabla, _) in self.generador_tablas.tablas_sociedad.items():
+            total = tabla.at['Total general', 'Total general'] if tabla is not None else 0
+            print(f"     - {sociedad}: {m} {total:,.2f}")
+        for moneda, (tabla, _) in self.generador_tablas.tablas_moneda.items():
+            total = tabla.at['Total general', 'Total general'] if tabla is not None else 0
+            print(f"     - Documentos en {moneda} (moneda original): {moneda} {total:,.2f}")
         print(f"   • Tiempo de procesamiento: {self.tiempo_proceso:.1f} segundos")
         eficiencia = (9000/self.tiempo_proceso) if self.tiempo_proceso > 0 else 0
         print(f"   • Eficiencia vs manual: {eficiencia:.0f}x más rápido")
 
+    def mostrar_detalle_documentos(self, por_pagina: int = 15):
+        # Documentos que componen una celda (sectorista / semana) o búsqueda por Ref. Letra
+        if len(self.gestor) == 0:
+            print("\n⚠️  No hay datos procesados")
+            return
+        indice = self.indice
+        sectoristas = indice.sectoristas
+        print("\n" + "="*65)
+        print("   DETALLE DE DOCUMENTOS")
+        print("="*65)
+        for numero, nombre in enumerate(sectoristas, 1):
+            print(f"   [{numero:>2}] {nombre}")
+        entrada = input("\n   🔎 Sectorista (número) o Ref. Letra: ").strip()
+        if not entrada:
+            return
+        if entrada.isdigit() and 1 <= int(entrada) <= len(sectoristas):
+            sectorista = sectoristas[int(entrada) - 1]
+            semana = input(f"   📅 Semana (1-{len(CalendarioMes.ETIQUETAS)}, Enter = todas): ").strip()
+            proyeccion = f"SEMANA_{semana}" if semana else None
+            titulo = f"{sectorista} - {proyeccion or 'todas las semanas'}"
+            total = len(indice.posiciones(sectorista, proyeccion))
+            paginas = (lambda pagina: indice.celda(sectorista, proyeccion, pagina, por_pagina))
+        else:
+            documentos = indice.buscar_ref_letra(entrada)
+            titulo, total = f"Ref. Letra {entrada}", len(documentos)
+            paginas = (lambda pagina: documentos.iloc[pagina * por_pagina:(pagina + 1) * por_pagina])
+        
+        m = self.gestor.moneda_reporte or "$"
+        print(f"\n   {titulo}: {total:,} documentos (mayor monto primero)")
+        pagina = 0
+        while pagina * por_pagina < total:
+            print(f"\n{'DOCUMENTO':<14} {'REF. LETRA':<12} {'CD':<4} {'TRAMO':<11} {'SEMANA':<10} {'MONTO':>15}")
+            print("-" * 70)
+            for _, fila in paginas(pagina).iterrows():
+                documento = _convertir_valor(fila.get('Nº documento'), str, "") or ""
+                referencia = _convertir_valor(fila.get('Ref. Letra'), str, "") or ""
+                print(f"{documento[:14]:<14} {referencia[:12]:<12} {str(fila['CD']):<4} "
+                      f"{str(fila['TRAMO']):<11} {str(fila['PROYECCIÓN']):<10} {m} {fila['MONTO']:>{14 - len(m)},.2f}")
+            pagina += 1
+            if pagina * por_pagina >= total:
+                break
+            restantes = total - pagina * por_pagina
+            if input(f"\n   ▶️  Enter: {min(restantes, por_pagina)} más de {restantes:,} | q: salir ").strip().lower() == "q":
+                break
+
 # EXPORTACIÓN
 # DESARROLLADORA: Josie Mamani - Sistema de exportación a Excel
     def exportar_reporte_completo(self) -> bool:
@@ -472,22 +3233,11 @@ class ProcesadorARPC:
             print("   📁 PREPARANDO EXPORTACIÓN...")
             print("="*60)
             
-            # Crear DataFrame con todas las columnas originales + nuevas
-            datos_completos = []
-            for doc in self.gestor.documentos:
-                dict_completo = doc.a_diccionario()
-                datos_completos.append(dict_completo)
-            
-            df_completo = pd.DataFrame(datos_completos)
-            
             # Solicitar ubicación para guardar
-            root = tk.Tk()
-            root.withdraw()
-            
             mes = self.mes_reporte.strftime("%B%Y").lower()
             nombre_sugerido = f"ARPC_PROYECCIONES_{mes}.xlsx"
             
-            ruta_salida = filedialog.asksaveasfilename(
+            ruta_salida = DialogosArchivo.guardar(
                 title="Guardar Reporte de Proyecciones",
                 defaultextension=".xlsx",
                 filetypes=[("Excel files", "*.xlsx")],
@@ -498,42 +3248,38 @@ class ProcesadorARPC:
                 print("\n⚠️  Exportación cancelada")
                 return False
             
-            # Exportar a Excel con múltiples hojas
-            with pd.ExcelWriter(ruta_salida, engine='openpyxl') as writer:
-                # Hoja 1: Datos completos
-                df_completo.to_excel(writer, sheet_name='DATOS_COMPLETOS', index=False)
-                
-                # Hoja 2: Tablas dinámicas
-                if self.generador_tablas.tabla_proyecciones is not None:
-                    # Filtrar solo columnas de semanas válidas
-                    semanas_cols = [col for col in self.generador_tablas.tabla_proyecciones.columns 
-                                  if col in ["SEMANA_1", "SEMANA_2", "SEMANA_3", "SEMANA_4", "SEMANA_5", "Total general"]]
-                    tabla_filtrada = self.generador_tablas.tabla_proyecciones[semanas_cols]
-                    tabla_filtrada.to_excel(writer, sheet_name='TABLA_DINAMICA', startrow=0)
-                    
-                    # Segunda tabla
-                    if self.generador_tablas.tabla_cd is not None:
-                        start_row = len(tabla_filtrada) + 3
-                        self.generador_tablas.tabla_cd.to_excel(
-                            writer, sheet_name='TABLA_DINAMICA', startrow=start_row
-                        )
+            return self.exportar_a(ruta_salida)
+            
+        except Exception as e:
+            self.ultimo_error = self._describir_error(e)
+            print(f"\n❌ Error exportando: {e}")
+            return False
+    
+    def exportar_a(self, ruta_salida: str) -> bool:
+        self.ultimo_error = None
+        try:
+            if len(self.gestor) == 0:
+                self.ultimo_error = "No hay datos para exportar"
+                print("\n⚠️  No hay datos para exportar")
+                return False
+            
+            with self.metricas.etapa('exportacion', len(self.gestor)):
+                # Filas originales + TRAMO / ESTATUS 1 / PROYECCIÓN (sin diccionarios por fila)
+                df_completo = self.gestor.a_dataframe()
                 
-                # Hoja 3: Resumen
+                # Exportar a Excel con múltiples hojas, escritas fila a fila
+                escritor = EscritorPorBloques(ruta_salida)
+                # Hoja 1: Datos completos
+                escritor.agregar(df_completo)
+                # Hojas 2 y 3: Tablas dinámicas y resumen
                 stats = self.gestor.obtener_estadisticas()
-                df_resumen = pd.DataFrame([
-                    ["Total documentos procesados", f"{stats['total']:,}"],
-                    ["Facturas (DR)", f"{stats['dr']:,}"],
-                    ["Letras (DL)", f"{stats['dl']:,}"],
-                    ["Monto total proyectado", f"$ {stats['monto_total']:,.2f}"],
-                    ["Monto DR (Facturas)", f"$ {stats['monto_dr']:,.2f}"],
-                    ["Monto DL (Letras)", f"$ {stats['monto_dl']:,.2f}"],
-                    ["Registros originales", f"{self.total_registros:,}"],
-                    ["Columnas identificadas", f"{self.total_columnas}"],
-                    ["Tiempo procesamiento", f"{self.tiempo_proceso:.1f} segundos"],
-                    ["Fecha reporte", self.mes_reporte.strftime("%d/%m/%Y")]
-                ], columns=['INDICADOR', 'VALOR'])
+                escritor.cerrar(self.generador_tablas, self._filas_resumen(
+                    stats, self.total_registros, self.total_columnas,
+                    self.tiempo_proceso, self.mes_reporte, self.validacion, self.generador_tablas
+                ), self.validacion.rechazos() if self.validacion is not None else None)
                 
-                df_resumen.to_excel(writer, sheet_name='RESUMEN', index=False)
+                # Copias de DATOS_COMPLETOS para sistemas posteriores
+                adicionales = self._exportar_formatos_adicionales(df_completo, ruta_salida)
             
             print("\n" + "="*60)
             print("   📁 EXPORTACIÓN EXITOSA")
@@ -543,16 +3289,1306 @@ class ProcesadorARPC:
             print(f"\n   ✅ Hojas generadas:")
             print(f"   • DATOS_COMPLETOS: {len(df_completo):,} registros")
             print(f"   • TABLA_DINAMICA: 2 tablas dinámicas")
+            for nombre, *_ in self.generador_tablas.hojas()[1:]:
+                detalle = "en moneda original" if nombre.startswith("TD_MONEDA_") else "de la sociedad"
+                print(f"   • {nombre}: tablas dinámicas {detalle}")
             print(f"   • RESUMEN: Indicadores clave")
+            if self.validacion is not None:
+                print(f"   • RECHAZOS: {self.validacion.observaciones:,} observaciones de calidad")
+            for ruta in adicionales:
+                print(f"   • {os.path.basename(ruta)}: copia de DATOS_COMPLETOS")
             print(f"\n   ✅ Listo para distribución a gerencia")
             print("="*60)
             
             return True
             
         except Exception as e:
+            self.ultimo_error = self._describir_error(e)
             print(f"\n❌ Error exportando: {e}")
             return False
+    
+    def _exportar_formatos_adicionales(self, df_completo: pd.DataFrame, ruta_salida: str) -> List[str]:
+        base = os.path.splitext(ruta_salida)[0]
+        generados = []
+        for formato in self.formatos_adicionales:
+            ruta = f"{base}.{formato}"
+            try:
+                if formato == 'csv':
+                    df_completo.to_csv(ruta, index=False)
+                elif formato == 'parquet':
+                    self._para_parquet(df_completo).to_parquet(ruta, index=False)
+                else:
+                    print(f"   ⚠️  Formato adicional no soportado: {formato}")
+                    continue
+                generados.append(ruta)
+            except Exception as e:
+                print(f"   ⚠️  No se pudo generar {os.path.basename(ruta)}: {e}")
+        return generados
+    
+    @staticmethod
+    def _para_parquet(df: pd.DataFrame) -> pd.DataFrame:
+        # Parquet exige un tipo por columna: las columnas con valores mixtos pasan a texto
+        mixtas = [c for c in df.columns if df[c].dtype == object
+                  and pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed')]
+        if not mixtas:
+            return df
+        df = df.copy()
+        for columna in mixtas:
+            df[columna] = df[columna].where(df[columna].isna(), df[columna].astype(str))
+        return df
+    
+    @staticmethod
+    def _escribir_tablas_dinamicas(writer, generador: GeneradorTablasDinamicas):
+        # Solo columnas de semanas válidas; consolidado y una hoja por sociedad
+        for hoja, tabla_filtrada, tabla_cd in generador.hojas():
+            if tabla_filtrada is None:
+                continue
+            tabla_filtrada.to_excel(writer, sheet_name=hoja, startrow=0)
+            
+            # Segunda tabla
+            if tabla_cd is not None:
+                start_row = len(tabla_filtrada) + 3
+                tabla_cd.to_excel(writer, sheet_name=hoja, startrow=start_row)
+    
+    @staticmethod
+    def _filas_resumen(stats: Dict, total_registros: int, total_columnas: int,
+                       tiempo_proceso: float, mes_reporte: datetime,
+                       validacion: Optional[ValidadorDatos] = None,
+                       generador: Optional[GeneradorTablasDinamicas] = None) -> List[List]:
+        m = (generador.moneda_reporte if generador is not None else None) or "$"
+        filas = [
+            ["Total documentos procesados", f"{stats['total']:,}"],
+            ["Facturas (DR)", f"{stats['dr']:,}"],
+            ["Letras (DL)", f"{stats['dl']:,}"],
+            ["Monto total proyectado", f"{m} {stats['monto_total']:,.2f}"],
+            ["Monto DR (Facturas)", f"{m} {stats['monto_dr']:,.2f}"],
+            ["Monto DL (Letras)", f"{m} {stats['monto_dl']:,.2f}"],
+            ["Registros originales", f"{total_registros:,}"],
+            ["Columnas identificadas", f"{total_columnas}"],
+            ["Tiempo procesamiento", f"{tiempo_proceso:.1f} segundos"],
+            ["Fecha reporte", mes_reporte.strftime("%d/%m/%Y")]
+        ]
+        if generador is not None and generador.monedas is not None:
+            filas += ProcesadorARPC._filas_monedas(generador)
+        if validacion is not None:
+            filas += validacion.filas_resumen()
+        return filas
+    
+    @staticmethod
+    def _filas_monedas(generador: GeneradorTablasDinamicas) -> List[List]:
+        # Montos por moneda del documento: en la moneda original y en la de reporte
+        moneda_reporte = generador.moneda_reporte
+        filas = [["Moneda de reporte", moneda_reporte or "Sin tabla de tipos de cambio (montos sin convertir)"]]
+        for moneda, fila in generador.monedas.iterrows():
+            filas.append([f"Monto en {moneda} (moneda original)",
+                          f"{moneda} {fila['MONTO_ORIGEN']:,.2f} ({int(fila['DOCUMENTOS']):,} documentos)"])
+            if moneda_reporte and moneda != moneda_reporte:
+                filas.append([f"Monto en {moneda} convertido", f"{moneda_reporte} {fila['MONTO']:,.2f}"])
+        return filas
+
+# ==================== PROCESAMIENTO POR BLOQUES (MEMORIA ACOTADA) ====================
+# Para historiales de millones de filas: se lee, clasifica y escribe bloque a bloque;
+# solo se conservan en memoria los cubos agregados
+class ProcesadorPorBloques:
+    def __init__(self, mes_reporte: datetime, filas_por_bloque: int = 100_000,
+                 lector: Optional[LectorSAP] = None, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, tipos_cambio: Optional[TiposCambio] = None):
+        self.mes_reporte = mes_reporte
+        self.inicio_semana = inicio_semana
+        self.reglas = reglas
+        self.tipos_cambio = tipos_cambio
+        self.historial: Optional[HistorialARPC] = None
+        self.filas_por_bloque = filas_por_bloque
+        self.lector = lector or LectorSAP()
+        self.gestor = GestorConsolidado([])
+        self.generador_tablas = None
+        self.validacion: Optional[ValidadorDatos] = None
+        self.total_registros = 0
+        self.tiempo_proceso = 0
+        self.metricas = MetricasProceso()
+    
+    def procesar(self, archivo: str, ruta_salida: str) -> bool:
+        inicio = datetime.now()
+        clasificador = ClasificadorVectorizado(self.mes_reporte, self.inicio_semana, self.reglas, self.tipos_cambio)
+        moneda_reporte = clasificador.tipos_cambio.moneda_reporte
+        escritor = EscritorPorBloques(ruta_salida)
+        self.validacion = ValidadorDatos(tipos_cambio=self.tipos_cambio, fecha_cambio=self.mes_reporte)
+        cubos, cubos_sociedades, cubos_monedas = [], [], []
+        sin_tasa = []
+        filtrados = 0
+        columnas = 0
+        
+        print(f"\n   🔄 Procesando {os.path.basename(archivo)} por bloques de {self.filas_por_bloque:,} filas...")
+        self.metricas.reiniciar()
+        bloques = self.lector.leer_por_bloques(archivo, self.filas_por_bloque)
+        while True:
+            # Cada etapa acumula su tiempo a lo largo de todos los bloques
+            with self.metricas.etapa('lectura') as medida:
+                bloque = next(bloques, None)
+                medida['filas'] = len(bloque) if bloque is not None else 0
+            if bloque is None:
+                break
+            columnas = max(columnas, len(bloque.columns))
+            with self.metricas.etapa('filtrado', len(bloque)):
+                mascara = bloque['CD'].isin(['DR', 'DL']).to_numpy()
+                df_filtrado = bloque[mascara]
+            filtrados += len(df_filtrado)
+            with self.metricas.etapa('validacion', len(df_filtrado)):
+                self.validacion.validar(df_filtrado, np.flatnonzero(mascara), self.lector.fechas_invalidas,
+                                        self.lector.inicios_bloque)
+            self.total_registros += len(bloque)
+            
+            # Cada bloque se clasifica, se agrega al cubo y se escribe de inmediato
+            with self.metricas.etapa('clasificacion', len(df_filtrado)):
+                clasificacion = clasificador.clasificar(df_filtrado)
+                sin_tasa.append(ClasificadorVectorizado.resumen_sin_tasa(clasificacion))
+            with self.metricas.etapa('agregacion', len(df_filtrado)):
+                gestor_bloque = GestorDocumentos()
+                gestor_bloque.moneda_reporte = moneda_reporte
+                gestor_bloque.agregar_clasificados(
+                    df_filtrado, np.arange(len(df_filtrado)), clasificacion, self.mes_reporte
+                )
+                if len(gestor_bloque) > 0:
+                    cubos.append(gestor_bloque.obtener_cubo())
+                    cubos_sociedades.append(gestor_bloque.obtener_cubo_sociedades())
+                    cubos_monedas.append(gestor_bloque.obtener_cubo_monedas())
+                if len(cubos) >= 50:
+                    parcial = GestorConsolidado(cubos, cubos_sociedades, cubos_monedas)
+                    cubos, cubos_sociedades, cubos_monedas = (
+                        [parcial.obtener_cubo()], [parcial.obtener_cubo_sociedades()], [parcial.obtener_cubo_monedas()]
+                    )
+            if len(gestor_bloque) > 0:
+                with self.metricas.etapa('exportacion', len(gestor_bloque)):
+                    escritor.agregar(gestor_bloque.a_dataframe())
+            print(f"   📝 {self.total_registros:,} registros procesados...")
+        
+        if sin_tasa:
+            ProcesadorARPC._advertir_sin_tasa(pd.concat(sin_tasa).groupby(level=0).sum(), self.mes_reporte)
+        with self.metricas.etapa('tablas', filtrados):
+            self.gestor = GestorConsolidado(cubos, cubos_sociedades, cubos_monedas, moneda_reporte)
+            self.generador_tablas = GeneradorTablasDinamicas(self.gestor)
+            self.generador_tablas.generar_tablas()
+        self.tiempo_proceso = (datetime.now() - inicio).total_seconds()
+        
+        stats = self.gestor.obtener_estadisticas()
+        with self.metricas.etapa('exportacion'):
+            ruta_tablas = escritor.cerrar(self.generador_tablas, ProcesadorARPC._filas_resumen(
+                stats, self.total_registros, columnas, self.tiempo_proceso, self.mes_reporte, self.validacion,
+                self.generador_tablas
+            ), self.validacion.rechazos())
+        
+        print(f"   ✅ Filtrado DR/DL - Completado ({filtrados:,} de {self.total_registros:,})")
+        print(f"      • DR (Facturas): {stats['dr']:,} documentos")
+        print(f"      • DL (Letras): {stats['dl']:,} documentos")
+        for aviso in self.lector.fechas.describir_fallidas():
+            print(f"   ⚠️  {aviso}")
+        self.validacion.imprimir()
+        print(f"   ✅ {escritor.filas_escritas:,} registros escritos en {ruta_salida}")
+        if ruta_tablas != ruta_salida:
+            print(f"   ✅ Tablas dinámicas y resumen en {ruta_tablas}")
+        if self.historial is not None:
+            # Por bloques solo se conserva el cubo: el historial guarda los agregados
+            with self.metricas.etapa('historial'):
+                self.historial.registrar(archivo, self.mes_reporte, self.gestor,
+                                         self.total_registros, clasificador.firma())
+            print(f"   ✅ Agregados registrados en el historial ({self.historial.ruta})")
+        print(f"\n   ⏱️  **Tiempo transcurrido: {self.tiempo_proceso:.1f} segundos**")
+        self.metricas.imprimir()
+        return True
+
+# ==================== PROCESAMIENTO POR LOTES (SIN INTERFAZ) ====================
+# Procesa varios archivos SAP sin diálogos tkinter (nodos del programador de tareas)
+class ProcesadorLote:
+    CODIGO_OK = 0
+    CODIGO_ERROR_LECTURA = 1
+    CODIGO_ERROR_PROCESO = 2
+    CODIGO_ERROR_EXPORTACION = 3
+    CODIGO_NO_ENCONTRADO = 4
+    
+    def __init__(self, directorio_salida: str, mes_reporte: datetime, usar_cache: bool = True,
+                 procesos: int = 1, generar_reportes: bool = True,
+                 formatos_adicionales: Optional[List[str]] = None,
+                 perfilar: Optional[List[str]] = None, perfilador: str = 'cprofile',
+                 directorio_incremental: Optional[str] = None, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, historial: Optional[str] = None,
+                 tipos_cambio: Optional[TiposCambio] = None):
+        self.directorio_salida = directorio_salida
+        self.mes_reporte = mes_reporte
+        self.usar_cache = usar_cache
+        self.procesos = max(1, procesos)
+        self.generar_reportes = generar_reportes
+        self.formatos_adicionales = formatos_adicionales or []
+        self.perfilar = perfilar or []
+        self.perfilador = perfilador
+        self.inicio_semana = inicio_semana
+        self.reglas = reglas
+        self.tipos_cambio = tipos_cambio  # cargada una vez; se envía a cada proceso de trabajo
+        self.historial = historial  # ruta de la base; cada proceso abre su propia conexión
+        # Con estado incremental los archivos se procesan en orden, cada uno contra el anterior
+        self.directorio_incremental = directorio_incremental
+        if directorio_incremental and self.procesos > 1:
+            print("   ⚠️  Modo incremental: los archivos se procesan en orden (sin procesos paralelos)")
+            self.procesos = 1
+        self.resultados: List[Dict] = []
+        self.cubos: Dict[str, pd.DataFrame] = {}
+        self.cubos_sociedades: Dict[str, Optional[pd.DataFrame]] = {}
+        self.cubos_monedas: Dict[str, pd.DataFrame] = {}
+        self.tiempo_total = 0.0
+    
+    @staticmethod
+    def expandir_entradas(entradas: List[str]) -> List[str]:
+        # Rutas y patrones glob, sin duplicados y en el orden recibido
+        archivos = []
+        for entrada in entradas:
+            coincidencias = sorted(glob.glob(entrada, recursive=True)) if glob.has_magic(entrada) else [entrada]
+            for archivo in coincidencias:
+                if archivo not in archivos:
+                    archivos.append(archivo)
+        return archivos
+    
+    def ruta_salida(self, archivo: str, usadas: List[str]) -> str:
+        mes = self.mes_reporte.strftime("%Y%m")
+        base, extension = os.path.splitext(os.path.basename(archivo))
+        ruta = os.path.join(self.directorio_salida, f"ARPC_PROYECCIONES_{mes}_{base}.xlsx")
+        if ruta in usadas:
+            # Mismo nombre con otra extensión (p. ej. .csv y .xlsx) en la misma ejecución
+            ruta = ruta[:-5] + f"_{extension.lstrip('.')}.xlsx"
+        return ruta
+    
+    def procesar_archivo(self, archivo: str, salida: Optional[str]) -> Dict:
+        # Devuelve el estado del archivo y su cubo agregado (nunca el DataFrame completo)
+        inicio = datetime.now()
+        resultado = {'archivo': archivo, 'salida': None, 'codigo': self.CODIGO_OK,
+                     'estado': 'OK', 'mensaje': '', 'registros': 0, 'columnas': 0,
+                     'documentos': 0, 'cubo': None, 'cubo_sociedades': None, 'cubo_monedas': None}
+        
+        procesador = ProcesadorARPC(usar_cache=self.usar_cache)
+        procesador.mes_reporte = self.mes_reporte
+        procesador.inicio_semana = self.inicio_semana
+        procesador.reglas = self.reglas
+        procesador.tipos_cambio = self.tipos_cambio
+        procesador.formatos_adicionales = self.formatos_adicionales
+        if self.procesos > 1:
+            # Con varios archivos en paralelo, las hojas de cada libro se leen en su proceso
+            procesador.lector.procesos = 1
+        procesador.metricas = MetricasProceso(
+            self.perfilar, self.perfilador, os.path.join(self.directorio_salida, "perfiles"),
+            prefijo=os.path.basename(archivo).replace(".", "_")
+        )
+        if self.directorio_incremental:
+            procesador.incremental = EstadoIncremental(self.directorio_incremental)
+        try:
+            if self.historial:
+                procesador.historial = HistorialARPC(self.historial)
+            if not os.path.isfile(archivo):
+                raise FileNotFoundError(archivo)
+            procesador.cargar_archivo(archivo)
+            resultado['registros'] = procesador.total_registros
+            resultado['columnas'] = procesador.total_columnas
+            if procesador.lector.fechas.fallidas:
+                resultado['fechas_no_interpretables'] = dict(procesador.lector.fechas.fallidas)
+            
+            if not procesador.cargar_y_procesar():
+                resultado.update(codigo=self.CODIGO_ERROR_PROCESO, estado='ERROR_PROCESO',
+                                 mensaje=procesador.ultimo_error or '')
+            else:
+                resultado['documentos'] = len(procesador.gestor)
+                resultado['rechazos'] = {motivo: cantidad for motivo, cantidad
+                                         in procesador.validacion.conteos.items() if cantidad}
+                if procesador.incremental is not None:
+                    resultado['incremental'] = procesador.incremental.resumen
+                resultado['cubo'] = procesador.gestor.obtener_cubo()
+                resultado['cubo_sociedades'] = procesador.gestor.obtener_cubo_sociedades()
+                resultado['cubo_monedas'] = procesador.gestor.obtener_cubo_monedas()
+                if salida:
+                    if procesador.exportar_a(salida):
+                        resultado['salida'] = salida
+                    else:
+                        resultado.update(codigo=self.CODIGO_ERROR_EXPORTACION, estado='ERROR_EXPORTACION',
+                                         mensaje=procesador.ultimo_error or '')
+        except FileNotFoundError as e:
+            resultado.update(codigo=self.CODIGO_NO_ENCONTRADO, estado='NO_ENCONTRADO', mensaje=str(e))
+        except ErrorArchivoSAP as e:
+            resultado.update(codigo=self.CODIGO_ERROR_LECTURA, estado='ERROR_LECTURA', mensaje=str(e))
+        except Exception as e:
+            resultado.update(codigo=self.CODIGO_ERROR_PROCESO, estado='ERROR_PROCESO', mensaje=str(e))
+        
+        resultado['segundos'] = round((datetime.now() - inicio).total_seconds(), 3)
+        resultado['metricas'] = procesador.metricas.a_diccionario()
+        return resultado
+    
+    def _procesar_en_trabajador(self, archivo: str, salida: Optional[str]) -> Dict:
+        # En los procesos de trabajo no se imprime el avance de cada archivo
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.procesar_archivo(archivo, salida)
+    
+    def ejecutar(self, archivos: List[str]) -> List[Dict]:
+        inicio = datetime.now()
+        os.makedirs(self.directorio_salida, exist_ok=True)
+        salidas = []
+        for archivo in archivos:
+            salidas.append(self.ruta_salida(archivo, salidas) if self.generar_reportes else None)
+        
+        if self.procesos > 1 and len(archivos) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.procesos, len(archivos))) as pool:
+                resultados = list(pool.map(self._procesar_en_trabajador, archivos, salidas))
+        else:
+            resultados = [self.procesar_archivo(a, s) for a, s in zip(archivos, salidas)]
+        
+        self.resultados, self.cubos, self.cubos_sociedades, self.cubos_monedas = [], {}, {}, {}
+        for resultado in resultados:
+            cubo, cubo_sociedades = resultado.pop('cubo'), resultado.pop('cubo_sociedades')
+            cubo_monedas = resultado.pop('cubo_monedas')
+            if cubo is not None:
+                self.cubos[resultado['archivo']] = cubo
+                self.cubos_sociedades[resultado['archivo']] = cubo_sociedades
+                self.cubos_monedas[resultado['archivo']] = cubo_monedas
+            self.resultados.append(resultado)
+        self.tiempo_total = (datetime.now() - inicio).total_seconds()
+        return self.resultados
+    
+    def exportar_consolidado(self, ruta_salida: str) -> bool:
+        # Tablas dinámicas y RESUMEN de todos los archivos a partir de sus cubos
+        if not self.cubos:
+            print("\n⚠️  No hay datos para consolidar")
+            return False
+        
+        gestor = GestorConsolidado(list(self.cubos.values()), list(self.cubos_sociedades.values()),
+                                   list(self.cubos_monedas.values()),
+                                   self.tipos_cambio.moneda_reporte if self.tipos_cambio else None)
+        generador = GeneradorTablasDinamicas(gestor)
+        generador.generar_tablas()
+        correctos = [r for r in self.resultados if r['archivo'] in self.cubos]
+        
+        filas = ProcesadorARPC._filas_resumen(
+            gestor.obtener_estadisticas(),
+            sum(r['registros'] for r in correctos),
+            max(r['columnas'] for r in correctos),
+            self.tiempo_total, self.mes_reporte, generador=generador
+        )
+        filas.append(["Archivos consolidados", f"{len(correctos)} de {len(self.resultados)}"])
+        
+        with pd.ExcelWriter(ruta_salida, engine='openpyxl') as writer:
+            ProcesadorARPC._escribir_tablas_dinamicas(writer, generador)
+            pd.DataFrame(filas, columns=['INDICADOR', 'VALOR']).to_excel(
+                writer, sheet_name='RESUMEN', index=False
+            )
+            pd.DataFrame([{k: v for k, v in r.items() if not isinstance(v, dict)}
+                          for r in self.resultados]).to_excel(
+                writer, sheet_name='ARCHIVOS', index=False
+            )
+        
+        print(f"   📊 Consolidado: {ruta_salida} ({len(correctos)} archivos)")
+        return True
+    
+    def escribir_resumen(self, ruta: str, inicio: datetime):
+        resumen = {
+            'inicio': inicio.isoformat(timespec='seconds'),
+            'fin': datetime.now().isoformat(timespec='seconds'),
+            'mes_reporte': self.mes_reporte.strftime("%Y-%m"),
+            'archivos_total': len(self.resultados),
+            'archivos_ok': sum(1 for r in self.resultados if r['codigo'] == self.CODIGO_OK),
+            'codigo_salida': self.codigo_salida(),
+            'archivos': self.resultados
+        }
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(resumen, archivo, ensure_ascii=False, indent=2)
+    
+    def escribir_metricas(self, ruta: str):
+        # Métricas por etapa de cada archivo, etiquetadas con su nombre
+        MetricasProceso.escribir(ruta, [
+            ({'archivo': os.path.basename(r['archivo']), 'mes': self.mes_reporte.strftime("%Y-%m")},
+             r['metricas'])
+            for r in self.resultados if r.get('metricas')
+        ])
+    
+    def codigo_salida(self) -> int:
+        # 0 si todos los archivos terminaron bien, si no el mayor código por archivo
+        return max((r['codigo'] for r in self.resultados), default=self.CODIGO_OK)
+
+# ==================== VIGILANCIA DE CARPETA ====================
+# Procesa las exportaciones que Tesorería deja en una carpeta compartida. Sondeo periódico
+# (sin dependencias y válido en unidades de red): un archivo está listo cuando su tamaño y
+# fecha de modificación no cambian durante `estabilidad` segundos. Los archivos con el mismo
+# contenido (hash) se procesan una sola vez, también entre reinicios, y cada archivo terminado
+# deja su latencia (detección → reporte) en un registro rotativo
+class VigilanteCarpeta:
+    ARCHIVO_ESTADO = "vigilancia_estado.json"
+    ARCHIVO_LATENCIAS = "vigilancia_latencias.jsonl"
+    MAX_BYTES_LATENCIAS = 5 * 1024 * 1024  # al superarlo se rota a .1
+    PREFIJOS_TEMPORALES = ('~$', '.~lock', '.')
+    SUFIJOS_TEMPORALES = ('.tmp', '.part', '.crdownload')
+    
+    def __init__(self, carpeta: str, lote: ProcesadorLote, intervalo: float = 2.0,
+                 estabilidad: float = 5.0, mes_fijo: bool = False):
+        # lote: configuración de procesamiento (salida, reglas, caché, historial...); sus
+        # procesos son los archivos procesados a la vez. mes_fijo=False: mes actual al procesar
+        self.carpeta = carpeta
+        self.lote = lote
+        self.procesos = lote.procesos
+        self.intervalo = intervalo
+        self.estabilidad = estabilidad
+        self.mes_fijo = mes_fijo
+        self.ruta_estado = os.path.join(lote.directorio_salida, self.ARCHIVO_ESTADO)
+        self.ruta_latencias = os.path.join(lote.directorio_salida, self.ARCHIVO_LATENCIAS)
+        self.procesados: Dict[str, Dict] = self._leer_estado()
+        self.latencias = deque(maxlen=200)
+        self._vistos: Dict[str, Dict] = {}
+        self._cola = deque()
+        self._en_curso: Dict = {}
+        self._detener = threading.Event()
+    
+    def detener(self):
+        self._detener.set()
+    
+    # ---------- Estado persistente (hashes ya procesados) ----------
+    def _leer_estado(self) -> Dict[str, Dict]:
+        try:
+            with open(self.ruta_estado, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return {}
+    
+    def _guardar_estado(self):
+        temporal = self.ruta_estado + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(self.procesados, archivo, ensure_ascii=False, indent=2)
+        os.replace(temporal, self.ruta_estado)
+    
+    @staticmethod
+    def _hash_contenido(ruta: str) -> str:
+        digest = hashlib.sha256()
+        with open(ruta, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b''):
+                digest.update(bloque)
+        return digest.hexdigest()
+    
+    # ---------- Detección ----------
+    def _es_candidato(self, nombre: str) -> bool:
+        minusculas = nombre.lower()
+        return (os.path.splitext(minusculas)[1] in LectorSAP.EXTENSIONES
+                and not nombre.startswith(self.PREFIJOS_TEMPORALES)
+                and not minusculas.endswith(self.SUFIJOS_TEMPORALES))
+    
+    def _explorar(self):
+        ahora = time.time()
+        presentes = set()
+        try:
+            with os.scandir(self.carpeta) as iterador:
+                entradas = list(iterador)
+        except OSError:
+            # Carpeta compartida no disponible por un momento: se conserva lo visto y se reintenta
+            return
+        for entrada in entradas:
+            try:
+                if not entrada.is_file() or not self._es_candidato(entrada.name):
+                    continue
+                presentes.add(entrada.path)
+                estado = entrada.stat()
+            except OSError:
+                # Eliminado, renombrado o bloqueado entre el listado y la consulta: siguiente sondeo
+                continue
+            ruta = entrada.path
+            firma = (estado.st_size, estado.st_mtime_ns)
+            registro = self._vistos.get(ruta)
+            if registro is None or registro['firma'] != firma:
+                # Archivo nuevo, aún copiándose o reemplazado por otra versión
+                en_espera = registro is not None and not registro['encolado']
+                self._vistos[ruta] = {'firma': firma, 'detectado': registro['detectado'] if en_espera else ahora,
+                                      'cambio': ahora, 'encolado': False}
+            elif not registro['encolado'] and firma[0] > 0 and ahora - registro['cambio'] >= self.estabilidad:
+                self._encolar(ruta, registro, ahora)
+        for ruta in set(self._vistos) - presentes:
+            del self._vistos[ruta]
+    
+    def _encolar(self, ruta: str, registro: Dict, ahora: float):
+        try:
+            clave = self._hash_contenido(ruta)
+        except OSError:
+            # Bloqueado por quien lo está copiando: se reintenta en el siguiente sondeo
+            registro['cambio'] = ahora
+            return
+        registro['encolado'] = True
+        nombre = os.path.basename(ruta)
+        en_curso = {trabajo['hash'] for trabajo in self._en_curso.values()} | {t['hash'] for t in self._cola}
+        if clave in self.procesados or clave in en_curso:
+            previo = self.procesados.get(clave, {}).get('archivo', 'en curso')
+            print(f"   ⏭️  {nombre}: contenido ya procesado ({os.path.basename(previo)}), se omite")
+            return
+        self._cola.append({'ruta': ruta, 'hash': clave, 'detectado': registro['detectado'], 'listo': ahora})
+        print(f"   📥 {nombre} en cola ({len(self._cola)} pendientes)")
+    
+    # ---------- Procesamiento (concurrencia acotada) ----------
+    def _ruta_salida(self, trabajo: Dict) -> str:
+        ruta = self.lote.ruta_salida(trabajo['ruta'], [])
+        if os.path.exists(ruta):
+            # Otra versión de un archivo con el mismo nombre: no se sobrescribe su reporte
+            ruta = ruta[:-5] + f"_{trabajo['hash'][:8]}.xlsx"
+        return ruta
+    
+    def _despachar(self, pool: ProcessPoolExecutor):
+        while self._cola and len(self._en_curso) < self.procesos:
+            trabajo = self._cola.popleft()
+            if not self.mes_fijo:
+                hoy = datetime.now()
+                self.lote.mes_reporte = datetime(hoy.year, hoy.month, 1)
+            trabajo['inicio'] = time.time()
+            futuro = pool.submit(self.lote._procesar_en_trabajador, trabajo['ruta'], self._ruta_salida(trabajo))
+            self._en_curso[futuro] = trabajo
+    
+    def _recoger(self, terminados):
+        for futuro in terminados:
+            trabajo = self._en_curso.pop(futuro)
+            try:
+                resultado = futuro.result()
+                for clave in ('cubo', 'cubo_sociedades', 'cubo_monedas'):
+                    resultado.pop(clave, None)
+            except Exception as e:
+                resultado = {'codigo': ProcesadorLote.CODIGO_ERROR_PROCESO, 'estado': 'ERROR_PROCESO',
+                             'mensaje': str(e), 'salida': None, 'segundos': 0.0}
+            self._registrar(trabajo, resultado)
+    
+    def _registrar(self, trabajo: Dict, resultado: Dict):
+        fin = time.time()
+        nombre = os.path.basename(trabajo['ruta'])
+        latencia = fin - trabajo['detectado']
+        registro = {
+            'archivo': nombre, 'hash': trabajo['hash'][:16], 'estado': resultado['estado'],
+            'codigo': resultado['codigo'], 'salida': resultado.get('salida'),
+            'detectado': datetime.fromtimestamp(trabajo['detectado']).isoformat(timespec='seconds'),
+            'fin': datetime.fromtimestamp(fin).isoformat(timespec='seconds'),
+            'latencia_s': round(latencia, 3),
+            'espera_estabilidad_s': round(trabajo['listo'] - trabajo['detectado'], 3),
+            'cola_s': round(trabajo['inicio'] - trabajo['listo'], 3),
+            'proceso_s': round(fin - trabajo['inicio'], 3),
+            'registros': resultado.get('registros', 0), 'documentos': resultado.get('documentos', 0)
+        }
+        self._escribir_latencia(registro)
+        
+        if resultado['codigo'] != ProcesadorLote.CODIGO_OK:
+            # No se marca como procesado: se reintenta si el archivo vuelve a cambiar
+            print(f"   ❌ {nombre}: {resultado['estado']} {resultado.get('mensaje', '')}".rstrip())
+            return
+        self.procesados[trabajo['hash']] = {'archivo': trabajo['ruta'], 'salida': resultado.get('salida'),
+                                            'fecha': registro['fin']}
+        self._guardar_estado()
+        self.latencias.append(latencia)
+        p50, p95 = np.percentile(np.array(self.latencias), [50, 95])
+        print(f"   ✅ {nombre} → {os.path.basename(resultado.get('salida') or '')} "
+              f"(latencia {latencia:.1f} s; p50 {p50:.1f} s, p95 {p95:.1f} s en {len(self.latencias)} archivos)")
+    
+    def _escribir_latencia(self, registro: Dict):
+        if os.path.exists(self.ruta_latencias) and os.path.getsize(self.ruta_latencias) > self.MAX_BYTES_LATENCIAS:
+            os.replace(self.ruta_latencias, self.ruta_latencias + ".1")
+        with open(self.ruta_latencias, 'a', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    
+    # ---------- Ciclo principal ----------
+    def _inactivo(self) -> bool:
+        return (not self._cola and not self._en_curso
+                and all(registro['encolado'] for registro in self._vistos.values()))
+    
+    def ejecutar(self, una_pasada: bool = False):
+        # una_pasada: procesa lo que ya está en la carpeta y termina; si no, hasta detener() o Ctrl+C
+        if not os.path.isdir(self.carpeta):
+            raise FileNotFoundError(self.carpeta)
+        os.makedirs(self.lote.directorio_salida, exist_ok=True)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.detener())
+        print(f"   👀 Vigilando {os.path.abspath(self.carpeta)} (cada {self.intervalo:g} s, "
+              f"estable {self.estabilidad:g} s, {self.procesos} a la vez)")
+        print(f"   📁 Reportes en {os.path.abspath(self.lote.directorio_salida)}")
+        
+        with ProcessPoolExecutor(max_workers=self.procesos) as pool:
+            while not self._detener.is_set():
+                self._explorar()
+                self._despachar(pool)
+                if una_pasada and self._inactivo():
+                    break
+                if self._en_curso:
+                    # Se despierta al terminar un archivo (o al siguiente sondeo)
+                    terminados, _ = wait(list(self._en_curso), timeout=self.intervalo, return_when=FIRST_COMPLETED)
+                    self._recoger(terminados)
+                else:
+                    self._detener.wait(self.intervalo)
+            self._recoger(wait(list(self._en_curso)).done)
+
+# ==================== SERVICIO HTTP LOCAL (asyncio) ====================
+# API local para obtener las tablas dinámicas sin la consola: la lectura y clasificación
+# corren en procesos de trabajo y los resultados se guardan en un LRU por hash del archivo
+def _tabla_json(tabla: Optional[pd.DataFrame], indice: bool = True) -> Dict:
+    if tabla is None:
+        return {'columnas': [], 'filas': []}
+    tabla = tabla.reset_index() if indice else tabla
+    return {'columnas': [str(c) for c in tabla.columns],
+            'filas': tabla.astype(object).where(tabla.notna(), None).to_dict(orient='records')}
+
+
+def _procesar_para_servicio(contenido: bytes, nombre: str, mes_reporte: datetime,
+                            inicio_semana: Optional[int], reglas: Optional[ReglasClasificacion] = None,
+                            tipos_cambio: Optional[TiposCambio] = None,
+                            ruta_detalle: Optional[str] = None) -> Dict:
+    # Se ejecuta en un proceso de trabajo: el archivo subido va a un directorio temporal.
+    # Vuelven solo las tablas, el reporte y las estadísticas; el detalle por documento queda
+    # en ruta_detalle (disco) y el servicio lo indexa cuando se consulta
+    with tempfile.TemporaryDirectory(prefix="arpc_api_") as directorio:
+        archivo = os.path.join(directorio, os.path.basename(nombre))
+        with open(archivo, 'wb') as destino:
+            destino.write(contenido)
+        procesador = ProcesadorARPC(usar_cache=False)
+        procesador.mes_reporte = mes_reporte
+        procesador.inicio_semana = inicio_semana
+        procesador.reglas = reglas
+        procesador.tipos_cambio = tipos_cambio
+        procesador.lector.procesos = 1  # ya corre en un proceso de trabajo del servicio
+        with contextlib.redirect_stdout(io.StringIO()):
+            procesador.cargar_archivo(archivo)
+            if not procesador.cargar_y_procesar():
+                raise ErrorProcesamiento(f"No se pudo procesar el archivo: {procesador.ultimo_error}")
+            salida = os.path.join(directorio, "ARPC_PROYECCIONES.xlsx")
+            if not procesador.exportar_a(salida):
+                raise ErrorProcesamiento(f"No se pudo generar el reporte: {procesador.ultimo_error}")
+        with open(salida, 'rb') as reporte:
+            xlsx = reporte.read()
+    detalle = IndiceDocumentos.guardar(procesador.gestor, ruta_detalle) if ruta_detalle else None
+    
+    return {
+        'tabla_proyecciones': _tabla_json(procesador.generador_tablas.tabla_proyecciones),
+        'tabla_cd': _tabla_json(procesador.generador_tablas.tabla_cd),
+        'sociedades': {sociedad: {'tabla_proyecciones': _tabla_json(proyecciones), 'tabla_cd': _tabla_json(cd)}
+                       for sociedad, (proyecciones, cd) in procesador.generador_tablas.tablas_sociedad.items()},
+        'monedas': {moneda: {'tabla_proyecciones': _tabla_json(proyecciones), 'tabla_cd': _tabla_json(cd)}
+                    for moneda, (proyecciones, cd) in procesador.generador_tablas.tablas_moneda.items()},
+        'moneda_reporte': procesador.gestor.moneda_reporte,
+        'detalle': detalle,
+        'estadisticas': procesador.gestor.obtener_estadisticas(),
+        'rechazos': {motivo: cantidad for motivo, cantidad in procesador.validacion.conteos.items() if cantidad},
+        'registros': procesador.total_registros,
+        'xlsx': xlsx
+    }
+
+
+class ServicioARPC:
+    ESTADOS_HTTP = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                    500: "Internal Server Error"}
+    TIPO_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    MAX_TRABAJOS = 1000  # estados de trabajo conservados (los más antiguos se descartan)
+    MAX_INDICES = 2  # índices de detalle en memoria (se reconstruyen desde disco)
+    
+    def __init__(self, host: str = "127.0.0.1", puerto: int = 8765, procesos: int = 2,
+                 max_resultados: int = 16, max_mb: float = 512, inicio_semana: Optional[int] = None,
+                 reglas: Optional[ReglasClasificacion] = None, tipos_cambio: Optional[TiposCambio] = None):
+        self.host = host
+        self.puerto = puerto
+        self.procesos = max(1, procesos)
+        self.max_resultados = max_resultados
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.inicio_semana = inicio_semana
+        # Las mismas reglas y tipos de cambio que lote / bloques / vigilar
+        self.reglas = reglas
+        self.tipos_cambio = tipos_cambio
+        self.trabajos: Dict[str, Dict] = {}
+        self.resultados: 'OrderedDict[str, Dict]' = OrderedDict()  # LRU: clave → resultado
+        self.indices: 'OrderedDict[str, IndiceDocumentos]' = OrderedDict()  # LRU: clave → índice
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._directorio: Optional[tempfile.TemporaryDirectory] = None  # detalle de cada resultado
+    
+    # ---------- Resultados (LRU por hash del archivo) ----------
+    def _resultado(self, clave: str) -> Optional[Dict]:
+        resultado = self.resultados.get(clave)
+        if resultado is not None:
+            self.resultados.move_to_end(clave)
+        return resultado
+    
+    def _guardar_resultado(self, clave: str, resultado: Dict):
+        self.resultados[clave] = resultado
+        self.resultados.move_to_end(clave)
+        while len(self.resultados) > self.max_resultados:
+            desalojada, anterior = self.resultados.popitem(last=False)
+            self.indices.pop(desalojada, None)
+            if anterior['detalle']:
+                try:
+                    os.remove(anterior['detalle'])
+                except OSError:
+                    pass
+    
+    async def _indice(self, clave: str, resultado: Dict) -> IndiceDocumentos:
+        # El índice se arma desde el detalle en disco en la primera consulta (en un hilo)
+        indice = self.indices.get(clave)
+        if indice is None:
+            indice = await asyncio.get_running_loop().run_in_executor(
+                None, IndiceDocumentos.abrir, resultado['detalle']
+            )
+            self.indices[clave] = indice
+            while len(self.indices) > self.MAX_INDICES:
+                self.indices.popitem(last=False)
+        self.indices.move_to_end(clave)
+        return indice
+    
+    # ---------- Trabajos ----------
+    async def crear_trabajo(self, contenido: bytes, nombre: str, mes_reporte: datetime) -> Dict:
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, lambda: hashlib.sha256(contenido).hexdigest())
+        # Reglas, calendario y tipos de cambio en la clave: otra configuración, otro resultado
+        firma = ClasificadorVectorizado(mes_reporte, self.inicio_semana, self.reglas, self.tipos_cambio).firma()
+        clave = f"{digest[:32]}_{firma}"
+        trabajo = {'id': uuid.uuid4().hex[:12], 'archivo': nombre, 'clave': clave,
+                   'mes_reporte': mes_reporte.strftime("%Y-%m"), 'estado': 'en_cola', 'mensaje': '',
+                   'creado': datetime.now().isoformat(timespec='seconds')}
+        self.trabajos[trabajo['id']] = trabajo
+        while len(self.trabajos) > self.MAX_TRABAJOS:
+            del self.trabajos[next(iter(self.trabajos))]
+        
+        if self._resultado(clave) is not None:
+            trabajo.update(estado='listo', mensaje='Recuperado de la caché')
+            return trabajo
+        futuro = self._en_curso.get(clave)
+        if futuro is None:
+            # El mismo archivo subido dos veces mientras se procesa comparte el trabajo
+            ruta_detalle = os.path.join(self._directorio.name, clave) if self._directorio else None
+            futuro = loop.run_in_executor(self._pool, _procesar_para_servicio,
+                                          contenido, nombre, mes_reporte, self.inicio_semana,
+                                          self.reglas, self.tipos_cambio, ruta_detalle)
+            self._en_curso[clave] = futuro
+            futuro.add_done_callback(lambda f: self._terminar(clave, f))
+        trabajo['estado'] = 'procesando'
+        futuro.add_done_callback(lambda f: self._actualizar(trabajo, f))
+        return trabajo
+    
+    def _terminar(self, clave: str, futuro: asyncio.Future):
+        self._en_curso.pop(clave, None)
+        if not futuro.cancelled() and futuro.exception() is None:
+            self._guardar_resultado(clave, futuro.result())
+    
+    @staticmethod
+    def _actualizar(trabajo: Dict, futuro: asyncio.Future):
+        if futuro.cancelled():
+            trabajo.update(estado='error', mensaje='Cancelado')
+        elif futuro.exception() is not None:
+            trabajo.update(estado='error', mensaje=str(futuro.exception()))
+        else:
+            trabajo['estado'] = 'listo'
+    
+    # ---------- HTTP ----------
+    async def _leer_peticion(self, lector: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        linea = (await lector.readline()).decode('latin-1').strip()
+        metodo, ruta, _ = linea.split(" ", 2)
+        cabeceras = {}
+        while True:
+            cabecera = (await lector.readline()).decode('latin-1').strip()
+            if not cabecera:
+                break
+            nombre, _, valor = cabecera.partition(":")
+            cabeceras[nombre.strip().lower()] = valor.strip()
+        longitud = int(cabeceras.get('content-length', 0))
+        if longitud > self.max_bytes:
+            raise ValueError(413)
+        cuerpo = await lector.readexactly(longitud) if longitud else b''
+        return metodo.upper(), ruta, cabeceras, cuerpo
+    
+    @classmethod
+    def _respuesta(cls, codigo: int, cuerpo, tipo: str = "application/json",
+                   extra: Optional[Dict[str, str]] = None) -> bytes:
+        if not isinstance(cuerpo, bytes):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False, default=str).encode('utf-8')
+            tipo = "application/json; charset=utf-8"
+        cabeceras = {"Content-Type": tipo, "Content-Length": str(len(cuerpo)), "Connection": "close"}
+        cabeceras.update(extra or {})
+        encabezado = f"HTTP/1.1 {codigo} {cls.ESTADOS_HTTP.get(codigo, '')}\r\n" + "".join(
+            f"{nombre}: {valor}\r\n" for nombre, valor in cabeceras.items()
+        )
+        return (encabezado + "\r\n").encode('latin-1') + cuerpo
+    
+    async def _atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            try:
+                metodo, ruta, _, cuerpo = await self._leer_peticion(lector)
+                respuesta = await self._enrutar(metodo, ruta, cuerpo)
+            except ValueError as e:
+                codigo = e.args[0] if e.args and isinstance(e.args[0], int) else 400
+                respuesta = self._respuesta(codigo, {'error': self.ESTADOS_HTTP[codigo]})
+            except Exception as e:
+                respuesta = self._respuesta(500, {'error': str(e)})
+            escritor.write(respuesta)
+            await escritor.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+    
+    async def _enrutar(self, metodo: str, ruta: str, cuerpo: bytes) -> bytes:
+        partes = urlsplit(ruta)
+        segmentos = [s for s in partes.path.split("/") if s]
+        parametros = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+        
+        if segmentos == ["salud"]:
+            return self._respuesta(200, {'estado': 'ok', 'trabajos': len(self.trabajos),
+                                         'resultados_en_memoria': len(self.resultados),
+                                         'indices_en_memoria': len(self.indices)})
+        if segmentos == ["trabajos"]:
+            if metodo == "GET":
+                return self._respuesta(200, list(self.trabajos.values()))
+            if metodo != "POST":
+                return self._respuesta(405, {'error': 'Use POST para subir una exportación'})
+            if not cuerpo:
+                return self._respuesta(400, {'error': 'Cuerpo vacío: envíe el archivo SAP'})
+            hoy = datetime.now()
+            try:
+                mes_reporte = (datetime.strptime(parametros['mes'], "%Y-%m") if 'mes' in parametros
+                               else datetime(hoy.year, hoy.month, 1))
+            except ValueError:
+                return self._respuesta(400, {'error': f"Mes inválido '{parametros['mes']}' (formato AAAA-MM)"})
+            nombre = os.path.basename(parametros.get('archivo', 'exportacion.xlsx'))
+            if os.path.splitext(nombre)[1].lower() not in LectorSAP.EXTENSIONES:
+                return self._respuesta(400, {'error': f"Formato no soportado: {nombre}"})
+            trabajo = await self.crear_trabajo(cuerpo, nombre, mes_reporte)
+            return self._respuesta(200 if trabajo['estado'] == 'listo' else 202, trabajo)
+        
+        if len(segmentos) < 2 or segmentos[0] != "trabajos" or segmentos[1] not in self.trabajos:
+            return self._respuesta(404, {'error': 'Trabajo no encontrado'})
+        trabajo = self.trabajos[segmentos[1]]
+        if len(segmentos) == 2:
+            return self._respuesta(200, trabajo)
+        if trabajo['estado'] != 'listo':
+            return self._respuesta(409, {'error': f"Trabajo en estado '{trabajo['estado']}'",
+                                         'mensaje': trabajo['mensaje']})
+        resultado = self._resultado(trabajo['clave'])
+        if resultado is None:
+            return self._respuesta(404, {'error': 'Resultado desalojado de la memoria: vuelva a subir el archivo'})
+        recurso = segmentos[2]
+        if recurso in ("proyecciones", "cd"):
+            # ?sociedad=...: tablas de una hoja del libro; ?moneda=...: en la moneda original
+            # de sus documentos (por defecto, las consolidadas)
+            tablas = resultado
+            if parametros.get('sociedad'):
+                tablas = resultado['sociedades'].get(parametros['sociedad'])
+                if tablas is None:
+                    return self._respuesta(404, {'error': f"Sociedad desconocida: {parametros['sociedad']}",
+                                                 'sociedades': list(resultado['sociedades'])})
+            elif parametros.get('moneda'):
+                tablas = resultado['monedas'].get(parametros['moneda'].strip().upper())
+                if tablas is None:
+                    return self._respuesta(404, {'error': f"Moneda sin tablas: {parametros['moneda']}",
+                                                 'monedas': list(resultado['monedas'])})
+            return self._respuesta(200, tablas['tabla_proyecciones' if recurso == "proyecciones" else 'tabla_cd'])
+        if recurso == "resumen":
+            return self._respuesta(200, {'registros': resultado['registros'], **resultado['estadisticas'],
+                                         'moneda_reporte': resultado['moneda_reporte'],
+                                         'monedas': list(resultado['monedas']),
+                                         'rechazos': resultado['rechazos']})
+        if recurso in ("documentos", "top", "buscar"):
+            if not resultado['detalle']:
+                return self._respuesta(404, {'error': 'Detalle por documento no disponible'})
+            indice = await self._indice(trabajo['clave'], resultado)
+            return self._respuesta(200, self._detalle(indice, recurso, parametros))
+        if recurso == "reporte":
+            nombre = f"ARPC_PROYECCIONES_{trabajo['mes_reporte'].replace('-', '')}.xlsx"
+            return self._respuesta(200, resultado['xlsx'], self.TIPO_XLSX,
+                                   {"Content-Disposition": f'attachment; filename="{nombre}"'})
+        return self._respuesta(404, {'error': f"Recurso desconocido: {recurso}"})
+    
+    @staticmethod
+    def _detalle(indice: IndiceDocumentos, recurso: str, parametros: Dict[str, str]) -> Dict:
+        # Consultas O(resultado) sobre el índice del archivo (documentos ordenados por monto)
+        if recurso == "buscar":
+            documentos = indice.buscar_ref_letra(parametros.get('ref_letra', ''))
+            return {'total': len(documentos), **_tabla_json(documentos, indice=False)}
+        semana = parametros.get('semana')
+        if semana and semana.isdigit():
+            semana = f"SEMANA_{semana}"
+        if recurso == "top":
+            n = int(parametros.get('n', 10))
+            documentos = indice.top(parametros.get('sectorista'), semana, n)
+            return {'total': len(documentos), **_tabla_json(documentos, indice=False)}
+        pagina, por_pagina = int(parametros.get('pagina', 0)), int(parametros.get('por_pagina', 50))
+        if 'tramo' in parametros:
+            documentos = indice.por_tramo(parametros['tramo'], pagina, por_pagina)
+            total = len(indice.posiciones_tramo(parametros['tramo']))
+        elif 'cd' in parametros:
+            documentos = indice.por_cd(parametros['cd'], pagina, por_pagina)
+            total = len(indice.posiciones_cd(parametros['cd']))
+        else:
+            documentos = indice.celda(parametros.get('sectorista'), semana, pagina, por_pagina)
+            total = len(indice.posiciones(parametros.get('sectorista'), semana))
+        return {'total': total, 'pagina': pagina, 'por_pagina': por_pagina,
+                **_tabla_json(documentos, indice=False)}
+    
+    async def servir(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+        self._directorio = tempfile.TemporaryDirectory(prefix="arpc_servicio_")
+        servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        print(f"   🌐 Servicio ARPC en http://{self.host}:{self.puerto} "
+              f"({self.procesos} procesos, {self.max_resultados} resultados en memoria)")
+        try:
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            self._pool.shutdown()
+            self.indices.clear()
+            self._directorio.cleanup()
+
+
+def _mes_reporte(texto: str) -> datetime:
+    try:
+        return datetime.strptime(texto, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Mes inválido '{texto}' (formato AAAA-MM)")
+
+
+def _inicio_semana(texto: str) -> Optional[int]:
+    texto = texto.strip().lower()
+    if texto in ("dia1", "día1"):
+        return None
+    for indice, dia in enumerate(CalendarioMes.DIAS_SEMANA):
+        if texto in (dia, dia.replace("é", "e"), dia.replace("á", "a")):
+            return indice
+    raise argparse.ArgumentTypeError(
+        f"Inicio de semana inválido '{texto}' ({', '.join(CalendarioMes.DIAS_SEMANA)} o dia1)"
+    )
+
+
+def _consultar_historial(args) -> int:
+    ruta = args.base or os.environ.get("ARPC_HISTORIAL", HistorialARPC.RUTA_DEFECTO)
+    if not os.path.exists(ruta):
+        print(f"❌ Historial no encontrado: {ruta}")
+        return ProcesadorLote.CODIGO_NO_ENCONTRADO
+    historial = HistorialARPC(ruta)
+    if args.ejecuciones:
+        print(historial.ejecuciones().to_string(index=False))
+        return ProcesadorLote.CODIGO_OK
+    tendencia = historial.tendencia(args.sectorista, args.proyeccion, args.meses)
+    print(f"\n   📈 {args.proyeccion} - {args.sectorista or 'todos los sectoristas'} "
+          f"(últimos {args.meses} meses)")
+    if len(tendencia) == 0:
+        print("   Sin registros")
+    for _, fila in tendencia.iterrows():
+        print(f"   {fila['MES']}  {int(fila['DOCUMENTOS']):>8,} docs  $ {fila['MONTO']:>16,.2f}")
+    return ProcesadorLote.CODIGO_OK
+
+
+def _ejecutar_backtest(args, parser: argparse.ArgumentParser) -> int:
+    try:
+        cortes = [datetime.strptime(c.strip(), "%Y-%m-%d") for c in args.cortes.split(",") if c.strip()]
+    except ValueError:
+        parser.error(f"Cortes inválidos '{args.cortes}' (formato AAAA-MM-DD)")
+    if not cortes and len(args.seguimientos) == 1:
+        fin_mes = args.mes.replace(day=calendar.monthrange(args.mes.year, args.mes.month)[1])
+        cortes = [fin_mes + timedelta(days=1)]
+    if len(cortes) != len(args.seguimientos):
+        parser.error("Indique con --cortes una fecha por cada exportación posterior")
+    try:
+        reglas = ReglasClasificacion.cargar(args.reglas) if args.reglas else None
+        lector = LectorSAP()
+        backtest = BacktestProyecciones(args.mes, args.inicio_semana, reglas, _cargar_tipos_cambio(args))
+        print(f"   🔄 {backtest.proyectar(lector.leer(args.proyeccion)):,} documentos proyectados "
+              f"en {os.path.basename(args.proyeccion)}")
+        if len(backtest.sin_tasa) > 0:
+            print(f"   ⚠️  {int(backtest.sin_tasa['DOCUMENTOS'].sum()):,} documentos sin tipo de cambio "
+                  f"({', '.join(map(str, backtest.sin_tasa.index))}): su monto cuenta como 0")
+        for archivo, corte in zip(args.seguimientos, cortes):
+            cobrados = backtest.seguimiento(lector.leer(archivo), corte)
+            print(f"   🔄 {os.path.basename(archivo)} ({corte:%Y-%m-%d}): {cobrados:,} cobrados")
+        backtest.imprimir()
+        if args.salida:
+            print(f"\n   ✅ Backtest guardado en {', '.join(backtest.exportar(args.salida))}")
+        return ProcesadorLote.CODIGO_OK
+    except FileNotFoundError as e:
+        print(f"❌ Archivo no encontrado: {e}")
+        return ProcesadorLote.CODIGO_NO_ENCONTRADO
+    except ErrorArchivoSAP as e:
+        print(f"❌ {e}")
+        return ProcesadorLote.CODIGO_ERROR_LECTURA
+    except ErrorProcesamiento as e:
+        print(f"❌ {e}")
+        return ProcesadorLote.CODIGO_ERROR_PROCESO
+
+
+def _cargar_tipos_cambio(args) -> Optional[TiposCambio]:
+    # Sin --tipos-cambio los montos quedan en su moneda original (ErrorTiposCambio si la tabla es inválida)
+    if not args.tipos_cambio:
+        return None
+    return TiposCambio.cargar(args.tipos_cambio, args.moneda_reporte)
+
+
+def _vigilar_carpeta(args) -> int:
+    try:
+        reglas = ReglasClasificacion.cargar(args.reglas) if args.reglas else None
+        tipos_cambio = _cargar_tipos_cambio(args)
+    except ErrorReglas as e:
+        print(f"❌ Reglas inválidas: {e}")
+        return ProcesadorLote.CODIGO_ERROR_PROCESO
+    except ErrorTiposCambio as e:
+        print(f"❌ {e}")
+        return ProcesadorLote.CODIGO_ERROR_PROCESO
+    hoy = datetime.now()
+    lote = ProcesadorLote(
+        args.salida, args.mes or datetime(hoy.year, hoy.month, 1), usar_cache=not args.sin_cache,
+        procesos=args.procesos,
+        formatos_adicionales=[f.strip().lower() for f in args.formatos.split(",") if f.strip()],
+        inicio_semana=args.inicio_semana, reglas=reglas, historial=args.historial, tipos_cambio=tipos_cambio
+    )
+    vigilante = VigilanteCarpeta(args.carpeta, lote, args.intervalo, args.estabilidad, mes_fijo=args.mes is not None)
+    try:
+        vigilante.ejecutar(una_pasada=args.una_pasada)
+    except FileNotFoundError as e:
+        print(f"❌ Carpeta no encontrada: {e}")
+        return ProcesadorLote.CODIGO_NO_ENCONTRADO
+    except KeyboardInterrupt:
+        pass
+    print(f"\n   👋 Vigilancia detenida ({len(vigilante.procesados)} archivos procesados en total)")
+    return ProcesadorLote.CODIGO_OK
+
+
+def ejecutar_cli(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="main.py", description="Sistema ARPC - procesamiento sin interfaz gráfica",
+        epilog="Sin subcomando se abre el menú interactivo (--reabrir: con la última ejecución restaurada)"
+    )
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    
+    lote = subcomandos.add_parser("lote", help="Procesar uno o más archivos SAP")
+    lote.add_argument("entradas", nargs="+", help="Rutas o patrones glob de archivos SAP")
+    lote.add_argument("-o", "--salida", required=True, help="Directorio de reportes")
+    lote.add_argument("-m", "--mes", type=_mes_reporte, default=None,
+                      help="Mes del reporte AAAA-MM (por defecto el mes actual)")
+    lote.add_argument("--resumen", default=None,
+                      help="Ruta del resumen JSON (por defecto <salida>/resumen_lote.json)")
+    lote.add_argument("--sin-cache", action="store_true", help="No usar la caché local")
+    lote.add_argument("-p", "--procesos", type=int, default=1,
+                      help="Procesos de trabajo para leer y clasificar en paralelo")
+    lote.add_argument("--consolidado", default=None,
+                      help="Ruta .xlsx del reporte consolidado de todos los archivos")
+    lote.add_argument("--sin-reportes", action="store_true",
+                      help="No generar el reporte individual de cada archivo")
+    lote.add_argument("--formatos", default="",
+                      help="Copias adicionales de DATOS_COMPLETOS, p. ej. csv,parquet")
+    lote.add_argument("--incremental", default=None,
+                      help="Directorio del estado incremental: solo se reclasifican las filas "
+                           "nuevas o modificadas desde la ejecución anterior")
+    
+    bloques = subcomandos.add_parser(
+        "bloques", help="Procesar un archivo muy grande por bloques (memoria acotada)"
+    )
+    bloques.add_argument("entrada", help="Archivo SAP (.xlsx, .csv o .parquet)")
+    bloques.add_argument("-o", "--salida", required=True,
+                         help="Archivo de salida .xlsx o .csv (filas enriquecidas)")
+    bloques.add_argument("-m", "--mes", type=_mes_reporte, default=None,
+                         help="Mes del reporte AAAA-MM (por defecto el mes actual)")
+    bloques.add_argument("--filas", type=int, default=100_000, help="Filas por bloque")
+    
+    for subcomando in (lote, bloques):
+        subcomando.add_argument("--inicio-semana", type=_inicio_semana, default=None,
+                                help="Día de inicio de las semanas del mes (lunes ... domingo); "
+                                     "por defecto bloques de 7 días desde el día 1")
+        subcomando.add_argument("--reglas", default=None,
+                                help="Tablas de tramos, estatus y semanas por unidad (.json o .yaml)")
+        subcomando.add_argument("--historial", default=None,
+                                help="Base SQLite donde registrar la ejecución (documentos y agregados)")
+        subcomando.add_argument("--metricas", default=None,
+                                help="Archivo de métricas por etapa (.json, o .prom para Prometheus)")
+        subcomando.add_argument("--perfilar", default="",
+                                help=f"Etapas a perfilar: {','.join(MetricasProceso.ETAPAS)} o 'todas'")
+        subcomando.add_argument("--perfilador", choices=MetricasProceso.PERFILADORES, default="cprofile",
+                                help="cprofile (.prof) o muestreo (pyinstrument, .html)")
+    
+    historial = subcomandos.add_parser(
+        "historial", help="Tendencias de varios meses desde el historial de ejecuciones"
+    )
+    historial.add_argument("--base", default=None,
+                           help=f"Base SQLite del historial (por defecto {HistorialARPC.RUTA_DEFECTO})")
+    historial.add_argument("--sectorista", default=None, help="Solo este sectorista")
+    historial.add_argument("--proyeccion", default="SEMANA_1", help="Semana proyectada (SEMANA_1 ...)")
+    historial.add_argument("--meses", type=int, default=12, help="Últimos meses registrados")
+    historial.add_argument("--ejecuciones", action="store_true", help="Listar las ejecuciones registradas")
+    
+    backtest = subcomandos.add_parser(
+        "backtest", help="Comparar las semanas proyectadas de un mes con exportaciones posteriores"
+    )
+    backtest.add_argument("proyeccion", help="Exportación SAP del mes proyectado")
+    backtest.add_argument("seguimientos", nargs="+", help="Exportaciones posteriores, en orden cronológico")
+    backtest.add_argument("-m", "--mes", type=_mes_reporte, required=True, help="Mes proyectado AAAA-MM")
+    backtest.add_argument("--cortes", default="",
+                          help="Fecha AAAA-MM-DD de cada exportación posterior (por defecto, con una "
+                               "sola exportación, el día 1 del mes siguiente)")
+    backtest.add_argument("-o", "--salida", default=None, help="Reporte .xlsx del backtest")
+    backtest.add_argument("--inicio-semana", type=_inicio_semana, default=None,
+                          help="Día de inicio de las semanas del mes (como en la proyección)")
+    backtest.add_argument("--reglas", default=None, help="Reglas de clasificación (.json o .yaml)")
+    
+    vigilar = subcomandos.add_parser(
+        "vigilar", help="Procesar automáticamente los archivos SAP que llegan a una carpeta"
+    )
+    vigilar.add_argument("carpeta", help="Carpeta compartida donde se dejan las exportaciones")
+    vigilar.add_argument("-o", "--salida", required=True,
+                         help="Directorio de reportes (también guarda el estado y el registro de latencias)")
+    vigilar.add_argument("-m", "--mes", type=_mes_reporte, default=None,
+                         help="Mes del reporte AAAA-MM (por defecto el mes actual al procesar cada archivo)")
+    vigilar.add_argument("-p", "--procesos", type=int, default=2, help="Archivos procesados a la vez")
+    vigilar.add_argument("--intervalo", type=float, default=2.0, help="Segundos entre sondeos de la carpeta")
+    vigilar.add_argument("--estabilidad", type=float, default=5.0,
+                         help="Segundos sin cambios de tamaño para considerar un archivo terminado")
+    vigilar.add_argument("--una-pasada", action="store_true",
+                         help="Procesar lo que ya hay en la carpeta y terminar")
+    vigilar.add_argument("--sin-cache", action="store_true", help="No usar la caché local")
+    vigilar.add_argument("--formatos", default="",
+                         help="Copias adicionales de DATOS_COMPLETOS, p. ej. csv,parquet")
+    vigilar.add_argument("--inicio-semana", type=_inicio_semana, default=None,
+                         help="Día de inicio de las semanas del mes (lunes ... domingo)")
+    vigilar.add_argument("--reglas", default=None, help="Reglas de clasificación (.json o .yaml)")
+    vigilar.add_argument("--historial", default=None,
+                         help="Base SQLite donde registrar cada ejecución")
+    
+    servicio = subcomandos.add_parser("servicio", help="API HTTP local (tablas dinámicas y reporte)")
+    servicio.add_argument("--host", default="127.0.0.1", help="Interfaz de escucha")
+    servicio.add_argument("--puerto", type=int, default=8765, help="Puerto HTTP")
+    servicio.add_argument("-p", "--procesos", type=int, default=2,
+                          help="Procesos de trabajo para leer y clasificar")
+    servicio.add_argument("--resultados", type=int, default=16,
+                          help="Resultados en memoria (LRU por hash del archivo)")
+    servicio.add_argument("--max-mb", type=float, default=512, help="Tamaño máximo por archivo subido")
+    servicio.add_argument("--inicio-semana", type=_inicio_semana, default=None,
+                          help="Día de inicio de las semanas del mes (lunes ... domingo)")
+    servicio.add_argument("--reglas", default=None, help="Reglas de clasificación (.json o .yaml)")
+    for subcomando in (lote, bloques, backtest, vigilar, servicio):
+        subcomando.add_argument("--tipos-cambio", default=None,
+                                help="Tabla de tipos de cambio (.csv o .xlsx: moneda, fecha, tasa)")
+        subcomando.add_argument("--moneda-reporte", default=None,
+                                help=f"Moneda a la que se convierten los montos con --tipos-cambio "
+                                     f"(por defecto {TiposCambio.MONEDA_REPORTE})")
+    
+    args = parser.parse_args(argv)
+    if args.comando == "servicio":
+        try:
+            reglas = ReglasClasificacion.cargar(args.reglas) if args.reglas else None
+            tipos_cambio = _cargar_tipos_cambio(args)
+        except ErrorReglas as e:
+            print(f"❌ Reglas inválidas: {e}")
+            return ProcesadorLote.CODIGO_ERROR_PROCESO
+        except ErrorTiposCambio as e:
+            print(f"❌ {e}")
+            return ProcesadorLote.CODIGO_ERROR_PROCESO
+        try:
+            asyncio.run(ServicioARPC(args.host, args.puerto, args.procesos, args.resultados,
+                                     args.max_mb, args.inicio_semana, reglas, tipos_cambio).servir())
+        except KeyboardInterrupt:
+            print("\n   👋 Servicio detenido")
+        return ProcesadorLote.CODIGO_OK
+    if args.comando == "historial":
+        return _consultar_historial(args)
+    if args.comando == "backtest":
+        return _ejecutar_backtest(args, parser)
+    if args.comando == "vigilar":
+        return _vigilar_carpeta(args)
+    perfilar = [e.strip().lower() for e in args.perfilar.split(",") if e.strip()]
+    desconocidas = [e for e in perfilar if e not in MetricasProceso.ETAPAS and e != 'todas']
+    if desconocidas:
+        parser.error(f"Etapas a perfilar desconocidas: {', '.join(desconocidas)} "
+                     f"(válidas: {', '.join(MetricasProceso.ETAPAS)} o 'todas')")
+    inicio = datetime.now()
+    mes_reporte = args.mes or datetime(inicio.year, inicio.month, 1)
+    try:
+        reglas = ReglasClasificacion.cargar(args.reglas) if args.reglas else None
+        tipos_cambio = _cargar_tipos_cambio(args)
+    except ErrorReglas as e:
+        print(f"❌ Reglas inválidas: {e}")
+        return ProcesadorLote.CODIGO_ERROR_PROCESO
+    except ErrorTiposCambio as e:
+        print(f"❌ {e}")
+        return ProcesadorLote.CODIGO_ERROR_PROCESO
+    
+    if args.comando == "bloques":
+        procesador = ProcesadorPorBloques(mes_reporte, args.filas, inicio_semana=args.inicio_semana,
+                                          reglas=reglas, tipos_cambio=tipos_cambio)
+        procesador.historial = HistorialARPC(args.historial) if args.historial else None
+        procesador.metricas = MetricasProceso(
+            perfilar, args.perfilador, os.path.join(os.path.dirname(os.path.abspath(args.salida)), "perfiles"),
+            prefijo=os.path.basename(args.entrada).replace(".", "_")
+        )
+        try:
+            procesador.procesar(args.entrada, args.salida)
+            if args.metricas:
+                procesador.metricas.guardar(args.metricas, {
+                    'archivo': os.path.basename(args.entrada), 'mes': mes_reporte.strftime("%Y-%m")
+                })
+            return ProcesadorLote.CODIGO_OK
+        except FileNotFoundError as e:
+            print(f"❌ Archivo no encontrado: {e}")
+            return ProcesadorLote.CODIGO_NO_ENCONTRADO
+        except Exception as e:
+            print(f"❌ Error en procesamiento: {e}")
+            return ProcesadorLote.CODIGO_ERROR_PROCESO
+    
+    archivos = ProcesadorLote.expandir_entradas(args.entradas)
+    if not archivos:
+        print("❌ Ningún archivo coincide con las entradas indicadas")
+        return ProcesadorLote.CODIGO_NO_ENCONTRADO
+    
+    procesador_lote = ProcesadorLote(
+        args.salida, mes_reporte, usar_cache=not args.sin_cache,
+        procesos=args.procesos, generar_reportes=not args.sin_reportes,
+        formatos_adicionales=[f.strip().lower() for f in args.formatos.split(",") if f.strip()],
+        perfilar=perfilar, perfilador=args.perfilador, directorio_incremental=args.incremental,
+        inicio_semana=args.inicio_semana, reglas=reglas, historial=args.historial, tipos_cambio=tipos_cambio
+    )
+    procesador_lote.ejecutar(archivos)
+    if args.consolidado and not procesador_lote.exportar_consolidado(args.consolidado):
+        procesador_lote.resultados.append({
+            'archivo': args.consolidado, 'salida': None,
+            'codigo': ProcesadorLote.CODIGO_ERROR_EXPORTACION, 'estado': 'ERROR_CONSOLIDADO',
+            'mensaje': 'Sin datos para consolidar'
+        })
+    procesador_lote.escribir_resumen(
+        args.resumen or os.path.join(args.salida, "resumen_lote.json"), inicio
+    )
+    if args.metricas:
+        procesador_lote.escribir_metricas(args.metricas)
+    
+    for resultado in procesador_lote.resultados:
+        icono = "✅" if resultado['codigo'] == ProcesadorLote.CODIGO_OK else "❌"
+        print(f"   {icono} [{resultado['codigo']}] {resultado['archivo']} ({resultado['estado']})")
+    return procesador_lote.codigo_salida()
+
 # ==================== INTERFAZ DE USUARIO ====================
+class DialogosArchivo:
+    # Una sola raíz Tk oculta para todos los diálogos, creada en el primer uso.
+    # Sin tkinter o sin pantalla la ruta se pide por consola
+    _raiz = None
+    _sin_tk = False
+    
+    @classmethod
+    def _obtener_raiz(cls):
+        if cls._raiz is None and not cls._sin_tk:
+            try:
+                import tkinter as tk
+                cls._raiz = tk.Tk()
+                cls._raiz.withdraw()
+            except Exception:
+                cls._sin_tk = True
+        return cls._raiz
+    
+    @staticmethod
+    def _por_consola(titulo: str) -> str:
+        return input(f"   {titulo} (ruta, Enter para cancelar): ").strip().strip('"')
+    
+    @classmethod
+    def abrir(cls, **opciones) -> str:
+        raiz = cls._obtener_raiz()
+        if raiz is None:
+            return cls._por_consola(opciones.get('title', 'Archivo'))
+        from tkinter import filedialog
+        return filedialog.askopenfilename(parent=raiz, **opciones)
+    
+    @classmethod
+    def guardar(cls, **opciones) -> str:
+        raiz = cls._obtener_raiz()
+        if raiz is None:
+            ruta = cls._por_consola(opciones.get('title', 'Guardar'))
+            return ruta or ""
+        from tkinter import filedialog
+        return filedialog.asksaveasfilename(parent=raiz, **opciones)
+
 # DESARROLLADOR: Carlos García - Interfaz y sistema principal
 class SistemaARPC:
     @staticmethod
@@ -572,21 +4608,48 @@ class SistemaARPC:
         print("   [1] 📂 CARGAR Y PROCESAR ARCHIVO SAP")
         print("   [2] 📊 VER REPORTE DE PROYECCIONES")
         print("   [3] 📈 EXPORTAR REPORTE A EXCEL")
-        print("   [4] 🚪 SALIR DEL SISTEMA")
+        print("   [4] 🔎 DETALLE DE DOCUMENTOS")
+        print("   [5] ♻️  REABRIR ÚLTIMA EJECUCIÓN")
+        print("   [6] 🚪 SALIR DEL SISTEMA")
         print("─"*60)
         
         while True:
-            opcion = input("\n   🎯 Seleccione [1-4]: ").strip()
-            if opcion in ["1", "2", "3", "4"]:
+            opcion = input("\n   🎯 Seleccione [1-6]: ").strip()
+            if opcion in ["1", "2", "3", "4", "5", "6"]:
                 return opcion
             print("   ❌ Opción inválida")
 
 # ==================== MAIN ====================
-def main():
+def _opciones_menu(argv: List[str]) -> Optional[argparse.Namespace]:
+    # Opciones del menú interactivo; None si argv es un subcomando (o --help) de ejecutar_cli
+    if any(a in ("-h", "--help") for a in argv) or (argv and not argv[0].startswith("-")):
+        return None
+    parser = argparse.ArgumentParser(prog="main.py", description="Sistema ARPC - menú interactivo")
+    parser.add_argument("--reabrir", action="store_true",
+                        help="Abrir el menú con la última ejecución ya restaurada")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    opciones = _opciones_menu(argv)
+    if opciones is None:
+        return ejecutar_cli(argv)
+    
     SistemaARPC.mostrar_inicio()
     
     procesador = ProcesadorARPC()
-    datos_procesados = False
+    if os.environ.get("ARPC_SIN_HISTORIAL", "") != "1":
+        procesador.historial = HistorialARPC()
+    if InstantaneaARPC.disponible() and os.environ.get("ARPC_SIN_INSTANTANEA", "") != "1":
+        procesador.instantanea = InstantaneaARPC()
+    if os.environ.get("ARPC_TIPOS_CAMBIO"):
+        try:
+            procesador.tipos_cambio = TiposCambio.cargar(os.environ["ARPC_TIPOS_CAMBIO"],
+                                                         os.environ.get("ARPC_MONEDA_REPORTE"))
+        except ErrorTiposCambio as e:
+            print(f"⚠️  {e} (montos sin convertir)")
+    datos_procesados = opciones.reabrir and procesador.reabrir_ultima_ejecucion()
     
     while True:
         try:
@@ -604,22 +4667,32 @@ def main():
                 if datos_procesados:
                     procesador.mostrar_reporte_proyecciones()
                 else:
-                    print("\n⚠️  Primero procese un archivo (Opción 1)")
+                    print("\n⚠️  Primero procese un archivo (Opción 1) o reabra la última ejecución (Opción 5)")
             
             elif opcion == "3":
                 if datos_procesados:
                     procesador.exportar_reporte_completo()
                 else:
-                    print("\n⚠️  Primero procese un archivo (Opción 1)")
+                    print("\n⚠️  Primero procese un archivo (Opción 1) o reabra la última ejecución (Opción 5)")
             
             elif opcion == "4":
+                if datos_procesados:
+                    procesador.mostrar_detalle_documentos()
+                else:
+                    print("\n⚠️  Primero procese un archivo (Opción 1) o reabra la última ejecución (Opción 5)")
+            
+            elif opcion == "5":
+                if procesador.reabrir_ultima_ejecucion():
+                    datos_procesados = True
+            
+            elif opcion == "6":
                 print("\n" + "👋"*30)
                 print("   ¡GRACIAS POR USAR EL SISTEMA ARPC!")
                 print("   Soltrak - Automatización Inteligente de Cobranzas")
                 print("👋"*30)
-                break
+                return 0
             
-            if opcion != "4":
+            if opcion != "6":
                 input("\n   📌 Presione Enter para continuar...")
                 
         except KeyboardInterrupt:
@@ -630,4 +4703,4 @@ def main():
             continue
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Los módulos del sistema se importan como en `python src/main.py` (main, benchmark)
+DIRECTORIO_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, DIRECTORIO_SRC)
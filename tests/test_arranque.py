@@ -0,0 +1,40 @@
+"""
+Arranque: `import main` y `main.py --help` no cargan pandas, numpy ni tkinter
+"""
+
+import json
+import subprocess
+import sys
+
+from conftest import DIRECTORIO_SRC
+
+MODULOS_PESADOS = ['pandas', 'numpy', 'tkinter']
+
+
+def _ejecutar(codigo: str) -> dict:
+    # Proceso nuevo (sys.modules limpio); la última línea de la salida es el resultado en JSON
+    proceso = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True,
+                             cwd=DIRECTORIO_SRC, timeout=120)
+    assert proceso.returncode == 0, proceso.stderr
+    return json.loads(proceso.stdout.strip().splitlines()[-1])
+
+
+def _cargados() -> str:
+    return f"print(json.dumps([m for m in {MODULOS_PESADOS!r} if m in sys.modules]))"
+
+
+def test_import_no_carga_modulos_pesados():
+    assert _ejecutar(f"import sys, json\nimport main\n{_cargados()}") == []
+
+
+def test_ayuda_no_carga_modulos_pesados():
+    codigo = (f"import sys, json\nimport main\n"
+              f"try:\n    main.main(['--help'])\nexcept SystemExit:\n    pass\n{_cargados()}")
+    assert _ejecutar(codigo) == []
+
+
+def test_import_sin_tkinter():
+    # Sin tkinter (p. ej. Python sin Tk en un servidor) el módulo importa y los diálogos van por consola
+    codigo = ("import sys, json\nsys.modules['tkinter'] = None\nimport main\n"
+              "print(json.dumps(main.DialogosArchivo._obtener_raiz() is None))")
+    assert _ejecutar(codigo) is True
@@ -0,0 +1,98 @@
+"""
+ClasificadorVectorizado frente a DocumentoSAP (clasificación fila a fila): mismos resultados
+"""
+
+import itertools
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import CalendarioMes, ClasificadorVectorizado, DocumentoSAP
+
+MES_REPORTE = datetime(2025, 11, 1)
+CDS = ['DR', 'DL', 'DZ']
+# Bordes de tramos, estatus y semanas por mora, además de vacíos y texto no numérico
+MORAS = [-15, 0, 1, 7, 8, 28, 29, 30, 31, 60, 61, 90, 91, 180, 181, 360, 361, None, 'x', '45']
+FECHAS = ['01/11/2025', '08/11/2025', '30/11/2025', '15/10/2025', '05/12/2025', None, 'malo']
+REFERENCIAS = ['L123', '', None]
+BASES = ['25/10/2025', None]
+
+
+def _exportacion() -> pd.DataFrame:
+    # 2,520 filas: todas las combinaciones de CD, mora, fechas y referencia de letra
+    filas = []
+    combinaciones = itertools.product(CDS, MORAS, FECHAS, BASES, REFERENCIAS)
+    for i, (cd, mora, fecha, base, referencia) in enumerate(combinaciones):
+        filas.append({
+            'CD': cd, 'Mora': mora, 'Sectorista': ['ANA TORRES', None, ''][i % 3],
+            'Imp. ML2 Pend.': [1500.5, None, -20.0, '300'][i % 4],
+            'Vencimiento neto': fecha, 'Base p.plazo pago': base or fecha,
+            'Ref. Letra': referencia, 'Clv.ref.(cabecera) 2': f"R{i}"
+        })
+    return pd.DataFrame(filas)
+
+
+@pytest.mark.parametrize('inicio_semana', [None, 0, 6])
+def test_paridad_con_documento_sap(inicio_semana):
+    df = _exportacion()
+    clasificacion = ClasificadorVectorizado(MES_REPORTE, inicio_semana).clasificar(df)
+    
+    esperado = []
+    for _, fila in df.iterrows():
+        documento = DocumentoSAP(fila, MES_REPORTE, inicio_semana)
+        esperado.append((documento.tramo, documento.estatus, documento.proyeccion,
+                         documento._es_valido_para_procesar(), documento.dias_mora, documento.monto))
+    obtenido = list(zip(clasificacion['TRAMO'], clasificacion['ESTATUS 1'], clasificacion['PROYECCIÓN'],
+                        clasificacion['ES_VALIDO'].tolist(), clasificacion['DIAS_MORA'].tolist(),
+                        clasificacion['MONTO'].tolist()))
+    
+    assert len(df) == 2520
+    diferencias = [(i, e, o) for i, (e, o) in enumerate(zip(esperado, obtenido)) if e != o]
+    assert diferencias == []
+
+
+def test_columnas_de_texto_y_categoricas():
+    # Las columnas categóricas (LectorSAP) se convierten por valor distinto con el mismo resultado
+    df = _exportacion()
+    categorico = df.astype({'CD': 'category', 'Sectorista': 'category', 'Ref. Letra': 'category'})
+    clasificador = ClasificadorVectorizado(MES_REPORTE)
+    pd.testing.assert_frame_equal(clasificador.clasificar(df), clasificador.clasificar(categorico))
+
+
+def test_sin_columnas_opcionales():
+    df = pd.DataFrame({'CD': ['DR', 'DL'], 'Mora': [10, 10]})
+    clasificacion = ClasificadorVectorizado(MES_REPORTE).clasificar(df)
+    assert clasificacion['SECTORISTA'].tolist() == ['SIN GESTOR', 'SIN GESTOR']
+    assert np.array_equal(clasificacion['ES_VALIDO'].to_numpy(), [True, False])
+    assert clasificacion['PROYECCIÓN'].tolist() == ['SEMANA_2', 'NO_PROCESAR']
+
+
+def _semana_fija(dia: int, desde: int) -> str:
+    # Bloques fijos de 7 días (1-7, 8-14, 15-21, 22-28, 29+) desde SEMANA_<desde>, tope SEMANA_5
+    return f"SEMANA_{min(desde + (min(dia, 29) - 1) // 7, 5)}"
+
+
+@pytest.mark.parametrize('mes_reporte', [datetime(2026, 2, 1), datetime(2024, 2, 1), datetime(2025, 1, 1)])
+def test_bloques_fijos_por_defecto(mes_reporte):
+    # Sin inicio de semana: cinco semanas en meses de 28, 29 y 31 días, con el día 29+ en SEMANA_5
+    calendario = CalendarioMes(mes_reporte)
+    assert calendario.semanas == 5
+    assert calendario.etiquetas.tolist() == [f"SEMANA_{i}" for i in range(1, 6)]
+    
+    filas, esperado = [], []
+    for dia in range(1, calendario.dias + 1):
+        fecha = mes_reporte.replace(day=dia)
+        filas.append({'CD': 'DR', 'Mora': 0, 'Vencimiento neto': fecha.strftime("%d/%m/%Y")})
+        esperado.append(_semana_fija(dia, 2))
+        filas.append({'CD': 'DL', 'Mora': 0, 'Ref. Letra': 'L1',
+                      'Base p.plazo pago': (fecha - timedelta(days=8)).strftime("%d/%m/%Y")})
+        esperado.append(_semana_fija(dia, 1))
+    filas.append({'CD': 'DR', 'Mora': 29})
+    esperado.append("SEMANA_5")
+    df = pd.DataFrame(filas).assign(**{'Sectorista': 'ANA TORRES', 'Imp. ML2 Pend.': 100.0})
+    
+    clasificacion = ClasificadorVectorizado(mes_reporte).clasificar(df)
+    assert clasificacion['PROYECCIÓN'].tolist() == esperado
+    assert [DocumentoSAP(fila, mes_reporte).proyeccion for _, fila in df.iterrows()] == esperado
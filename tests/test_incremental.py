@@ -0,0 +1,65 @@
+"""
+EstadoIncremental: solo se reclasifican las filas nuevas o modificadas y las tablas no cambian
+"""
+
+import contextlib
+import io
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from benchmark import GeneradorSAPSintetico
+from main import EstadoIncremental, ProcesadorARPC
+
+MES_REPORTE = datetime(2025, 11, 1)
+
+
+@pytest.fixture
+def exportacion(tmp_path):
+    ruta = tmp_path / "SAP.csv"
+    GeneradorSAPSintetico(MES_REPORTE).escribir(3000, str(ruta))
+    return ruta
+
+
+def _procesar(ruta, directorio_estado=None) -> ProcesadorARPC:
+    procesador = ProcesadorARPC(usar_cache=False)
+    procesador.mes_reporte = MES_REPORTE
+    if directorio_estado is not None:
+        procesador.incremental = EstadoIncremental(str(directorio_estado))
+    with contextlib.redirect_stdout(io.StringIO()):
+        procesador.cargar_archivo(str(ruta))
+        assert procesador.cargar_y_procesar()
+    return procesador
+
+
+def test_mismo_archivo_dos_veces(exportacion, tmp_path):
+    primera = _procesar(exportacion, tmp_path / "estado")
+    segunda = _procesar(exportacion, tmp_path / "estado")
+    
+    assert primera.incremental.resumen['estado_previo'] is False
+    resumen = segunda.incremental.resumen
+    assert resumen['estado_previo'] is True
+    assert (resumen['nuevas'], resumen['modificadas'], resumen['eliminadas']) == (0, 0, 0)
+    assert resumen['sin_cambios'] == primera.incremental.resumen['nuevas']
+    pd.testing.assert_frame_equal(primera.generador_tablas.tabla_proyecciones,
+                                  segunda.generador_tablas.tabla_proyecciones)
+    pd.testing.assert_frame_equal(primera.generador_tablas.tabla_cd, segunda.generador_tablas.tabla_cd)
+
+
+def test_fila_modificada_igual_a_proceso_completo(exportacion, tmp_path):
+    _procesar(exportacion, tmp_path / "estado")
+    df = pd.read_csv(exportacion, dtype=str)
+    fila = df.index[df['CD'] == 'DR'][0]
+    df.loc[fila, 'Mora'] = '400'
+    df = df.drop(index=df.index[df['CD'] == 'DR'][1])
+    df.to_csv(exportacion, index=False)
+    
+    incremental = _procesar(exportacion, tmp_path / "estado")
+    completo = _procesar(exportacion)
+    
+    resumen = incremental.incremental.resumen
+    assert (resumen['nuevas'], resumen['modificadas'], resumen['eliminadas']) == (0, 1, 1)
+    assert incremental.gestor.obtener_estadisticas() == pytest.approx(completo.gestor.obtener_estadisticas())
+    pd.testing.assert_frame_equal(incremental.generador_tablas.tabla_proyecciones,
+                                  completo.generador_tablas.tabla_proyecciones)
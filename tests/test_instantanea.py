@@ -0,0 +1,83 @@
+"""
+InstantaneaARPC: reabrir la última ejecución da el mismo cubo y procesar después no la acumula
+"""
+
+import contextlib
+import io
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from benchmark import GeneradorSAPSintetico
+from main import InstantaneaARPC, ProcesadorARPC
+
+pytest.importorskip('pyarrow')
+
+MES_REPORTE = datetime(2025, 11, 1)
+MES_ANTERIOR = datetime(2025, 10, 1)
+
+
+@pytest.fixture
+def exportacion(tmp_path):
+    ruta = tmp_path / "SAP.csv"
+    GeneradorSAPSintetico(MES_REPORTE).escribir(2000, str(ruta))
+    return ruta
+
+
+def _procesador(directorio, mes_reporte, inicio_semana=None) -> ProcesadorARPC:
+    procesador = ProcesadorARPC(usar_cache=False)
+    procesador.mes_reporte = mes_reporte
+    procesador.inicio_semana = inicio_semana
+    procesador.instantanea = InstantaneaARPC(str(directorio))
+    return procesador
+
+
+def _procesar(procesador, ruta):
+    with contextlib.redirect_stdout(io.StringIO()):
+        procesador.cargar_archivo(str(ruta))
+        assert procesador.cargar_y_procesar()
+
+
+def _reabrir(procesador):
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert procesador.reabrir_ultima_ejecucion()
+
+
+def test_guardar_y_reabrir_mismo_cubo(exportacion, tmp_path):
+    original = _procesador(tmp_path / "instantanea", MES_REPORTE, 0)
+    _procesar(original, exportacion)
+    
+    reabierto = _procesador(tmp_path / "instantanea", MES_ANTERIOR)
+    _reabrir(reabierto)
+    
+    assert len(reabierto.gestor) == len(original.gestor)
+    assert reabierto.mes_reporte == MES_REPORTE
+    assert reabierto.inicio_semana == 0
+    # Las claves vuelven como objetos (None en vez de NaN): se comparan valores, no dtypes
+    pd.testing.assert_frame_equal(reabierto.gestor.obtener_cubo().reset_index(drop=True),
+                                  original.gestor.obtener_cubo().reset_index(drop=True), check_dtype=False)
+    pd.testing.assert_frame_equal(reabierto.generador_tablas.tabla_proyecciones,
+                                  original.generador_tablas.tabla_proyecciones)
+
+
+def test_reabrir_y_procesar_no_acumula(exportacion, tmp_path):
+    _procesar(_procesador(tmp_path / "instantanea", MES_ANTERIOR, 0), exportacion)
+    
+    procesador = _procesador(tmp_path / "instantanea", MES_REPORTE)
+    _reabrir(procesador)
+    _procesar(procesador, exportacion)
+    
+    # Mes e inicio de semana de la sesión, no los de la ejecución reabierta
+    nuevo = _procesador(tmp_path / "nuevo", MES_REPORTE)
+    _procesar(nuevo, exportacion)
+    assert procesador.mes_reporte == MES_REPORTE
+    assert procesador.inicio_semana is None
+    assert len(procesador.gestor) == len(nuevo.gestor)
+    pd.testing.assert_frame_equal(procesador.gestor.obtener_cubo(), nuevo.gestor.obtener_cubo())
+    
+    # La instantánea guardada de nuevo es la del archivo recién procesado
+    reabierto = _procesador(tmp_path / "instantanea", MES_ANTERIOR)
+    _reabrir(reabierto)
+    assert len(reabierto.gestor) == len(nuevo.gestor)
+    assert reabierto.mes_reporte == MES_REPORTE
@@ -0,0 +1,81 @@
+"""
+ReglasClasificacion: validación de las tablas de rangos y carga desde archivo
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from main import ErrorReglas, ReglasClasificacion
+
+TRAMOS_VALIDOS = [
+    {'hasta': 0, 'etiqueta': "Por Vencer"},
+    {'desde': 1, 'hasta': 45, 'etiqueta': "1 a 45"},
+    {'desde': 46, 'etiqueta': "45+"}
+]
+
+
+def _reglas(**tablas) -> ReglasClasificacion:
+    return ReglasClasificacion({'por_defecto': tablas})
+
+
+@pytest.mark.parametrize('tramos, mensaje', [
+    ([], "no tiene rangos"),
+    ([{'hasta': 0, 'etiqueta': "A"}, {'desde': 1}], "sin etiqueta"),
+    ([{'hasta': 0, 'etiqueta': "A"}, {'desde': 10, 'hasta': 5, 'etiqueta': "B"}, {'desde': 11, 'etiqueta': "C"}],
+     "rango invertido"),
+    ([{'desde': 0, 'hasta': 10, 'etiqueta': "A"}, {'desde': 11, 'etiqueta': "B"}], "hueco antes de 0"),
+    ([{'hasta': 10, 'etiqueta': "A"}, {'desde': 11, 'hasta': 20, 'etiqueta': "B"}], "hueco después de 20"),
+    ([{'hasta': 10, 'etiqueta': "A"}, {'desde': 10, 'etiqueta': "B"}], "se superponen"),
+    ([{'hasta': 10, 'etiqueta': "A"}, {'desde': 15, 'etiqueta': "B"}], "hueco entre 10 y 15"),
+])
+def test_tramos_invalidos(tramos, mensaje):
+    with pytest.raises(ErrorReglas, match=mensaje):
+        _reglas(tramos=tramos)
+
+
+def test_estatus_sin_proyectado():
+    with pytest.raises(ErrorReglas, match="falta el estatus PROYECTADO"):
+        _reglas(estatus=[{'hasta': 0, 'etiqueta': "POR VENCER"}, {'desde': 1, 'etiqueta': "EN GESTIÓN"}])
+
+
+def test_semanas_con_etiqueta_invalida():
+    with pytest.raises(ErrorReglas, match="etiquetas no válidas"):
+        _reglas(semanas_mora=[{'hasta': 7, 'etiqueta': "SEMANA_1"}, {'desde': 8, 'etiqueta': "SEMANA_9"}])
+
+
+def test_unidades_sin_columna_unidad():
+    with pytest.raises(ErrorReglas, match="falta 'columna_unidad'"):
+        ReglasClasificacion({'unidades': {'2000': {'dias_base_dl': 15}}})
+
+
+def test_cargar_archivo_invalido(tmp_path):
+    ruta = tmp_path / "reglas.json"
+    ruta.write_text("[1, 2]", encoding='utf-8')
+    with pytest.raises(ErrorReglas, match="se esperaba un objeto"):
+        ReglasClasificacion.cargar(str(ruta))
+    ruta.write_text("{no es json", encoding='utf-8')
+    with pytest.raises(ErrorReglas, match="No se pudieron leer"):
+        ReglasClasificacion.cargar(str(ruta))
+    with pytest.raises(ErrorReglas, match="No se pudieron leer"):
+        ReglasClasificacion.cargar(str(tmp_path / "no_existe.json"))
+
+
+def test_reglas_validas_y_herencia(tmp_path):
+    ruta = tmp_path / "reglas.json"
+    ruta.write_text(json.dumps({
+        'columna_unidad': 'SOCIEDAD',
+        'por_defecto': {'tramos': TRAMOS_VALIDOS},
+        'unidades': {'2000': {'dias_base_dl': 15}}
+    }), encoding='utf-8')
+    reglas = ReglasClasificacion.cargar(str(ruta))
+    
+    assert reglas.conjunto().tramos.clasificar(np.array([-3, 0, 1, 45, 46])).tolist() == [
+        "Por Vencer", "Por Vencer", "1 a 45", "1 a 45", "45+"
+    ]
+    # La unidad hereda los tramos de por_defecto; una unidad desconocida usa por_defecto
+    assert reglas.conjunto('2000').tramos.clasificar(46) == "45+"
+    assert reglas.conjunto('2000').dias_base_dl == 15
+    assert reglas.conjunto('9999').dias_base_dl == ReglasClasificacion.POR_DEFECTO['dias_base_dl']
+    assert reglas.firma() != ReglasClasificacion().firma()
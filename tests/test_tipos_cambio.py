@@ -0,0 +1,101 @@
+"""
+TiposCambio: tasa vigente por fecha ("as of"), respaldo al mes de reporte y carga de la tabla
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import ClasificadorVectorizado, ErrorTiposCambio, TiposCambio
+
+
+@pytest.fixture
+def tipos_cambio() -> TiposCambio:
+    return TiposCambio(pd.DataFrame({
+        'MONEDA': ['PEN', 'PEN', 'EUR'],
+        'FECHA': pd.to_datetime(['2025-10-01', '2025-11-15', '2025-11-20']),
+        'TASA': [0.27, 0.25, 1.08]
+    }), 'USD')
+
+
+def _monedas(*codigos) -> np.ndarray:
+    return np.array(codigos, dtype=object)
+
+
+@pytest.mark.parametrize('fecha, esperada', [
+    (datetime(2025, 9, 30), np.nan),     # antes de la primera tasa
+    (datetime(2025, 10, 1), 0.27),       # el mismo día en que entra en vigencia
+    (datetime(2025, 11, 14), 0.27),      # un día antes del cambio
+    (datetime(2025, 11, 15), 0.25),
+    (datetime(2026, 1, 1), 0.25),        # después de la última tasa
+])
+def test_tasa_vigente_en_los_bordes(tipos_cambio, fecha, esperada):
+    tasa = tipos_cambio.tasas_vigentes(_monedas('PEN'), fecha)
+    np.testing.assert_array_equal(tasa, [esperada])
+
+
+def test_una_fecha_por_fila(tipos_cambio):
+    fechas = pd.to_datetime(['2025-10-15', '2025-11-15', '2025-09-01']).to_numpy()
+    tasa = tipos_cambio.tasas_vigentes(_monedas('PEN', 'PEN', 'PEN'), fechas)
+    np.testing.assert_array_equal(tasa, [0.27, 0.25, np.nan])
+
+
+def test_moneda_de_reporte_y_sin_tasa(tipos_cambio):
+    tasa = tipos_cambio.tasas_vigentes(_monedas('USD', 'GBP', 'EUR'), datetime(2025, 11, 1))
+    np.testing.assert_array_equal(tasa, [1.0, np.nan, np.nan])
+
+
+def test_respaldo_a_la_primera_tasa_del_mes(tipos_cambio):
+    # EUR solo tiene tasa desde el 20/11: al 01/11 se usa esa, pero no la de un mes posterior
+    noviembre = datetime(2025, 11, 1)
+    tasa = tipos_cambio.tasas_vigentes(_monedas('EUR'), noviembre, TiposCambio.fin_de_mes(noviembre))
+    np.testing.assert_array_equal(tasa, [1.08])
+    octubre = datetime(2025, 10, 1)
+    tasa = tipos_cambio.tasas_vigentes(_monedas('EUR'), octubre, TiposCambio.fin_de_mes(octubre))
+    np.testing.assert_array_equal(tasa, [np.nan])
+
+
+def test_convertir(tipos_cambio):
+    monto, sin_tasa = tipos_cambio.convertir(_monedas('PEN', 'USD', 'GBP'), np.array([100.0, 50.0, 10.0]),
+                                             datetime(2025, 11, 15))
+    np.testing.assert_allclose(monto, [25.0, 50.0, 0.0])
+    assert sin_tasa.tolist() == [False, False, True]
+
+
+def test_sin_tabla_no_convierte():
+    monto, sin_tasa = TiposCambio().convertir(_monedas('PEN', None), np.array([100.0, 5.0]), datetime(2025, 11, 1))
+    np.testing.assert_array_equal(monto, [100.0, 5.0])
+    assert not sin_tasa.any()
+
+
+def test_clasificador_marca_sin_tasa(tipos_cambio):
+    df = pd.DataFrame({'CD': ['DR', 'DR', 'DR'], 'Mora': [5, 5, 5], 'Imp. ML2 Pend.': [100.0, 100.0, 100.0],
+                       'Moneda': ['pen', 'GBP', None]})
+    clasificacion = ClasificadorVectorizado(datetime(2025, 11, 1), tipos_cambio=tipos_cambio).clasificar(df)
+    assert clasificacion['MONEDA'].tolist() == ['PEN', 'GBP', 'USD']
+    np.testing.assert_allclose(clasificacion['MONTO'], [27.0, 0.0, 100.0])
+    resumen = ClasificadorVectorizado.resumen_sin_tasa(clasificacion)
+    assert resumen.loc['GBP', 'DOCUMENTOS'] == 1 and resumen.loc['GBP', 'MONTO_ORIGEN'] == 100.0
+
+
+def test_cargar(tmp_path):
+    ruta = tmp_path / "tipos_cambio.csv"
+    ruta.write_text("Moneda;Fecha;Tasa\npen;01/11/2025;0.25\nEUR;2025-11-01;1.08\n", encoding='utf-8')
+    tabla = TiposCambio.cargar(str(ruta))
+    assert tabla.moneda_reporte == TiposCambio.MONEDA_REPORTE
+    np.testing.assert_array_equal(tabla.tasas_vigentes(_monedas('PEN', 'EUR'), datetime(2025, 11, 1)), [0.25, 1.08])
+
+
+@pytest.mark.parametrize('contenido, mensaje', [
+    ("moneda,tasa\nPEN,0.25\n", "Faltan columnas"),
+    ("moneda,fecha,tasa\nPEN,01/11/2025,-1\n", "inválida en las filas 2"),
+    ("moneda,fecha,tasa\nPEN,no es fecha,0.25\n", "inválida en las filas 2"),
+    ("moneda,fecha,tasa\nPEN,01/11/2025,0.25\nPEN,2025-11-01,0.26\n", "más de una tasa"),
+])
+def test_cargar_tabla_invalida(tmp_path, contenido, mensaje):
+    ruta = tmp_path / "tipos_cambio.csv"
+    ruta.write_text(contenido, encoding='utf-8')
+    with pytest.raises(ErrorTiposCambio, match=mensaje):
+        TiposCambio.cargar(str(ruta))